@@ -10,8 +10,11 @@ Public API principles:
 """
 
 from ._version import __version__
-from .database import CarlosDatabase, load_database
-from .types import CarlosVector, IndexingResult, RetrievalResult
+from .database import CarlosDatabase, convert_to_columnar, load_database
+from .filters import col
+from .types import CarlosVector, IndexingResult, RetrievalResult, VectorMatrix
+from .vector_search import retrieve_by_vector, retrieve_many_by_vector
+from .startup import warmup
 from .bundled_db import copy_bundled_database, load_bundled_database
 
 __all__ = [
@@ -20,17 +23,28 @@ __all__ = [
     "CarlosVector",
     "IndexingResult",
     "RetrievalResult",
+    "VectorMatrix",
     "load_database",
+    "convert_to_columnar",
+    "col",
     "load_bundled_database",
     "copy_bundled_database",
     "index_lora",
     "retrieve",
+    "retrieve_many",
+    "retrieve_by_vector",
+    "retrieve_many_by_vector",
+    "warmup",
 ]
-# Lazy import: indexing pulls heavy GPU-only dependencies
+# Lazy import: indexing and text retrieval pull in torch / transformers
 def index_lora(*args, **kwargs):
     from .index import index_lora as _index_lora
     return _index_lora(*args, **kwargs)
 
 def retrieve(*args, **kwargs):
     from .retrieve import retrieve as _retrieve
-    return _retrieve(*args, **kwargs)
\ No newline at end of file
+    return _retrieve(*args, **kwargs)
+
+def retrieve_many(*args, **kwargs):
+    from .retrieve import retrieve_many as _retrieve_many
+    return _retrieve_many(*args, **kwargs)
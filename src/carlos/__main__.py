@@ -0,0 +1,92 @@
+# src/carlos/__main__.py
+"""
+Command line entry point: `carlos <command>` / `python -m carlos <command>`.
+
+  carlos serve [--db PATH] [--host HOST] [--port PORT] [--query-mode exact|fast] ...
+  carlos cold-start [--db PATH] [--device DEVICE] [--query-mode exact|fast] [--json]
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+from typing import List, Optional
+
+
+def _serve(args: argparse.Namespace) -> None:
+    from .bundled_db import load_bundled_database
+    from .config import RetrievalConfig
+    from .database import load_database
+    from .serve import serve
+
+    db = load_database(args.db) if args.db else load_bundled_database()
+    serve(
+        db,
+        host=args.host,
+        port=args.port,
+        cfg=RetrievalConfig(device=args.device, local_files_only=args.local_files_only),
+        query_mode=args.query_mode,
+        fake_encoder=args.fake_encoder,
+        workers=args.workers,
+        max_pending=args.max_pending,
+        timeout_s=args.timeout,
+    )
+
+
+def _cold_start(args: argparse.Namespace) -> None:
+    # Run in a fresh process: nothing below has been imported or loaded yet.
+    start = time.perf_counter()
+    from .bundled_db import load_bundled_database
+    from .config import RetrievalConfig
+    from .database import load_database
+    from .startup import WarmupReport, warmup
+
+    db = load_database(args.db) if args.db else load_bundled_database()
+    db_load = time.perf_counter() - start
+    cfg = RetrievalConfig(device=args.device, warmup=not args.no_encoder_warmup, local_files_only=args.local_files_only)
+    report = warmup(db, cfg, query_mode=args.query_mode, query=args.query)
+    stages = dict(db_load=db_load, **report.stages)
+    if args.json:
+        print(json.dumps(dict(device=report.device, query_mode=report.query_mode, stages_s=stages,
+                              time_to_first_result_s=sum(stages.values()))))
+    else:
+        print(WarmupReport(stages=stages, device=report.device, query_mode=report.query_mode).format())
+        print(f"time to first result: {sum(stages.values()):.2f} s ({report.device}, {report.query_mode})")
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    parser = argparse.ArgumentParser(prog="carlos", description="CARLoS command line tools.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("serve", help="Serve retrieval over HTTP (see carlos.serve).")
+    p.add_argument("--db", default=None, help="Database parquet file (default: the bundled database).")
+    p.add_argument("--host", default="127.0.0.1")
+    p.add_argument("--port", type=int, default=8080)
+    p.add_argument("--device", default="cuda", help="Text encoder device; falls back to CPU.")
+    p.add_argument("--query-mode", choices=("exact", "fast"), default="exact")
+    p.add_argument("--local-files-only", action="store_true", help="Load models from the local cache only (air-gapped).")
+    p.add_argument("--workers", type=int, default=2, help="Threads for encoding and scoring.")
+    p.add_argument("--max-pending", type=int, default=64, help="Requests admitted at once; more get 503.")
+    p.add_argument("--timeout", type=float, default=30.0, help="Per-request deadline in seconds; slower get 504.")
+    p.add_argument(
+        "--fake-encoder", action="store_true",
+        help="Use deterministic random query vectors instead of CLIP (no torch; for testing clients).",
+    )
+    p.set_defaults(func=_serve)
+
+    p = commands.add_parser("cold-start", help="Time each stage of the first retrieval in a fresh process.")
+    p.add_argument("--db", default=None, help="Database parquet file (default: the bundled database).")
+    p.add_argument("--device", default="cuda", help="Text encoder device; falls back to CPU.")
+    p.add_argument("--query-mode", choices=("exact", "fast"), default="exact")
+    p.add_argument("--local-files-only", action="store_true", help="Load models from the local cache only (air-gapped).")
+    p.add_argument("--query", default="oil painting style", help="Query of the timed first retrieval.")
+    p.add_argument("--no-encoder-warmup", action="store_true", help="Skip the encoder pass after model load.")
+    p.add_argument("--json", action="store_true", help="Print one JSON object instead of a table.")
+    p.set_defaults(func=_cold_start)
+
+    args = parser.parse_args(argv)
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+from __future__ import annotations
+
+import numpy as np
+
+
+def _sq_distances(x: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    # ||x - c||^2 = ||x||^2 - 2 x.c + ||c||^2, without materializing (N, K, D)
+    d = -2.0 * (x @ centroids.T)
+    d += np.einsum("ij,ij->i", x, x)[:, None]
+    d += np.einsum("ij,ij->i", centroids, centroids)[None, :]
+    return np.maximum(d, 0.0)
+
+
+def assign(x: np.ndarray, centroids: np.ndarray, *, chunk: int = 65_536) -> np.ndarray:
+    """Index of the nearest centroid (L2) for every row of `x`."""
+    out = np.empty(x.shape[0], dtype=np.int64)
+    for i in range(0, x.shape[0], chunk):
+        out[i : i + chunk] = _sq_distances(x[i : i + chunk], centroids).argmin(axis=1)
+    return out
+
+
+def kmeans(
+    x: np.ndarray,
+    k: int,
+    *,
+    iters: int = 20,
+    seed: int = 0,
+    max_train: int = 50_000,
+) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Plain Lloyd's k-means with k-means++ seeding, in numpy.
+
+    Trains on at most `max_train` sampled rows, then assigns every row.
+    Returns (centroids [k, D] float32, assignments [N] int64). `k` is clipped to N.
+    """
+    x = np.asarray(x, dtype=np.float32)
+    n = x.shape[0]
+    if n == 0:
+        raise ValueError("kmeans needs at least one row")
+    k = int(min(k, n))
+    rng = np.random.default_rng(seed)
+    train = x if n <= max_train else x[rng.choice(n, size=max_train, replace=False)]
+
+    # k-means++ seeding
+    centroids = np.empty((k, x.shape[1]), dtype=np.float32)
+    centroids[0] = train[rng.integers(train.shape[0])]
+    closest = _sq_distances(train, centroids[:1])[:, 0]
+    for i in range(1, k):
+        total = float(closest.sum())
+        if total <= 0.0:
+            centroids[i] = train[rng.integers(train.shape[0])]
+        else:
+            centroids[i] = train[rng.choice(train.shape[0], p=closest / total)]
+        closest = np.minimum(closest, _sq_distances(train, centroids[i : i + 1])[:, 0])
+
+    for _ in range(iters):
+        labels = assign(train, centroids)
+        counts = np.bincount(labels, minlength=k)
+        moved = counts > 0
+        order = np.argsort(labels, kind="stable")
+        starts = np.searchsorted(labels[order], np.arange(k))
+        sums = np.add.reduceat(train[order].astype(np.float64), starts[moved], axis=0)
+        new = centroids.copy()
+        new[moved] = (sums / counts[moved, None]).astype(np.float32)
+        if np.allclose(new, centroids, atol=1e-6):
+            centroids = new
+            break
+        centroids = new
+
+    return centroids, assign(x, centroids)
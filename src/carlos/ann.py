@@ -0,0 +1,168 @@
+# src/carlos/ann.py
+"""
+Inverted-file (IVF) approximate nearest-neighbour index over CARLoS directions.
+
+A k-means coarse quantizer partitions the unit-normalized directions into `nlist`
+cells; a query is scored exactly, but only against rows in its `nprobe` nearest cells.
+The index stores row positions only (scores always come from the VectorMatrix), so it
+stays small and is updated incrementally as rows are upserted.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Mapping, Optional, Sequence
+
+import numpy as np
+
+from ._kmeans import assign, kmeans
+from .quantize import proxy_queries, shortlist
+from .types import VectorMatrix
+
+
+# k-means trains on at most this many sampled rows; rows are assigned in chunks.
+_TRAIN_ROWS = 50_000
+_ASSIGN_CHUNK = 65_536
+
+
+def _str_keys(keys: Sequence[object]) -> np.ndarray:
+    # object dtype: fixed-width numpy strings would silently truncate longer keys on update
+    out = np.empty(len(keys), dtype=object)
+    out[:] = [str(k) for k in keys]
+    return out
+
+
+def default_nlist(n: int) -> int:
+    """~4 * sqrt(N) cells, at least 1."""
+    return max(1, int(round(4.0 * np.sqrt(max(n, 1)))))
+
+
+@dataclass
+class IVFIndex:
+    centroids: np.ndarray  # (C, D) float32
+    assignments: np.ndarray  # (N,) int64 cell per row position, -1 = not indexed
+    keys: np.ndarray  # (N,) str(key) per row at build/update time, for staleness checks
+    _lists: Optional[tuple[np.ndarray, np.ndarray]] = field(default=None, repr=False, compare=False)
+
+    @property
+    def nlist(self) -> int:
+        return int(self.centroids.shape[0])
+
+    @classmethod
+    def build(cls, matrix: VectorMatrix, *, nlist: Optional[int] = None, seed: int = 0) -> "IVFIndex":
+        if len(matrix) == 0:
+            raise ValueError("Cannot build an ANN index over an empty database")
+        # Normalize only the training sample, then assign the rest chunk by chunk, so no
+        # (N, D) normalized copy of the (possibly memory-mapped) matrix is made.
+        n = len(matrix)
+        train = np.arange(n)
+        if n > _TRAIN_ROWS:
+            train = np.sort(np.random.default_rng(seed).choice(n, size=_TRAIN_ROWS, replace=False))
+        centroids, labels = kmeans(matrix.unit_rows(train), nlist or default_nlist(n), seed=seed)
+        if n > _TRAIN_ROWS:
+            labels = np.concatenate([
+                assign(matrix.unit_rows(np.arange(i, min(i + _ASSIGN_CHUNK, n))), centroids)
+                for i in range(0, n, _ASSIGN_CHUNK)
+            ])
+        return cls(centroids=centroids, assignments=labels.astype(np.int64), keys=_str_keys(matrix.keys))
+
+    def update(self, positions: Sequence[int], unit_directions: np.ndarray, keys: Sequence[object]) -> None:
+        """(Re)assign rows at `positions` (inserts may extend the index)."""
+        positions = np.asarray(positions, dtype=np.int64).reshape(-1)
+        if positions.size == 0:
+            return
+        end = int(positions.max()) + 1
+        if end > self.assignments.size:
+            grow = end - self.assignments.size
+            self.assignments = np.concatenate([self.assignments, np.full(grow, -1, dtype=np.int64)])
+            self.keys = np.concatenate([self.keys, _str_keys([""] * grow)])
+        self.assignments[positions] = assign(np.asarray(unit_directions, dtype=np.float32), self.centroids)
+        self.keys[positions] = _str_keys(keys)
+        self._lists = None
+
+    def probe(self, query_unit: np.ndarray, nprobe: int) -> np.ndarray:
+        """Sorted row positions stored in the `nprobe` cells nearest to the query."""
+        q = np.asarray(query_unit, dtype=np.float32).reshape(-1)
+        # argmin ||c - q||^2 == argmin ||c||^2 - 2 c.q
+        dist = np.einsum("ij,ij->i", self.centroids, self.centroids) - 2.0 * (self.centroids @ q)
+        cells = np.argsort(dist, kind="stable")[: max(1, int(nprobe))]
+        order, offsets = self._inverted_lists()
+        parts = [order[offsets[c] : offsets[c + 1]] for c in cells]
+        return np.sort(np.concatenate(parts)) if parts else np.zeros(0, dtype=np.int64)
+
+    def _inverted_lists(self) -> tuple[np.ndarray, np.ndarray]:
+        # CSR layout: positions grouped by cell, rebuilt lazily after updates.
+        if self._lists is None:
+            a = self.assignments
+            indexed = np.flatnonzero(a >= 0)
+            order = indexed[np.argsort(a[indexed], kind="stable")]
+            counts = np.bincount(a[indexed], minlength=self.nlist)
+            offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+            self._lists = (order, offsets)
+        return self._lists
+
+    def matches(self, matrix: VectorMatrix) -> bool:
+        """True if the index covers exactly the rows (and keys) of `matrix`."""
+        return (
+            self.assignments.size == len(matrix)
+            and self.centroids.shape[1] == matrix.dim
+            and bool(np.array_equal(self.keys, _str_keys(matrix.keys)))
+        )
+
+    def save(self, path: str | Path) -> Path:
+        path = Path(path)
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments, keys=self.keys.astype(str))
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "IVFIndex":
+        with np.load(Path(path), allow_pickle=False) as z:
+            return cls(centroids=z["centroids"], assignments=z["assignments"], keys=_str_keys(z["keys"]))
+
+
+def recall_at_k(matrix: VectorMatrix, index: IVFIndex, queries: np.ndarray, *, k: int = 10, nprobe: int = 8) -> float:
+    """Mean fraction of the exact top-k recovered when only the probed cells are scored."""
+    hits = 0
+    for q in np.asarray(queries, dtype=np.float32):
+        q = q / max(float(np.linalg.norm(q)), 1e-8)
+        exact = matrix.normalized @ q
+        truth = set(shortlist(exact, k).tolist())
+        cand = index.probe(q, nprobe)
+        got = cand[shortlist(exact[cand], k)]
+        hits += len(truth.intersection(got.tolist()))
+    return hits / float(k * len(queries))
+
+
+def recall_report(
+    matrix: VectorMatrix,
+    *,
+    index: Optional[IVFIndex] = None,
+    nprobes: Sequence[int] = (1, 2, 4, 8, 16),
+    k: int = 10,
+    num_queries: int = 200,
+    seed: int = 0,
+) -> Mapping[int, Mapping[str, float]]:
+    """Recall@k and the fraction of rows scored, per nprobe, over `proxy_queries`."""
+    index = index or IVFIndex.build(matrix, seed=seed)
+    queries = proxy_queries(matrix, num_queries=num_queries, seed=seed)
+    report: dict[int, dict[str, float]] = {}
+    for nprobe in nprobes:
+        scanned = np.mean([index.probe(q / np.linalg.norm(q), nprobe).size for q in queries]) / len(matrix)
+        report[int(nprobe)] = {
+            f"recall@{k}": recall_at_k(matrix, index, queries, k=k, nprobe=nprobe),
+            "fraction_scanned": float(scanned),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    from .bundled_db import load_bundled_database
+
+    m = load_bundled_database().vector_matrix()
+    idx = IVFIndex.build(m)
+    print(f"Bundled database: {len(m)} vectors, nlist={idx.nlist}")
+    for nprobe, stats in recall_report(m, index=idx).items():
+        print(f"nprobe={nprobe}", {name: round(value, 4) for name, value in stats.items()})
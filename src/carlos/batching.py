@@ -0,0 +1,206 @@
+# src/carlos/batching.py
+"""
+Dynamic micro-batching of concurrent text retrievals.
+
+A threaded app that calls `retrieve()` per request runs one small text-encoder batch
+per request. `RetrievalBatcher` queues those requests instead: a worker thread takes
+the first waiting query, collects whatever else arrives within `max_wait_ms` (up to
+`max_batch_size` queries), encodes them together and scores each group of requests
+that share filters with one matrix-matrix product. Each caller gets back exactly what
+`retrieve()` would return for its query.
+
+    batcher = RetrievalBatcher(db, cfg=cfg, max_batch_size=32, max_wait_ms=5)
+    results = batcher.retrieve("oil painting style", top_k=10)   # from any thread
+    batcher.close()
+
+Exact search only (no `search="ann"` / `quantization`), as in `retrieve_many`.
+"""
+from __future__ import annotations
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+
+from .config import RetrievalConfig
+from .database import CarlosDatabase
+from .filters import Predicate
+from .retrieve import QUERY_MODES, _embed_queries, _embed_queries_fast, _retrieval_prompts
+from .types import RetrievalResult
+from .vector_search import _candidate_positions, _rank_many
+
+_STOP = object()
+
+
+@dataclass
+class _Request:
+    query: str
+    top_k: int
+    max_strength: float
+    min_consistency: float
+    where: Optional[Predicate]
+    future: Future = field(default_factory=Future)
+
+    def filters(self) -> Tuple[float, float, Optional[Predicate]]:
+        return (self.max_strength, self.min_consistency, self.where)
+
+
+class RetrievalBatcher:
+    """
+    Coalesces concurrent `retrieve()` calls on one database into batched encoder passes.
+
+    max_batch_size:
+      Most queries encoded together.
+    max_wait_ms:
+      How long the first query of a batch waits for others. Adds at most this much
+      latency when traffic is low.
+    """
+
+    def __init__(
+        self,
+        db: CarlosDatabase,
+        *,
+        cfg: RetrievalConfig = RetrievalConfig(),
+        query_mode: str = "exact",
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5.0,
+    ) -> None:
+        if query_mode not in QUERY_MODES:
+            raise ValueError(f"query_mode must be one of {QUERY_MODES}, got {query_mode!r}")
+        if max_batch_size < 1:
+            raise ValueError(f"max_batch_size must be >= 1, got {max_batch_size}")
+        if "cuda" in cfg.device and not torch.cuda.is_available():
+            print("Warning: CUDA device requested but not available; falling back to CPU.")
+            cfg = cfg.with_overrides(device="cpu")
+        self.db = db
+        self.cfg = cfg
+        self.query_mode = query_mode
+        self.max_batch_size = int(max_batch_size)
+        self.max_wait = max(float(max_wait_ms), 0.0) / 1000.0
+        self._queue: "queue.Queue[object]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._counts = {"batches": 0, "queries": 0, "largest_batch": 0}
+        self._worker = threading.Thread(target=self._run, name="carlos-retrieval-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(
+        self,
+        query: str,
+        *,
+        top_k: int = 5,
+        max_strength: float = 9.8,
+        min_consistency: float = 0.041,
+        where: Optional[Predicate] = None,
+    ) -> "Future[List[RetrievalResult]]":
+        """Queue a query; the future resolves to its `retrieve()` results."""
+        if not isinstance(query, str) or query.strip() == "":
+            raise ValueError("query must be a non-empty string")
+        if top_k <= 0:
+            raise ValueError(f"top_k must be > 0, got {top_k}")
+        request = _Request(query, int(top_k), float(max_strength), float(min_consistency), where)
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("RetrievalBatcher is closed")
+            self._queue.put(request)
+        return request.future
+
+    def retrieve(self, query: str, *, timeout: Optional[float] = None, **kwargs) -> List[RetrievalResult]:
+        """Blocking `submit(...)`; takes the filters of `carlos.retrieve.retrieve`."""
+        return self.submit(query, **kwargs).result(timeout=timeout)
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            out: Dict[str, float] = dict(self._counts)
+        out["mean_batch"] = out["queries"] / out["batches"] if out["batches"] else 0.0
+        return out
+
+    def close(self) -> None:
+        """Finish queued requests and stop the worker."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(_STOP)
+        self._worker.join()
+
+    def __enter__(self) -> "RetrievalBatcher":
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.close()
+
+    def _run(self) -> None:
+        stopping = False
+        while not stopping:
+            first = self._queue.get()
+            if first is _STOP:
+                return
+            batch: List[_Request] = [first]  # type: ignore[list-item]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)  # type: ignore[arg-type]
+            self._process(batch)
+
+    def _process(self, batch: List[_Request]) -> None:
+        with self._lock:
+            self._counts["batches"] += 1
+            self._counts["queries"] += len(batch)
+            self._counts["largest_batch"] = max(self._counts["largest_batch"], len(batch))
+        live = [r for r in batch if r.future.set_running_or_notify_cancel()]
+        if not live:
+            return
+        try:
+            reprs = self._embed([r.query for r in live])
+        except BaseException as e:
+            for r in live:
+                r.future.set_exception(e)
+            return
+
+        # One scoring pass per distinct filter set (usually one for the whole batch).
+        groups: List[Tuple[Tuple[float, float, Optional[Predicate]], List[int]]] = []
+        for i, r in enumerate(live):
+            for filters, members in groups:
+                if filters == r.filters():
+                    members.append(i)
+                    break
+            else:
+                groups.append((r.filters(), [i]))
+
+        matrix = self.db.vector_matrix()
+        for (max_strength, min_consistency, where), members in groups:
+            try:
+                positions = _candidate_positions(
+                    self.db, matrix, max_strength=max_strength, min_consistency=min_consistency, where=where
+                )
+                if positions.size == 0:
+                    ranked: List[List[RetrievalResult]] = [[] for _ in members]
+                else:
+                    k = max(live[i].top_k for i in members)
+                    ranked = _rank_many(self.db, matrix, positions, reprs[members], k)
+            except BaseException as e:
+                for i in members:
+                    live[i].future.set_exception(e)
+                continue
+            for i, results in zip(members, ranked):
+                live[i].future.set_result(results[: live[i].top_k])
+
+    def _embed(self, queries: List[str]) -> np.ndarray:
+        if self.query_mode == "fast":
+            return _embed_queries_fast(self.db, queries, cfg=self.cfg, batch_size=len(queries))
+        # Size the encoder batch so that the whole micro-batch is one pass.
+        per_query = max(1, len(_retrieval_prompts(self.cfg)))
+        return _embed_queries(queries, cfg=self.cfg, batch_size=len(queries) * per_query)
@@ -18,6 +18,7 @@ class IndexingConfig:
     # Filesystem / caching
     working_directory: Path = Path("./carlos_working_directory")
     models_cache_dir: Optional[Path] = None
+    local_files_only: bool = False  # load models from models_cache_dir only, never the network
 
     # CivitAI
     civitai_key_str: Optional[str] = None  # if None, resolve via env at runtime
@@ -55,8 +56,20 @@ class RetrievalConfig:
     # Filesystem / caching
     working_directory: Path = Path("./carlos_working_directory")
     models_cache_dir: Optional[Path] = working_directory / "models_cache"
+    local_files_only: bool = False  # load models from models_cache_dir only, never the network
+    embeddings_cache_dir: Optional[Path] = working_directory / "embeddings_cache"  # None = memory only
+    query_cache_size: int = 4096  # query representations kept in memory (LRU); 0 disables
+    query_cache_dir: Optional[Path] = None  # also persist them here, one small .npy per query
+    reuse_prompt_prefix: bool = True  # encode only query tokens on top of cached prompt keys/values
+    prompt_set: str = "all"  # retrieval prompts: "all" or a named subset (see carlos.prompt_sets)
+    prompt_sets_dir: Optional[Path] = working_directory / "prompt_sets"
     device: str = "cuda"
 
+    # CPU execution (device="cpu")
+    cpu_quantize: bool = False  # opt-in dynamic int8 text encoder; changes rankings (see carlos.cpu_inference)
+    cpu_threads: Optional[int] = None  # torch intra-op threads, process-wide; None = torch default
+    warmup: bool = True  # run one encoder pass right after loading the model
+
     def with_overrides(self, **kwargs: Any) -> "RetrievalConfig":
         # ergonomic: cfg = cfg.with_overrides(num_images_per_prompt=2)
         return replace(self, **{k: v for k, v in kwargs.items() if v is not None})
\ No newline at end of file
@@ -0,0 +1,59 @@
+# src/carlos/cpu_inference.py
+"""
+CPU execution of the CLIP text encoder for retrieval.
+
+Retrieval only runs the text tower. On CPU its `nn.Linear` layers (attention projections,
+MLPs, text projection) dominate the cost; `quantize_text_encoder` swaps them for dynamic
+int8 versions (weights quantized once, activations per call), which keeps LayerNorm,
+embeddings and the vision tower in float32.
+
+A quantized model is tagged with `MODEL_VARIANT_ATTR`, which `model_fingerprint` appends
+to the model key so its embeddings never share cache entries, fast encoders or prompt
+sets with the float32 model.
+"""
+from __future__ import annotations
+
+import re
+import warnings
+from typing import Any, Optional
+
+import torch
+
+from .embedding_cache import MODEL_VARIANT_ATTR
+
+INT8_VARIANT = "int8"
+
+
+def quantize_text_encoder(model: Any) -> Any:
+    """
+    Dynamic int8 quantization (in place) of the text tower's linear layers of a CLIP model
+    exposing `text_model` / `text_projection` (`CLIPModel`, `CLIPTextModelWithProjection`).
+    """
+    try:
+        from torch.ao.nn.quantized.dynamic import Linear as DynamicLinear
+        from torch.ao.quantization import default_dynamic_qconfig, quantize_dynamic
+    except ImportError as e:  # removed from recent torch builds
+        raise RuntimeError(
+            "This PyTorch build has no torch.ao.quantization; "
+            "set RetrievalConfig(cpu_quantize=False) to run the float32 text encoder on CPU."
+        ) from e
+
+    spec = {name: default_dynamic_qconfig for name in ("text_model", "text_projection") if hasattr(model, name)}
+    if not spec:
+        raise ValueError(f"{type(model).__name__} has no text_model / text_projection to quantize")
+    model.eval()
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", message=re.escape("torch.ao.quantization is deprecated"))
+        warnings.filterwarnings("ignore", message=re.escape("torch.quantize_per_tensor"))
+        quantize_dynamic(model, spec, dtype=torch.qint8, mapping={torch.nn.Linear: DynamicLinear}, inplace=True)
+    setattr(model, MODEL_VARIANT_ATTR, INT8_VARIANT)
+    return model
+
+
+def configure_threads(num_threads: Optional[int]) -> None:
+    """Set torch's intra-op thread count (process-wide); None keeps the current setting."""
+    if num_threads is None:
+        return
+    if int(num_threads) < 1:
+        raise ValueError(f"num_threads must be >= 1, got {num_threads}")
+    torch.set_num_threads(int(num_threads))
@@ -1,14 +1,24 @@
 # src/carlos/database.py
 from __future__ import annotations
 
-from dataclasses import dataclass
+from collections import OrderedDict
+from dataclasses import dataclass, field
 from pathlib import Path
-from typing import Any, Dict, Iterable, Mapping, Optional, Sequence
+import copy
+import json
+import os
+import re
+import tempfile
+import threading
+import uuid
+from typing import Any, Callable, Dict, Hashable, Iterable, Mapping, Optional, Sequence
 
 import numpy as np
 import pandas as pd
 
-from .types import CarlosVector, IndexingResult
+from .ann import IVFIndex
+from .quantize import QUANTIZATION_KINDS, load_codec, quantize_directions, save_codec
+from .types import CarlosVector, IndexingResult, RowView, VectorMatrix
 
 # Aligned with your create_metrics_dataframe() intent in index.py
 DEFAULT_REQUIRED_COLUMNS: tuple[str, ...] = (
@@ -24,32 +34,171 @@ DEFAULT_REQUIRED_COLUMNS: tuple[str, ...] = (
     "consistency",
 )
 
-def _coerce_int64(value: Any, *, field: str) -> int:
-    if value is None:
-        raise ValueError(f"{field} cannot be None")
+# Direction storage layouts understood by load_database / save_parquet:
+#   "list": `direction` is a list<double> column inside the parquet file (legacy, default)
+#   "npy":  the parquet has no `direction` column; directions live in a float32 (N, D)
+#           `<stem>.<generation>.directions.npy` sidecar that load_database memory-maps
+#           zero-copy. The parquet's schema metadata names its sidecar and row count, so
+#           a crash between the two writes leaves the previous pair intact and in use.
+#           Files written before generations existed use `<stem>.directions.npy`.
+DIRECTION_STORAGE_FORMATS: tuple[str, ...] = ("list", "npy")
+_SIDECAR_SUFFIX = ".directions.npy"
+_SIDECAR_META_KEY = b"carlos.directions_sidecar"
+# Random id of each base file write, in the parquet schema metadata; files derived from the
+# rows (quantized codecs) record it and are ignored once the base has been rewritten.
+_GENERATION_META_KEY = b"carlos.generation"
+
+
+# Incremental writes go to append-only delta segments next to the base file:
+#   <stem>.deltas/00000001.parquet, 00000002.parquet, ...
+# Each segment holds full rows (list layout) for keys changed since the previous
+# checkpoint; load_database replays them in order on top of the base, later wins.
+_DELTAS_SUFFIX = ".deltas"
+
+
+def deltas_dir_path(path: str | Path) -> Path:
+    """Directory holding the append-only delta segments of the database at `path`."""
+    path = Path(path)
+    return path.with_name(path.stem + _DELTAS_SUFFIX)
+
+
+def _segment_paths(path: str | Path) -> list[Path]:
+    d = deltas_dir_path(path)
+    if not d.is_dir():
+        return []
+    return sorted(p for p in d.glob("*.parquet") if p.stem.isdigit())
+
+
+def ann_index_path(path: str | Path) -> Path:
+    """Path of the persisted IVF index (see `carlos.ann`) that accompanies a database file."""
+    path = Path(path)
+    return path.with_name(path.stem + ".ivf.npz")
+
+
+def quantized_codes_path(path: str | Path, kind: str) -> Path:
+    """Path of the persisted `kind` codec (see `carlos.quantize`) that accompanies a database file."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{kind}.npz")
+
+
+def directions_sidecar_path(path: str | Path) -> Path:
+    """Path of the `.npy` direction block that accompanies a columnar parquet file."""
+    path = Path(path)
+    meta = _sidecar_meta(path)
+    if meta is not None:
+        return path.with_name(meta["file"])
+    return path.with_name(path.stem + _SIDECAR_SUFFIX)
+
+
+def _schema_metadata(path: Path) -> Dict[bytes, bytes]:
+    if not path.exists():
+        return {}
+    import pyarrow.parquet as pq
+
+    return pq.read_schema(path).metadata or {}
+
+
+def _sidecar_meta(path: Path) -> Optional[Dict[str, Any]]:
+    # {"file": sidecar name, "rows": N} from the parquet schema metadata, if recorded.
+    raw = _schema_metadata(path).get(_SIDECAR_META_KEY)
+    return None if raw is None else json.loads(raw)
+
+
+def _base_generation(path: Path) -> Optional[str]:
+    raw = _schema_metadata(path).get(_GENERATION_META_KEY)
+    return None if raw is None else raw.decode()
+
+
+def _sidecar_paths(path: Path) -> list[Path]:
+    # Every direction sidecar of `path` on disk: all generations and the legacy name.
+    pattern = re.compile(re.escape(path.stem) + r"(\.g[0-9a-f]+)?" + re.escape(_SIDECAR_SUFFIX))
+    if not path.parent.exists():
+        return []
+    return sorted(p for p in path.parent.iterdir() if pattern.fullmatch(p.name))
+
+
+def _remove_sidecars(path: Path, *, keep: Optional[Path] = None) -> None:
+    for p in _sidecar_paths(path):
+        if p != keep:
+            try:
+                p.unlink()
+            except OSError:
+                pass  # e.g. still memory-mapped on Windows; removed by a later save
+
+
+def _atomic_write(dst: Path, write: Any) -> None:
+    # Write next to the destination and rename, so readers never see a half-written file.
+    # The temp name is unique, so concurrent writers never share (or delete) each other's.
+    fd, name = tempfile.mkstemp(dir=dst.parent, prefix=dst.name + ".", suffix=".tmp")
+    os.close(fd)
+    tmp = Path(name)
+    try:
+        write(tmp)
+        os.replace(tmp, dst)
+    finally:
+        if tmp.exists():
+            tmp.unlink()
+
+
+def _save_npy(path: Path, array: np.ndarray) -> None:
+    # np.save(path) would append ".npy" to the temp name; write through a handle instead.
+    with open(path, "wb") as f:
+        np.save(f, array)
+
+
+# Columns retrieval needs before the final top-k; always loaded, even with projection.
+RETRIEVAL_COLUMNS: tuple[str, ...] = ("version_id", "direction", "strength", "consistency")
+
+# Leaf filter masks kept per database (see `memoize_filter`); each is an N-length bool array.
+FILTER_MASK_CACHE_SIZE = 32
+
+# Row-group size for files we write; small groups keep lazy per-row metadata reads cheap.
+_ROW_GROUP_SIZE = 16_384
+
+
+def _read_parquet_rows(path: Path, rows: np.ndarray, columns: Sequence[str]) -> pd.DataFrame:
+    """
+    Read `columns` for the given 0-based file row numbers, touching only the row groups
+    that contain them. Result rows are in the order of `rows`.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    pf = pq.ParquetFile(path)
+    sizes = [pf.metadata.row_group(i).num_rows for i in range(pf.num_row_groups)]
+    starts = np.concatenate([[0], np.cumsum(sizes)]).astype(np.int64)
+    groups = np.searchsorted(starts, rows, side="right") - 1
+
+    pieces = []
+    for g in np.unique(groups):
+        sel = np.flatnonzero(groups == g)
+        table = pf.read_row_group(int(g), columns=list(columns))
+        part = table.take(pa.array(rows[sel] - starts[g])).to_pandas()
+        part.index = sel
+        pieces.append(part)
+    return pd.concat(pieces).sort_index()
+
+
+def _normalize_key(value: Any) -> Any:
+    """
+    Canonical form for key lookups, so "123", 123, np.int64(123) and 123.0 all match.
+    Non-numeric keys are compared as stripped strings.
+    """
+    if isinstance(value, (bool, np.bool_)):
+        return value
     if isinstance(value, (int, np.integer)):
         return int(value)
+    if isinstance(value, (float, np.floating)):
+        return int(value) if float(value).is_integer() else float(value)
     if isinstance(value, str):
         s = value.strip()
-        if s == "":
-            raise ValueError(f"{field} cannot be empty string")
-        return int(s)
-    # allow pandas scalars
-    try:
-        return int(value)
-    except Exception as e:
-        raise TypeError(f"Could not coerce {field}={value!r} to int") from e
+        try:
+            return int(s)
+        except ValueError:
+            return s
+    return value
 
 
-def _coerce_optional_int(value: Any) -> Optional[int]:
-    if value is None:
-        return None
-    if isinstance(value, float) and pd.isna(value):
-        return None
-    if isinstance(value, str) and value.strip() == "":
-        return None
-    return int(value)
-
 def _direction_to_storage(direction: np.ndarray) -> list[float]:
     """
     Lossless for float32-origin vectors:
@@ -73,6 +222,104 @@ def _direction_from_storage(obj: Any) -> np.ndarray:
     raise TypeError(f"Unsupported direction storage type: {type(obj)}")
 
 
+def _coerce_int(value: Any, *, field: str, optional: bool = False) -> Optional[int]:
+    """
+    The int coercion of `upsert_row` and `upsert_many` for key and id columns: ints and
+    integral floats or strings ("12", " 12.0 ") pass. Missing values (None, NaN, "") give
+    None if `optional` and raise ValueError otherwise. Non-integral numbers and anything
+    else raise TypeError.
+    """
+    if isinstance(value, str):
+        value = value.strip() or None
+    if value is None or value is pd.NA or (isinstance(value, (float, np.floating)) and np.isnan(value)):
+        if optional:
+            return None
+        raise ValueError(f"{field} cannot be None or empty")
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    if isinstance(value, str):
+        try:
+            return int(value)
+        except ValueError:
+            pass
+    try:
+        number = float(value)
+    except (TypeError, ValueError) as e:
+        raise TypeError(f"Could not coerce {field}={value!r} to int") from e
+    if not number.is_integer():
+        raise TypeError(f"{field}={value!r} is not an integer")
+    return int(number)
+
+
+def _coerce_int_column(values: pd.Series, *, field: str, optional: bool = False) -> pd.Series:
+    """Column-wise `_coerce_int` ("Int64" if `optional`, else "int64"), vectorized for numeric columns."""
+    dtype = "Int64" if optional else "int64"
+    if pd.api.types.is_integer_dtype(values.dtype) and (optional or not values.isna().any()):
+        return values.astype(dtype)
+    if pd.api.types.is_float_dtype(values.dtype):
+        x = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = np.isnan(x)
+        present = x[~missing]
+        if (optional or not missing.any()) and np.isfinite(present).all() and (present == np.floor(present)).all():
+            return pd.Series(x, index=values.index).astype(dtype)
+    # Mixed or invalid values: coerce one by one (raises with the offending value).
+    return values.map(lambda v: _coerce_int(v, field=field, optional=optional)).astype(dtype)
+
+
+def _directions_column(values: Sequence[Any]) -> tuple[list[Any], Optional[np.ndarray]]:
+    """
+    Canonicalize a batch of directions to float32 arrays. Returns the per-row storage
+    objects and, when every row has a direction of the same dim, the stacked (K, D) block.
+    """
+    rows = [None if v is None else _direction_from_storage(v) for v in values]
+    present = [r for r in rows if r is not None]
+    if len(present) != len(rows) or len({r.size for r in present}) != 1:
+        return rows, None
+    block = np.stack(present).astype(np.float32, copy=False)
+    return list(block), block
+
+
+def _float_column(df: pd.DataFrame, column: str) -> np.ndarray:
+    if column not in df.columns:
+        return np.full(len(df), np.nan, dtype=np.float64)
+    return pd.to_numeric(df[column], errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+
+
+_NUMERIC_INFERRED = frozenset({"integer", "floating", "mixed-integer-float", "decimal", "boolean", "empty"})
+
+
+def _filter_array(df: pd.DataFrame, column: str) -> np.ndarray:
+    # Numeric columns (incl. nullable ints and object columns left by lazy hydration)
+    # become float64 with NaN for missing values; anything else stays object.
+    if column not in df.columns:
+        raise KeyError(f"Unknown column: {column}")
+    s = df[column]
+    if pd.api.types.is_numeric_dtype(s.dtype) or pd.api.types.infer_dtype(s, skipna=True) in _NUMERIC_INFERRED:
+        return pd.to_numeric(s, errors="coerce").to_numpy(dtype=np.float64, na_value=np.nan)
+    return s.to_numpy(dtype=object)
+
+
+def _build_vector_matrix(df: pd.DataFrame, *, key_column: str) -> VectorMatrix:
+    """
+    Stack the per-row `direction` storage into one contiguous float32 (N, D) block.
+    """
+    keys = df[key_column].to_numpy() if key_column in df.columns else np.arange(len(df))
+    if len(df) == 0:
+        directions = np.zeros((0, 0), dtype=np.float32)
+    else:
+        rows = [_direction_from_storage(d) for d in df["direction"].tolist()]
+        dims = {r.size for r in rows}
+        if len(dims) != 1:
+            raise ValueError(f"Inconsistent direction dims in database: {sorted(dims)}")
+        directions = np.stack(rows).astype(np.float32, copy=False)
+    return VectorMatrix.from_arrays(
+        keys=keys,
+        directions=directions,
+        strength=_float_column(df, "strength"),
+        consistency=_float_column(df, "consistency"),
+    )
+
+
 class CarlosDatabase:
     """
     Minimal DB interface. Keep it small and stable.
@@ -99,6 +346,17 @@ class CarlosDatabase:
     def upsert_indexing_result(self, result: IndexingResult) -> None:
         self.upsert_row(self.row_from_indexing_result(result))
 
+    def upsert_many(self, items: Iterable[Mapping[str, Any] | IndexingResult]) -> None:
+        """
+        Upsert a batch of rows and/or IndexingResults. Later items win on duplicate keys.
+        Backends should override this with a bulk implementation.
+        """
+        for item in items:
+            if isinstance(item, IndexingResult):
+                self.upsert_indexing_result(item)
+            else:
+                self.upsert_row(item)
+
     def row_from_indexing_result(self, result: IndexingResult) -> Dict[str, Any]:
         # Default behavior: store core metrics + whatever else caller included in result.row
         base = dict(result.row or {})
@@ -107,20 +365,77 @@ class CarlosDatabase:
         base["consistency"] = float(result.vector.consistency)
         return base
 
-    def get_vector(self, *, key: str, value: Any) -> CarlosVector:
+    def get_row(self, *, key: str, value: Any) -> Dict[str, Any]:
+        """Return the first row where `key` equals `value` (str/int keys are normalized)."""
         df = self.to_dataframe()
         if key not in df.columns:
             raise KeyError(f"Unknown key column: {key}")
-        hits = df[df[key] == value]
+        want = _normalize_key(value)
+        hits = df[df[key].map(_normalize_key) == want]
         if hits.empty:
             raise KeyError(f"No row found where {key}={value!r}")
-        row = hits.iloc[0].to_dict()
+        return hits.iloc[0].to_dict()
+
+    def rows_at(self, positions: Sequence[int]) -> list[Dict[str, Any]]:
+        """Row dicts at the given positions (aligned with `vector_matrix()` rows)."""
+        df = self.to_dataframe()
+        return [df.iloc[int(p)].to_dict() for p in positions]
+
+    def row_views(self, positions: Sequence[int]) -> list[Mapping[str, Any]]:
+        """
+        Read-only rows at the given positions, for results handed back to callers.
+        Backends with a columnar snapshot return `RowView`s; the default is `rows_at`.
+        """
+        return self.rows_at(positions)
+
+    def get_vector(self, *, key: str, value: Any) -> CarlosVector:
+        row = self.get_row(key=key, value=value)
         return CarlosVector(
             direction=_direction_from_storage(row["direction"]),
             strength=float(row["strength"]),
             consistency=float(row["consistency"]),
         )
 
+    def vector_matrix(self) -> VectorMatrix:
+        """
+        Columnar view of all stored vectors, aligned with `to_dataframe()` row order.
+
+        The default implementation rebuilds it on every call; backends should cache it.
+        """
+        return _build_vector_matrix(self.to_dataframe(), key_column="version_id")
+
+    def memoize_derived(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        """
+        Return a value derived from the stored data (codecs, filter masks, ...), built with
+        `build()`. Backends that cache must drop these entries whenever the data changes;
+        the default implementation does not cache.
+        """
+        return build()
+
+    def memoize_filter(self, predicate: Hashable, build: Callable[[], np.ndarray]) -> np.ndarray:
+        """
+        Boolean mask of a leaf filter predicate (see `carlos.filters`), built with
+        `build()`. Backends that cache keep only the most recently used masks and drop
+        them whenever the data changes; the default implementation does not cache.
+        """
+        return build()
+
+    def column_values(self, name: str) -> np.ndarray:
+        """
+        Column `name` as a numpy array aligned with `vector_matrix()` rows, for filtering
+        (see `carlos.filters`): numeric columns as float64 with NaN for missing values,
+        other columns as object. Memoized.
+        """
+        return self.memoize_derived(("column", name), lambda: _filter_array(self.to_dataframe(), name))
+
+    def ann_index(self) -> IVFIndex:
+        """IVF index over the directions (see `carlos.ann`), built on first use."""
+        return self.memoize_derived(("ann",), lambda: IVFIndex.build(self.vector_matrix()))
+
+    def quantized_directions(self, kind: str) -> Any:
+        """Compressed codes of the direction matrix (see `carlos.quantize`), memoized."""
+        return self.memoize_derived(("quantized", kind), lambda: quantize_directions(self.vector_matrix(), kind))
+
     def iter_vectors(self) -> Iterable[tuple[dict[str, Any], CarlosVector]]:
         df = self.to_dataframe()
         for _, r in df.iterrows():
@@ -148,10 +463,47 @@ class PandasCarlosDatabase(CarlosDatabase):
     path: Optional[Path] = None
     key_column: str = "version_id"
     _required_columns: Sequence[str] = DEFAULT_REQUIRED_COLUMNS
+    direction_storage: str = "list"
+    _matrix: Optional[VectorMatrix] = field(default=None, init=False, repr=False, compare=False)
+    # normalized key -> first row position; keys seen more than once are tracked separately
+    _key_index: Dict[Any, int] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _duplicate_keys: set = field(default_factory=set, init=False, repr=False, compare=False)
+    # normalized keys changed since the last save_parquet / checkpoint
+    _dirty_keys: set = field(default_factory=set, init=False, repr=False, compare=False)
+    _segment_seq: int = field(default=0, init=False, repr=False, compare=False)
+    # Held from a compaction's snapshot until its base file is committed (and by
+    # save_parquet), so base writes happen one at a time and in snapshot order.
+    _compact_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    _compact_thread: Optional[threading.Thread] = field(default=None, init=False, repr=False, compare=False)
+    _derived: Dict[Hashable, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # predicate -> mask, least recently used first; bounded by FILTER_MASK_CACHE_SIZE
+    _filter_masks: "OrderedDict[Hashable, np.ndarray]" = field(
+        default_factory=OrderedDict, init=False, repr=False, compare=False
+    )
+    _filter_lock: threading.Lock = field(default_factory=threading.Lock, init=False, repr=False, compare=False)
+    # Persistent, incrementally maintained ANN index (None until built or loaded)
+    _ann: Optional[IVFIndex] = field(default=None, init=False, repr=False, compare=False)
+    # Quantized codecs by kind, maintained incrementally and persisted like `_ann`
+    _codecs: Dict[str, Any] = field(default_factory=dict, init=False, repr=False, compare=False)
+    # Projection / lazy loading: columns still on disk in `_deferred_source`, and for each
+    # loaded row its row number in that file (-1 once `df` holds the row's full data).
+    # Lazily read values live in `_hydrated` (column -> object array by position, filled
+    # where `_hydrated_rows`), not in `df`. `_deferred_lock` guards all of this state.
+    _deferred_columns: tuple = field(default=(), init=False, repr=False, compare=False)
+    _deferred_source: Optional[Path] = field(default=None, init=False, repr=False, compare=False)
+    _source_rows: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
+    _lazy: bool = field(default=False, init=False, repr=False, compare=False)
+    _hydrated: Dict[str, np.ndarray] = field(default_factory=dict, init=False, repr=False, compare=False)
+    _hydrated_rows: Optional[np.ndarray] = field(default=None, init=False, repr=False, compare=False)
+    _deferred_lock: threading.RLock = field(default_factory=threading.RLock, init=False, repr=False, compare=False)
+    # Column order of the file a projected / lazy load came from; saves write it back in
+    # that order (projection moves RETRIEVAL_COLUMNS to the front of `df`).
+    _column_order: tuple = field(default=(), init=False, repr=False, compare=False)
 
     def __post_init__(self) -> None:
-        # Make a defensive copy to avoid spooky mutations.
-        self.df = self.df.copy()
+        # Make a defensive copy to avoid spooky mutations. Row positions back the key
+        # index and the vector matrix, so labels are reset to a RangeIndex.
+        self.df = self.df.copy().reset_index(drop=True)
 
         # Ensure required columns exist (create if missing).
         for c in self._required_columns:
@@ -164,12 +516,304 @@ class PandasCarlosDatabase(CarlosDatabase):
                 # don't force dtype conversion here; just ensure column exists
                 pass
 
+        if self.direction_storage not in DIRECTION_STORAGE_FORMATS:
+            raise ValueError(
+                f"direction_storage must be one of {DIRECTION_STORAGE_FORMATS}, got {self.direction_storage!r}"
+            )
+
+        self._rebuild_key_index()
+
     def required_columns(self) -> Sequence[str]:
         return tuple(self._required_columns)
 
     def to_dataframe(self) -> pd.DataFrame:
         return self.df
 
+    def vector_matrix(self) -> VectorMatrix:
+        """
+        Cached columnar view of all vectors. Built lazily on first use, patched in place
+        when `upsert_row` updates an existing row, and rebuilt after inserts.
+
+        If you mutate `df` directly, call `invalidate_caches()` afterwards.
+        """
+        if self._matrix is None:
+            self._matrix = _build_vector_matrix(self.df, key_column=self.key_column)
+        return self._matrix
+
+    def invalidate_caches(self) -> None:
+        self._matrix = None
+        self._derived.clear()
+        self._codecs.clear()
+        self._clear_filter_masks()
+        self._rebuild_key_index()
+
+    def memoize_derived(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        # Cleared by every upsert; see _data_changed().
+        if key not in self._derived:
+            self._derived[key] = build()
+        return self._derived[key]
+
+    def memoize_filter(self, predicate: Hashable, build: Callable[[], np.ndarray]) -> np.ndarray:
+        # LRU: recurring filters stay precomputed, one-off predicates (arbitrary
+        # thresholds) cannot grow memory. Cleared by every upsert.
+        with self._filter_lock:
+            mask = self._filter_masks.get(predicate)
+            if mask is not None:
+                self._filter_masks.move_to_end(predicate)
+                return mask
+        mask = build()
+        with self._filter_lock:
+            self._filter_masks[predicate] = mask
+            while len(self._filter_masks) > FILTER_MASK_CACHE_SIZE:
+                self._filter_masks.popitem(last=False)
+        return mask
+
+    def _clear_filter_masks(self) -> None:
+        with self._filter_lock:
+            self._filter_masks.clear()
+
+    def _data_changed(self) -> None:
+        self._derived.clear()
+        self._clear_filter_masks()
+
+    def ann_index(self) -> IVFIndex:
+        """
+        The IVF index, maintained incrementally by upserts and persisted next to the
+        database file by save_parquet/compact. Built with defaults on first use.
+        """
+        if self._ann is None:
+            self.build_ann_index(persist=False)
+        return self._ann
+
+    def build_ann_index(self, *, nlist: Optional[int] = None, seed: int = 0, persist: bool = True) -> IVFIndex:
+        """(Re)train the IVF coarse quantizer on all rows; writes it next to db.path if `persist`."""
+        self._ann = IVFIndex.build(self.vector_matrix(), nlist=nlist, seed=seed)
+        if persist and self.path is not None:
+            self._ann.save(ann_index_path(self.path))
+        return self._ann
+
+    def quantized_directions(self, kind: str) -> Any:
+        """
+        Compressed codes of the direction matrix (see `carlos.quantize`), maintained
+        incrementally by upserts (pq keeps its codebooks) and persisted next to the
+        database file by save_parquet/compact. Built on first use.
+        """
+        codec = self._codecs.get(kind)
+        if codec is None:
+            codec = self._codecs[kind] = quantize_directions(self.vector_matrix(), kind)
+        return codec
+
+    def _update_indexes(self, positions: Sequence[int], directions: Sequence[Any]) -> None:
+        # Re-place / re-encode the upserted rows in the ANN index and the codecs.
+        if self._ann is None and not self._codecs:
+            return
+        if len(directions) == 0:
+            return
+        if any(d is None for d in directions):
+            # Rows without a direction cannot be placed; retrain on next use instead.
+            self._ann = None
+            self._codecs.clear()
+            return
+        block = np.stack([_direction_from_storage(d) for d in directions]).astype(np.float32)
+        if self._ann is not None and block.shape[1] != self._ann.centroids.shape[1]:
+            self._ann = None
+        if any(block.shape[1] != c.dim for c in self._codecs.values()):
+            self._codecs.clear()
+        norms = np.linalg.norm(block, axis=1, keepdims=True)
+        unit = block / np.where(norms > 0, norms, 1.0)
+        positions = np.asarray(positions, dtype=np.int64)
+        if self._ann is not None:
+            keys = self.df[self.key_column].to_numpy()[positions]
+            self._ann.update(positions, unit, keys)
+        for codec in self._codecs.values():
+            codec.update(positions, unit)
+
+    def _rebuild_key_index(self) -> None:
+        index: Dict[Any, int] = {}
+        duplicates = set()
+        if self.key_column in self.df.columns:
+            for pos, value in enumerate(self.df[self.key_column].tolist()):
+                k = _normalize_key(value)
+                if k in index:
+                    duplicates.add(k)
+                else:
+                    index[k] = pos
+        self._key_index = index
+        self._duplicate_keys = duplicates
+
+    def position_of(self, value: Any) -> Optional[int]:
+        """Row position of the key-column value `value`, or None if absent. O(1)."""
+        return self._key_index.get(_normalize_key(value))
+
+    def get_row(self, *, key: str, value: Any) -> Dict[str, Any]:
+        if key != self.key_column:
+            return super().get_row(key=key, value=value)
+        pos = self.position_of(value)
+        if pos is None:
+            raise KeyError(f"No row found where {key}={value!r}")
+        return self.rows_at([pos])[0]
+
+    def rows_at(self, positions: Sequence[int]) -> list[Dict[str, Any]]:
+        if not self._lazy:
+            return super().rows_at(positions)
+        # Lazy databases read deferred columns for just these rows.
+        with self._deferred_lock:
+            rows = super().rows_at(positions)
+            if not self._deferred_columns:
+                return rows
+            at, values = self._deferred_values(np.asarray(positions, dtype=np.int64).reshape(-1))
+            for c, col in values.items():
+                for i, v in zip(at, col):
+                    rows[i][c] = v
+            return rows
+
+    def row_views(self, positions: Sequence[int]) -> list[Mapping[str, Any]]:
+        if self._deferred_columns:
+            # Lazy databases read the deferred metadata per row anyway.
+            return self.rows_at(positions)
+        columns = self.memoize_derived(("row_columns",), self._row_columns)
+        return [RowView(columns, int(p)) for p in positions]
+
+    def _row_columns(self) -> Dict[str, np.ndarray]:
+        # Owned copies, so views handed out before an upsert keep their values.
+        out: Dict[str, np.ndarray] = {}
+        for c in self.df.columns:
+            s = self.df[c]
+            if isinstance(s.dtype, pd.api.extensions.ExtensionDtype):
+                out[c] = s.to_numpy(dtype=object, na_value=None)
+            else:
+                out[c] = s.to_numpy(copy=True)
+        return out
+
+    @property
+    def deferred_columns(self) -> tuple[str, ...]:
+        """Columns not loaded yet (see `load_database(columns=..., lazy=...)`)."""
+        return tuple(self._deferred_columns)
+
+    def materialize(self, columns: Optional[Sequence[str]] = None) -> None:
+        """
+        Load deferred columns (all of them by default) for every row; with no `columns`
+        the database is fully in memory after.
+        """
+        with self._deferred_lock:
+            todo = [c for c in self._deferred_columns if columns is None or c in columns]
+            if not todo:
+                return
+            full = pd.read_parquet(self._deferred_source, columns=todo)
+            src = self._source_rows
+            n = len(self.df)
+            rows = np.full(n, -1, dtype=np.int64)
+            rows[: src.size] = src
+            from_file = rows >= 0
+            for c in todo:
+                col = full[c].take(np.where(from_file, rows, 0)).reset_index(drop=True)
+                if not from_file.all():
+                    merged = col.astype(object)
+                    merged[~from_file] = self.df[c].to_numpy()[~from_file]
+                    try:
+                        col = merged.astype(col.dtype)
+                    except (TypeError, ValueError):
+                        col = merged.infer_objects()
+                self.df[c] = col
+                self._hydrated.pop(c, None)
+            self._deferred_columns = tuple(c for c in self._deferred_columns if c not in todo)
+            if not self._deferred_columns:
+                self._clear_deferred()
+
+    def _deferred_values(self, pos: np.ndarray) -> tuple[np.ndarray, Dict[str, np.ndarray]]:
+        # Deferred values of the rows at `pos` whose data `df` does not hold: their indices
+        # into `pos`, and per column their values, read from the file on first request.
+        # The caller holds _deferred_lock.
+        src = self._source_rows
+        at = np.flatnonzero(pos < src.size)
+        at = at[src[pos[at]] >= 0]
+        pos = pos[at]
+        if pos.size == 0:
+            return at, {}
+        if self._hydrated_rows is None:
+            self._hydrated_rows = np.zeros(src.size, dtype=bool)
+        missing = np.unique(pos[~self._hydrated_rows[pos]])
+        if missing.size:
+            part = _read_parquet_rows(self._deferred_source, src[missing], self._deferred_columns)
+            for c in self._deferred_columns:
+                if c not in self._hydrated:
+                    self._hydrated[c] = np.full(src.size, None, dtype=object)  # allocated once
+                self._hydrated[c][missing] = part[c].astype(object).to_numpy()
+            self._hydrated_rows[missing] = True
+        return at, {c: self._hydrated[c][pos] for c in self._deferred_columns}
+
+    def _hydrate(self, positions: Sequence[int]) -> None:
+        # Before updates: copy the rows' deferred values into `df`, so columns missing
+        # from the new row keep their values.
+        with self._deferred_lock:
+            if not self._deferred_columns:
+                return
+            pos = np.asarray(positions, dtype=np.int64).reshape(-1)
+            at, values = self._deferred_values(pos)
+            pos = pos[at]
+            for c, col in values.items():
+                if c not in self.df.columns:
+                    self.df[c] = None
+                elif self.df[c].dtype != object:
+                    self.df[c] = self.df[c].astype(object)
+                j = self.df.columns.get_loc(c)
+                for p, v in zip(pos, col):
+                    self.df.iat[int(p), j] = v
+            if pos.size:
+                self._source_rows[pos] = -1
+            if (self._source_rows < 0).all():
+                self._clear_deferred()
+
+    def _clear_deferred(self) -> None:
+        with self._deferred_lock:
+            self._deferred_columns = ()
+            self._deferred_source = None
+            self._source_rows = None
+            self._hydrated = {}
+            self._hydrated_rows = None
+
+    def column_values(self, name: str) -> np.ndarray:
+        # Filtering needs the whole column; load it once rather than row by row.
+        if name in self._deferred_columns:
+            self.materialize([name])
+        return super().column_values(name)
+
+    def get_vector(self, *, key: str, value: Any) -> CarlosVector:
+        if key != self.key_column:
+            return super().get_vector(key=key, value=value)
+        pos = self.position_of(value)
+        if pos is None:
+            raise KeyError(f"No row found where {key}={value!r}")
+        if self._matrix is not None:
+            return self._matrix.vector(pos)
+        return CarlosVector(
+            direction=_direction_from_storage(self.df["direction"].iat[pos]),
+            strength=float(self.df["strength"].iat[pos]),
+            consistency=float(self.df["consistency"].iat[pos]),
+        )
+
+    def _patch_vector_matrix(self, position: int, row: Mapping[str, Any]) -> None:
+        m = self._matrix
+        if m is None:
+            return
+        direction_obj = row.get("direction")
+        if direction_obj is None:
+            self._matrix = None
+            return
+        d = _direction_from_storage(direction_obj)
+        if d.size != m.dim or not m.directions.flags.writeable:
+            self._matrix = None
+            return
+        norm = np.float32(np.linalg.norm(d))
+        m.keys[position] = row[self.key_column]
+        m.directions[position] = d
+        m.norms[position] = norm
+        if m._normalized is not None:
+            m._normalized[position] = d / norm if norm > 0 else d
+        strength, consistency = row.get("strength"), row.get("consistency")
+        m.strength[position] = np.nan if strength is None else float(strength)
+        m.consistency[position] = np.nan if consistency is None else float(consistency)
+
     def upsert_row(self, row: Mapping[str, Any]) -> None:
         if self.key_column not in row:
             raise KeyError(
@@ -187,10 +831,9 @@ class PandasCarlosDatabase(CarlosDatabase):
         row = dict(row)
 
         # Enforce canonical types for stable parquet schema
-        row["version_id"] = _coerce_int64(row.get("version_id"), field="version_id")
-        row["model_id"] = _coerce_optional_int(row.get("model_id"))
-        row["model_nsfw_level"] = _coerce_optional_int(row.get("model_nsfw_level"))
-        row["model_download_count"] = _coerce_optional_int(row.get("model_download_count"))
+        row["version_id"] = _coerce_int(row.get("version_id"), field="version_id")
+        for c in ("model_id", "model_nsfw_level", "model_download_count"):
+            row[c] = _coerce_int(row.get(c), field=c, optional=True)
 
         # Strength/consistency should be floats (allow None -> NaN)
         if "strength" in row and row["strength"] is not None:
@@ -209,19 +852,23 @@ class PandasCarlosDatabase(CarlosDatabase):
             )
 
         df = self.df
-        mask = df[self.key_column] == key_val
-        hit_indices = df.index[mask].tolist()
-
-        if len(hit_indices) > 1:
+        key_norm = _normalize_key(row[self.key_column])
+        if key_norm in self._duplicate_keys:
+            n_hits = int((df[self.key_column].map(_normalize_key) == key_norm).sum())
             raise ValueError(
                 f"Database corruption: multiple rows with {self.key_column}={key_val!r} "
-                f"({len(hit_indices)} rows)."
+                f"({n_hits} rows)."
             )
 
-        if len(hit_indices) == 1:
-            idx = hit_indices[0]
+        pos = self._key_index.get(key_norm)
+        if pos is not None:
+            self._hydrate([pos])
+            df = self.df
+            idx = df.index[pos]
             for k, v in row.items():
                 df.at[idx, k] = v
+            self._patch_vector_matrix(pos, row)
+            self._update_indexes([pos], [row.get("direction")])
         else:
             row_df = pd.DataFrame([dict(row)])
             if self.df.empty:
@@ -229,23 +876,455 @@ class PandasCarlosDatabase(CarlosDatabase):
                 self.df = row_df.astype(row_df.dtypes.to_dict())
             else:
                 self.df.loc[len(self.df)] = row_df.iloc[0]
+            self._key_index[key_norm] = len(self.df) - 1
+            self._matrix = None
+            self._update_indexes([len(self.df) - 1], [row.get("direction")])
+        self._dirty_keys.add(key_norm)
+        self._data_changed()
+
+    def upsert_many(self, items: Iterable[Mapping[str, Any] | IndexingResult]) -> None:
+        """
+        Bulk upsert. Validates and coerces the whole batch column-wise, splits it into
+        updates and inserts with the key index, then applies each in one step
+        (column assignment for updates, a single concat for inserts).
+        """
+        rows = [
+            self.row_from_indexing_result(x) if isinstance(x, IndexingResult) else dict(x)
+            for x in items
+        ]
+        if not rows:
+            return
+
+        required = set(self._required_columns) | {self.key_column}
+        for i, r in enumerate(rows):
+            if not required.issubset(r.keys()):
+                missing = sorted(required.difference(r.keys()))
+                raise KeyError(f"Row {i} missing required column(s) {missing}")
+
+        batch = pd.DataFrame.from_records(rows)
+
+        # Enforce canonical types for stable parquet schema (same rules as upsert_row)
+        batch["version_id"] = _coerce_int_column(batch["version_id"], field="version_id")
+        for c in ("model_id", "model_nsfw_level", "model_download_count"):
+            batch[c] = _coerce_int_column(batch[c], field=c, optional=True)
+        for c in ("strength", "consistency"):
+            batch[c] = pd.to_numeric(batch[c], errors="raise").astype("float64")
+        direction_rows, _ = _directions_column(batch["direction"].tolist())
+        batch["direction"] = pd.Series(direction_rows, index=batch.index, dtype=object)
+
+        keys = [_normalize_key(k) for k in batch[self.key_column].tolist()]
+        corrupt = self._duplicate_keys.intersection(keys)
+        if corrupt:
+            raise ValueError(
+                f"Database corruption: multiple rows with {self.key_column} in {sorted(corrupt)!r}."
+            )
+        # Later rows win, matching a sequence of upsert_row calls.
+        keep = ~pd.Series(keys).duplicated(keep="last").to_numpy()
+        batch = batch[keep].reset_index(drop=True)
+        keys = [k for k, kept in zip(keys, keep) if kept]
+
+        positions = np.asarray([self._key_index.get(k, -1) for k in keys], dtype=np.int64)
+        is_update = positions >= 0
+        updates = batch[is_update]
+        inserts = batch[~is_update]
+
+        if len(updates):
+            self._hydrate(positions[is_update])
+            self._apply_updates(positions[is_update], updates)
+        if len(inserts):
+            start = len(self.df)
+            if self.df.empty:
+                columns = list(self.df.columns) + [c for c in inserts.columns if c not in self.df.columns]
+                self.df = inserts.reindex(columns=columns).reset_index(drop=True)
+            else:
+                self.df = pd.concat([self.df, inserts], ignore_index=True)
+            for offset, k in enumerate(k for k, upd in zip(keys, is_update) if not upd):
+                self._key_index[k] = start + offset
+            self._matrix = None
+            positions[~is_update] = np.arange(start, start + len(inserts))
+        self._update_indexes(positions.tolist(), batch["direction"].tolist())
+        self._dirty_keys.update(keys)
+        self._data_changed()
+
+    def _apply_updates(self, positions: np.ndarray, updates: pd.DataFrame) -> None:
+        df = self.df
+        for c in updates.columns:
+            if c not in df.columns:
+                df[c] = None
+            col = df[c].copy()
+            values = updates[c]
+            if c == "direction" or col.dtype == object:
+                obj = np.empty(len(values), dtype=object)
+                obj[:] = values.tolist()
+                col.iloc[positions] = obj
+            else:
+                if col.dtype != values.dtype:
+                    # e.g. int64 column receiving the canonical nullable Int64 batch
+                    try:
+                        col = col.astype(values.dtype)
+                    except (TypeError, ValueError):
+                        col = col.astype(object)
+                col.iloc[positions] = values.array
+            df[c] = col
 
-    def save_parquet(self, path: str | Path | None = None) -> Path:
+        m = self._matrix
+        if m is None:
+            return
+        _, block = _directions_column(updates["direction"].tolist())
+        if block is None or block.shape[1] != m.dim or not m.directions.flags.writeable:
+            self._matrix = None
+            return
+        norms = np.linalg.norm(block, axis=1).astype(np.float32)
+        safe = np.where(norms > 0, norms, np.float32(1.0))
+        m.keys[positions] = updates[self.key_column].to_numpy()
+        m.directions[positions] = block
+        m.norms[positions] = norms
+        if m._normalized is not None:
+            m._normalized[positions] = block / safe[:, None]
+        m.strength[positions] = updates["strength"].to_numpy(dtype=np.float64, na_value=np.nan)
+        m.consistency[positions] = updates["consistency"].to_numpy(dtype=np.float64, na_value=np.nan)
+
+    def save_parquet(self, path: str | Path | None = None, *, direction_storage: Optional[str] = None) -> Path:
+        """
+        Write the full database to `path` (defaults to `db.path`), replacing the base file
+        atomically and dropping any delta segments it supersedes.
+
+        direction_storage defaults to the layout the database was loaded with; pass
+        "npy" to write the memory-mappable sidecar layout, or "list" for a single
+        self-contained parquet file.
+        """
         out = Path(path) if path is not None else self.path
         if out is None:
             raise ValueError("No output path provided. Pass `path=...` or set db.path.")
-        out.parent.mkdir(parents=True, exist_ok=True)
-        self.to_dataframe().to_parquet(out, index=False)
+        storage = direction_storage or self.direction_storage
+        if storage not in DIRECTION_STORAGE_FORMATS:
+            raise ValueError(f"direction_storage must be one of {DIRECTION_STORAGE_FORMATS}, got {storage!r}")
+        self.materialize()
+        with self._compact_lock:
+            folded = _segment_paths(out)
+            self._write_base(out, storage)
+            _remove_segments(folded)
         self.path = out
+        self.direction_storage = storage
+        self._dirty_keys.clear()
         return out
 
+    def checkpoint(self, *, compact_after: Optional[int] = None) -> Optional[Path]:
+        """
+        Persist only the rows changed since the last save/checkpoint as a new append-only
+        delta segment next to `db.path`. Cheap enough to call after every upsert batch;
+        the base file is never rewritten. Returns the segment path (None if nothing changed).
+
+        If `compact_after` is set and at least that many segments exist afterwards, a
+        background `compact()` is started, unless one is still running.
+        """
+        if self.path is None:
+            raise ValueError("checkpoint() needs db.path; call save_parquet(path) once first.")
+        if not self.path.exists():
+            self.save_parquet()
+            return None
+        if not self._dirty_keys:
+            return None
+
+        positions = sorted(self._key_index[k] for k in self._dirty_keys if k in self._key_index)
+        seg_dir = deltas_dir_path(self.path)
+        seg_dir.mkdir(parents=True, exist_ok=True)
+        existing = _segment_paths(self.path)
+        last = int(existing[-1].stem) if existing else 0
+        self._segment_seq = max(self._segment_seq, last) + 1
+        seg = seg_dir / f"{self._segment_seq:08d}.parquet"
+
+        delta = self.df.iloc[positions]
+        # Only the dirty rows: building the whole vector matrix after inserts would cost
+        # far more than writing the segment.
+        _, directions = _directions_column(delta["direction"].tolist())
+        _atomic_write(seg, lambda p: _write_list_parquet(delta, directions, p))
+        self._dirty_keys.clear()
+
+        if compact_after is not None and len(existing) + 1 >= compact_after:
+            self.compact(background=True)
+        return seg
+
+    def compact(self, *, background: bool = False) -> Optional[threading.Thread]:
+        """
+        Fold all delta segments into a new base file (atomic rename), then delete them.
+
+        The in-memory state is snapshotted synchronously, so callers may keep upserting and
+        checkpointing while a background compaction runs; segments written after the
+        snapshot are left in place and replayed on top of the new base. With
+        `background=True` the started thread is returned (join it to wait).
+
+        Compactions run one at a time. A background compaction requested while one is
+        in flight is skipped and the running thread returned; a blocking one waits for it.
+        """
+        if self.path is None:
+            raise ValueError("compact() needs db.path; call save_parquet(path) once first.")
+        if not self._compact_lock.acquire(blocking=not background):
+            return self._compact_thread
+        try:
+            self.materialize()
+            path, storage = self.path, self.direction_storage
+            # Exactly the segments this snapshot contains; later ones stay on disk.
+            folded = _segment_paths(path)
+            snapshot = PandasCarlosDatabase(
+                df=self.df,
+                path=path,
+                key_column=self.key_column,
+                _required_columns=self._required_columns,
+                direction_storage=storage,
+            )
+            snapshot._column_order = self._column_order
+            if self._matrix is not None:
+                snapshot._matrix = self._matrix.copy()
+            if self._ann is not None:
+                snapshot._ann = IVFIndex(
+                    centroids=self._ann.centroids,
+                    assignments=self._ann.assignments.copy(),
+                    keys=self._ann.keys.copy(),
+                )
+            snapshot._codecs = {kind: copy.deepcopy(codec) for kind, codec in self._codecs.items()}
+        except BaseException:
+            self._compact_lock.release()
+            raise
+
+        def _run() -> None:
+            try:
+                snapshot._write_base(path, storage)
+                _remove_segments(folded)
+            finally:
+                self._compact_lock.release()
+
+        if background:
+            t = threading.Thread(target=_run, name="carlos-compact", daemon=False)
+            self._compact_thread = t
+            t.start()
+            return t
+        _run()
+        return None
+
+    def _frame_in_file_order(self) -> pd.DataFrame:
+        # `df` with the loaded file's columns in their original order, new columns last.
+        order = [c for c in self._column_order if c in self.df.columns]
+        if not order or order == list(self.df.columns[: len(order)]):
+            return self.df
+        return self.df[order + [c for c in self.df.columns if c not in order]]
+
+    def _write_base(self, out: Path, storage: str) -> None:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        ann_path = ann_index_path(out)
+        if self._ann is not None:
+            self._ann.save(ann_path)
+        elif ann_path.exists():
+            ann_path.unlink()  # would describe an older version of the rows
+        generation = uuid.uuid4().hex[:16]
+        for kind in QUANTIZATION_KINDS:
+            codes_path = quantized_codes_path(out, kind)
+            if kind in self._codecs:
+                save_codec(self._codecs[kind], codes_path, generation=generation)
+            elif codes_path.exists():
+                codes_path.unlink()
+
+        if storage == "npy":
+            directions = np.ascontiguousarray(self.vector_matrix().directions, dtype=np.float32)
+            # A new generation never overwrites the sidecar the current parquet names; the
+            # parquet rename below is the commit point.
+            sidecar = out.with_name(f"{out.stem}.g{generation}{_SIDECAR_SUFFIX}")
+            _atomic_write(sidecar, lambda p: _save_npy(p, directions))
+            meta = self._frame_in_file_order().drop(columns=["direction"])
+            stamp = json.dumps({"file": sidecar.name, "rows": int(directions.shape[0])})
+            metadata = {_SIDECAR_META_KEY: stamp, _GENERATION_META_KEY: generation}
+            _atomic_write(out, lambda p: _write_meta_parquet(meta, metadata, p))
+            _remove_sidecars(out, keep=sidecar)
+        else:
+            try:
+                directions = self.vector_matrix().directions
+            except (TypeError, ValueError):
+                directions = None
+            metadata = {_GENERATION_META_KEY: generation}
+            _atomic_write(out, lambda p: _write_list_parquet(self._frame_in_file_order(), directions, p, metadata))
+            # Stale sidecars would shadow nothing (the parquet has `direction`), but
+            # remove them so the on-disk layout is unambiguous.
+            _remove_sidecars(out)
+
+
+def _remove_segments(segments: Sequence[Path]) -> None:
+    # Oldest first: if interrupted, the surviving segments are a suffix of the log and
+    # replaying them on top of the new base still yields the latest values.
+    for seg in segments:
+        try:
+            seg.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _write_list_parquet(
+    df: pd.DataFrame, directions: Optional[np.ndarray], path: Path, metadata: Optional[Mapping[bytes, str]] = None
+) -> None:
+    if directions is None:
+        # Rows without a usable direction: let pyarrow infer the column as-is.
+        _write_meta_parquet(df, metadata or {}, path)
+        return
+    # Rows may hold lists, float32 or float64 arrays; pyarrow refuses to mix array
+    # dtypes, so the column is rebuilt from the matrix as the legacy list<double>.
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    n, dim = directions.shape
+    values = pa.array(np.asarray(directions, dtype=np.float64).reshape(-1))
+    offsets = pa.array(np.arange(n + 1, dtype=np.int64) * dim, type=pa.int32())
+    column = pa.ListArray.from_arrays(offsets, values)
+    position = list(df.columns).index("direction")
+    table = pa.Table.from_pandas(df.drop(columns=["direction"]), preserve_index=False)
+    table = table.add_column(position, "direction", column)
+    if metadata:
+        table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    pq.write_table(table, path, row_group_size=_ROW_GROUP_SIZE)
 
-def load_database(source: str | Path) -> PandasCarlosDatabase:
+
+def _write_meta_parquet(df: pd.DataFrame, metadata: Mapping[bytes, str], path: Path) -> None:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    table = table.replace_schema_metadata({**(table.schema.metadata or {}), **metadata})
+    pq.write_table(table, path, row_group_size=_ROW_GROUP_SIZE)
+
+
+def _read_parquet_columns(path: Path) -> list[str]:
+    import pyarrow.parquet as pq
+
+    return list(pq.read_schema(path).names)
+
+
+def load_database(
+    source: str | Path,
+    *,
+    columns: Optional[Sequence[str]] = None,
+    lazy: bool = False,
+    mmap: bool = True,
+    apply_deltas: bool = True,
+) -> PandasCarlosDatabase:
+    """
+    Load a parquet database.
+
+    If the parquet file has no `direction` column and a direction sidecar
+    (`directions_sidecar_path`) exists next to it, directions are read from the sidecar -- memory-mapped read-only
+    when `mmap=True`, so no direction data is copied at load time.
+
+    Delta segments written by `checkpoint()` are replayed on top of the base file in
+    order (merged by key, later wins) unless `apply_deltas=False`. On a memory-mapped
+    sidecar, updated rows are patched into a copy-on-write mapping (only their pages are
+    copied); if the segments insert rows, they are compacted into a new base first, which
+    is then mapped.
+
+    A persisted ANN index (`<stem>.ivf.npz`) and quantized codecs (`<stem>.<kind>.npz`,
+    see `db.quantized_directions`) are picked up if they still match the rows.
+
+    columns:
+      Load only these columns (plus RETRIEVAL_COLUMNS, which are always loaded). Other
+      columns stay on disk; they are placeholders (None) in `to_dataframe()`.
+    lazy:
+      Read the deferred columns on demand, per row, when rows are requested through
+      `get_row` / `rows_at` (e.g. for the final top-k of `retrieve()`). With `lazy=True`
+      and no `columns`, only RETRIEVAL_COLUMNS are loaded up front.
+
+    Saving or compacting a projected database loads the deferred columns first.
+    """
     path = Path(source)
     if not path.exists():
         raise FileNotFoundError(f"Database path does not exist: {path}")
     if path.suffix.lower() != ".parquet":
         raise ValueError(f"Expected a .parquet file, got: {path.name}")
 
-    df = pd.read_parquet(path)
-    return PandasCarlosDatabase(df=df, path=path)
\ No newline at end of file
+    wanted: Optional[list[str]] = None
+    if columns is not None or lazy:
+        available = _read_parquet_columns(path)
+        unknown = sorted(set(columns or ()) - set(available) - {"direction"})
+        if unknown:
+            raise KeyError(f"Unknown column(s) {unknown} in {path.name}")
+        wanted = list(dict.fromkeys([*RETRIEVAL_COLUMNS, *(columns or ())]))
+
+    segments = _segment_paths(path) if apply_deltas else []
+    db = _load_base(path, mmap=mmap, columns=wanted, copy_on_write=bool(segments))
+    if wanted is not None:
+        db._column_order = tuple(_read_parquet_columns(path))
+        deferred = tuple(c for c in _read_parquet_columns(path) if c not in wanted)
+        if deferred:
+            db._deferred_columns = deferred
+            db._deferred_source = path
+            db._source_rows = np.arange(len(db.df), dtype=np.int64)
+            db._lazy = bool(lazy)
+    ann_path = ann_index_path(path)
+    if ann_path.exists():
+        index = IVFIndex.load(ann_path)
+        if index.matches(db.vector_matrix()):
+            db._ann = index
+    codes_paths = {kind: quantized_codes_path(path, kind) for kind in QUANTIZATION_KINDS}
+    codes_paths = {kind: p for kind, p in codes_paths.items() if p.exists()}
+    generation = _base_generation(path) if codes_paths else None
+    if generation is not None:
+        # Matched by the base file's generation, not by hashing the (mapped) directions.
+        for kind, p in codes_paths.items():
+            codec, saved = load_codec(p)
+            if saved == generation:
+                db._codecs[kind] = codec
+    for seg in segments:
+        db.upsert_many(pd.read_parquet(seg).to_dict("records"))
+    if segments:
+        db._segment_seq = int(segments[-1].stem)
+    db._dirty_keys.clear()
+    if segments and mmap and db.direction_storage == "npy" and db._matrix is None:
+        # Inserted rows: the mapped block cannot grow, and rebuilding the matrix would copy
+        # every row into memory. Fold the segments into a new base and map that instead.
+        try:
+            db.compact()
+        except OSError:
+            return db  # e.g. a read-only location; keep the in-memory copy
+        return load_database(path, columns=columns, lazy=lazy, mmap=mmap)
+    return db
+
+
+def _load_base(
+    path: Path, *, mmap: bool, columns: Optional[Sequence[str]] = None, copy_on_write: bool = False
+) -> PandasCarlosDatabase:
+    meta = _sidecar_meta(path)
+    sidecar = directions_sidecar_path(path)
+    available = _read_parquet_columns(path)
+    read_cols = None if columns is None else [c for c in columns if c in available]
+    if meta is not None and not sidecar.exists():
+        raise FileNotFoundError(f"{path.name} names direction sidecar {sidecar.name}, which does not exist")
+    if "direction" in available or not sidecar.exists():
+        df = pd.read_parquet(path, columns=read_cols)
+        return PandasCarlosDatabase(df=df, path=path)
+
+    df = pd.read_parquet(path, columns=read_cols)
+    # Copy-on-write ("c") lets replayed updates patch rows without touching the file.
+    directions = np.load(sidecar, mmap_mode=("c" if copy_on_write else "r") if mmap else None)
+    expected_rows = len(df) if meta is None else int(meta["rows"])
+    if directions.ndim != 2 or directions.shape[0] != len(df) or expected_rows != len(df):
+        raise ValueError(
+            f"Direction sidecar {sidecar.name} has shape {directions.shape}, "
+            f"expected ({len(df)}, D) to match {path.name}"
+        )
+    directions = directions.astype(np.float32, copy=False)
+    # Per-row views into the block keep the DataFrame API intact without copying.
+    df["direction"] = list(directions) if len(df) else []
+    db = PandasCarlosDatabase(df=df, path=path, direction_storage="npy")
+    db._matrix = VectorMatrix.from_arrays(
+        keys=db.df[db.key_column].to_numpy(),
+        directions=directions,
+        strength=_float_column(db.df, "strength"),
+        consistency=_float_column(db.df, "consistency"),
+    )
+    return db
+
+
+def convert_to_columnar(source: str | Path, dest: str | Path | None = None) -> Path:
+    """
+    Convert a list-column parquet database (e.g. the bundled `metrics_database.parquet`)
+    to the memory-mappable layout: `dest` parquet without `direction` plus a float32
+    `<stem>.<generation>.directions.npy` sidecar. Converts in place when `dest` is None.
+    """
+    db = load_database(source, mmap=False)
+    db.vector_matrix()
+    return db.save_parquet(dest if dest is not None else db.path, direction_storage="npy")
@@ -0,0 +1,206 @@
+# src/carlos/embedding_cache.py
+"""
+Caches for CLIP text embeddings used at retrieval time.
+
+Baseline embeddings of the query-independent retrieval prompts are identical for every
+query, so they are computed once per (CLIP model, prompt set) and kept in memory and on
+disk as `<model>-<prompt set hash>.npy`. A read-only directory of such files, for example
+one baked into a deployment image, can be searched before anything is computed.
+
+Query representations (the averaged prompt diff for one query) are cached in a bounded
+LRU keyed on normalized query text, CLIP model and prompt set, optionally backed by one
+`.npy` file per query that survives restarts.
+
+Embeddings may differ in the last bits between devices; the caches do not distinguish them.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+
+MODEL_VARIANT_ATTR = "carlos_variant"  # set on models whose weights were transformed, e.g. "int8"
+
+
+def prompt_set_hash(prompts: Sequence[str]) -> str:
+    """Content hash of an ordered prompt list (order matters: rows align with prompts)."""
+    h = hashlib.sha256()
+    for p in prompts:
+        data = p.encode("utf-8")
+        h.update(len(data).to_bytes(8, "little"))
+        h.update(data)
+    return h.hexdigest()[:16]
+
+
+def model_fingerprint(model: Any) -> str:
+    """
+    `<name or path>@<hub revision>` of a transformers model ("local" if unknown), with
+    `+<variant>` for transformed weights (e.g. int8-quantized).
+    """
+    config = getattr(model, "config", None)
+    name = getattr(config, "_name_or_path", None) or type(model).__name__
+    revision = getattr(config, "_commit_hash", None) or "local"
+    variant = getattr(model, MODEL_VARIANT_ATTR, None)
+    return f"{name}@{revision}" + (f"+{variant}" if variant else "")
+
+
+def baseline_filename(model_key: str, prompts_hash: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model_key).strip("_")
+    return f"{slug}-{prompts_hash}.npy"
+
+
+class BaselineEmbeddingCache:
+    """
+    Thread-safe (model, prompt set) -> [N, D] float32 embedding cache.
+
+    Lookup order: memory, `precomputed_dir` (read-only), `cache_dir`, then `compute()`
+    (whose result is written to `cache_dir` when one is given).
+    """
+
+    def __init__(self, *, precomputed_dir: Optional[Path] = None) -> None:
+        self._precomputed_dir = precomputed_dir
+        self._memory: Dict[Tuple[str, str], np.ndarray] = {}
+        self._lock = threading.Lock()
+
+    def get(
+        self,
+        model_key: str,
+        prompts: Sequence[str],
+        compute: Callable[[], np.ndarray],
+        *,
+        cache_dir: Optional[Path] = None,
+    ) -> np.ndarray:
+        key = (model_key, prompt_set_hash(prompts))
+        with self._lock:
+            cached = self._memory.get(key)
+        if cached is not None:
+            return cached
+
+        name = baseline_filename(*key)
+        dirs = [d for d in (self._precomputed_dir, cache_dir) if d is not None]
+        emb = None
+        for d in dirs:
+            emb = _read_embeddings(Path(d) / name, rows=len(prompts))
+            if emb is not None:
+                break
+        if emb is None:
+            emb = np.ascontiguousarray(compute(), dtype=np.float32)
+            if emb.ndim != 2 or emb.shape[0] != len(prompts):
+                raise ValueError(f"Expected embeddings of shape ({len(prompts)}, D), got {emb.shape}")
+            if cache_dir is not None:
+                _write_embeddings(Path(cache_dir) / name, emb)
+        emb.setflags(write=False)
+
+        with self._lock:
+            return self._memory.setdefault(key, emb)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._memory.clear()
+
+
+def normalize_query(query: str) -> str:
+    # The CLIP tokenizer lowercases and collapses whitespace, so these variants embed identically.
+    return " ".join(query.split()).lower()
+
+
+def query_cache_key(query: str, model_key: str, prompts_hash: str) -> str:
+    return f"{model_key}\x00{prompts_hash}\x00{normalize_query(query)}"
+
+
+class QueryEmbeddingCache:
+    """
+    Thread-safe LRU of query representations with hit/miss counters.
+
+    Holds at most `max_entries` vectors in memory. With `cache_dir`, entries are also
+    written there (one file per key) and read back on a memory miss, e.g. after a restart.
+    """
+
+    def __init__(self, max_entries: int = 4096, *, cache_dir: Optional[Path] = None) -> None:
+        self.max_entries = int(max_entries)
+        self.cache_dir = None if cache_dir is None else Path(cache_dir)
+        self._entries: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "disk_hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._counters["hits"] += 1
+                return value
+        value = self._read(key)
+        with self._lock:
+            if value is None:
+                self._counters["misses"] += 1
+                return None
+            self._counters["hits"] += 1
+            self._counters["disk_hits"] += 1
+            self._insert(key, value)
+        return value
+
+    def put(self, key: str, value: np.ndarray) -> None:
+        value = np.array(value, dtype=np.float32).reshape(-1)
+        value.setflags(write=False)
+        with self._lock:
+            self._insert(key, value)
+        if self.cache_dir is not None:
+            _write_embeddings(self._path(key), value)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {**self._counters, "entries": len(self._entries)}
+
+    def clear(self) -> None:
+        """Drop in-memory entries and reset counters (files in `cache_dir` are kept)."""
+        with self._lock:
+            self._entries.clear()
+            self._counters = dict.fromkeys(self._counters, 0)
+
+    def _insert(self, key: str, value: np.ndarray) -> None:
+        if self.max_entries <= 0:
+            return
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._counters["evictions"] += 1
+
+    def _path(self, key: str) -> Path:
+        return self.cache_dir / f"{hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]}.npy"
+
+    def _read(self, key: str) -> Optional[np.ndarray]:
+        if self.cache_dir is None:
+            return None
+        value = _read_embeddings(self._path(key), rows=None)
+        if value is not None:
+            value.setflags(write=False)
+        return value
+
+
+def _read_embeddings(path: Path, *, rows: Optional[int]) -> Optional[np.ndarray]:
+    # rows=None: a single 1-D vector is expected
+    if not path.exists():
+        return None
+    try:
+        emb = np.load(path, allow_pickle=False)
+    except (OSError, ValueError):
+        return None  # truncated/corrupt file: recompute and overwrite
+    if (emb.ndim != 1) if rows is None else (emb.ndim != 2 or emb.shape[0] != rows):
+        return None
+    return np.ascontiguousarray(emb, dtype=np.float32)
+
+
+def _write_embeddings(path: Path, emb: np.ndarray) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(tmp, "wb") as f:
+        np.save(f, emb)
+    os.replace(tmp, path)
@@ -0,0 +1,178 @@
+# src/carlos/fast_query.py
+"""
+Learned "fast" query encoder.
+
+The exact query representation averages `emb(prompt + " " + query) - emb(prompt)` over
+all retrieval prompts (about 2N text-encoder passes, N cached). `FastQueryEncoder` is a
+(ridge) least-squares linear map, optionally reduced-rank, from the CLIP text embedding
+of the bare query (one pass) to that averaged diff. It is fit offline on pairs produced
+by the exact pipeline (see `carlos.retrieve.train_fast_query_encoder`) and stored next to
+the database as `<stem>.query_encoder.npz`.
+
+The encoder records the CLIP model and prompt set it was fit for; using it with another
+model is an error.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+from .quantize import shortlist
+from .types import VectorMatrix
+
+
+def query_encoder_path(path: str | Path) -> Path:
+    """Path of the fast query encoder stored with the database file at `path`."""
+    path = Path(path)
+    return path.with_name(path.stem + ".query_encoder.npz")
+
+
+@dataclass(frozen=True)
+class FastQueryEncoder:
+    input_mean: np.ndarray  # (D_in,)
+    output_mean: np.ndarray  # (D_out,)
+    left: np.ndarray  # (D_in, r), or the full (D_in, D_out) map when `right` is None
+    right: Optional[np.ndarray]  # (r, D_out)
+    model_key: str
+    prompts_hash: str
+
+    @property
+    def rank(self) -> int:
+        return int(self.left.shape[1]) if self.right is not None else int(min(self.left.shape))
+
+    def predict(self, embeddings: np.ndarray) -> np.ndarray:
+        """Map text embeddings [..., D_in] to query representations [..., D_out]."""
+        x = np.asarray(embeddings, dtype=np.float32) - self.input_mean
+        y = x @ self.left
+        if self.right is not None:
+            y = y @ self.right
+        return (y + self.output_mean).astype(np.float32, copy=False)
+
+    def check_compatible(self, model_key: str, prompts_hash: str) -> None:
+        if (model_key, prompts_hash) != (self.model_key, self.prompts_hash):
+            raise ValueError(
+                f"Fast query encoder was fit for model {self.model_key!r} / prompt set "
+                f"{self.prompts_hash}, not {model_key!r} / {prompts_hash}; retrain it"
+            )
+
+    def save(self, path: str | Path) -> Path:
+        path = Path(path)
+        arrays = dict(
+            input_mean=self.input_mean,
+            output_mean=self.output_mean,
+            left=self.left,
+            model_key=np.asarray(self.model_key),
+            prompts_hash=np.asarray(self.prompts_hash),
+        )
+        if self.right is not None:
+            arrays["right"] = self.right
+        tmp = path.with_name(path.name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.savez(f, **arrays)
+        tmp.replace(path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "FastQueryEncoder":
+        with np.load(Path(path), allow_pickle=False) as z:
+            return cls(
+                input_mean=z["input_mean"],
+                output_mean=z["output_mean"],
+                left=z["left"],
+                right=z["right"] if "right" in z.files else None,
+                model_key=str(z["model_key"]),
+                prompts_hash=str(z["prompts_hash"]),
+            )
+
+
+def fit_fast_query_encoder(
+    embeddings: np.ndarray,
+    targets: np.ndarray,
+    *,
+    model_key: str,
+    prompts_hash: str,
+    rank: Optional[int] = None,
+    ridge: float = 1e-2,
+) -> FastQueryEncoder:
+    """
+    Ridge least squares from query embeddings [Q, D_in] to exact representations [Q, D_out].
+
+    ridge:
+      Regularization relative to the mean eigenvalue of the centered input covariance.
+    rank:
+      If set, keep only the top-`rank` directions of the fitted outputs (reduced-rank
+      regression), stored as two factors.
+    """
+    x = np.asarray(embeddings, dtype=np.float64)
+    y = np.asarray(targets, dtype=np.float64)
+    if x.ndim != 2 or y.ndim != 2 or x.shape[0] != y.shape[0] or x.shape[0] == 0:
+        raise ValueError(f"Expected [Q, D] embeddings and targets with matching Q, got {x.shape} and {y.shape}")
+    mx, my = x.mean(axis=0), y.mean(axis=0)
+    xc, yc = x - mx, y - my
+    gram = xc.T @ xc
+    lam = float(ridge) * max(float(np.trace(gram)) / gram.shape[0], 1e-12)
+    weight = np.linalg.solve(gram + lam * np.eye(gram.shape[0]), xc.T @ yc)  # (D_in, D_out)
+
+    right = None
+    if rank is not None and rank < min(weight.shape):
+        _, _, vt = np.linalg.svd(xc @ weight, full_matrices=False)
+        right = vt[: int(rank)]  # (r, D_out)
+        weight = weight @ right.T  # (D_in, r)
+
+    return FastQueryEncoder(
+        input_mean=mx.astype(np.float32),
+        output_mean=my.astype(np.float32),
+        left=weight.astype(np.float32),
+        right=None if right is None else right.astype(np.float32),
+        model_key=model_key,
+        prompts_hash=prompts_hash,
+    )
+
+
+def fidelity_report(
+    matrix: VectorMatrix,
+    exact: np.ndarray,
+    fast: np.ndarray,
+    *,
+    k: int = 10,
+    positions: Optional[np.ndarray] = None,
+) -> Mapping[str, float]:
+    """
+    How well fast representations [Q, D] reproduce the exact ones [Q, D]:
+    cosine between them (mean / 10th percentile), recall@k of the exact top-k rows and
+    top-1 agreement, scored over `positions` (all rows by default).
+    """
+    exact = np.asarray(exact, dtype=np.float32)
+    fast = np.asarray(fast, dtype=np.float32)
+    unit = lambda a: a / np.maximum(np.linalg.norm(a, axis=1, keepdims=True), 1e-8)  # noqa: E731
+    cosines = np.sum(unit(exact) * unit(fast), axis=1)
+
+    rows = matrix.normalized if positions is None else matrix.normalized[positions]
+    exact_scores = rows @ unit(exact).T  # [P, Q]
+    fast_scores = rows @ unit(fast).T
+    k = min(int(k), rows.shape[0])
+    recalls, top1 = [], []
+    for j in range(exact.shape[0]):
+        truth = shortlist(exact_scores[:, j], k)
+        got = shortlist(fast_scores[:, j], k)
+        recalls.append(len(np.intersect1d(truth, got)) / float(k))
+        top1.append(int(np.argmax(exact_scores[:, j]) == np.argmax(fast_scores[:, j])))
+    report: Dict[str, float] = {
+        "queries": float(exact.shape[0]),
+        "cosine_mean": float(cosines.mean()),
+        "cosine_p10": float(np.percentile(cosines, 10)),
+        f"recall@{k}": float(np.mean(recalls)),
+        "top1_agreement": float(np.mean(top1)),
+    }
+    return report
+
+
+def split_queries(queries: Sequence[str], *, holdout: float = 0.2, seed: int = 0) -> tuple[list[str], list[str]]:
+    """Deterministic train / held-out split of a query list (for fitting and reporting)."""
+    unique = list(dict.fromkeys(queries))
+    order = np.random.default_rng(seed).permutation(len(unique))
+    cut = len(unique) - int(round(holdout * len(unique)))
+    return [unique[i] for i in order[:cut]], [unique[i] for i in order[cut:]]
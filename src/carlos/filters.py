@@ -0,0 +1,191 @@
+# src/carlos/filters.py
+"""
+Filter expressions for `retrieve(..., where=...)`.
+
+Expressions are built from `col(name)` and compile to numpy boolean masks over the
+database's cached columns (`db.column_values(name)`), so filtering costs a few vector
+comparisons and happens before any scoring or row construction:
+
+    where = (col("model_nsfw_level") <= 1) & (col("model_download_count") >= 1_000)
+
+Missing values (None/NaN) never satisfy a comparison. The masks of the most recently
+used leaf predicates are memoized on the database (`db.memoize_filter`, an LRU of
+`FILTER_MASK_CACHE_SIZE` masks cleared by every upsert), so recurring filters such as an
+NSFW level or a popularity floor are precomputed bitmaps after their first use. Leaves
+built with `memoize=False` (e.g. from untrusted request parameters) are never cached.
+"""
+from __future__ import annotations
+
+import operator
+from dataclasses import dataclass, field
+from typing import TYPE_CHECKING, Any, Callable, Iterable, Mapping
+
+import numpy as np
+
+if TYPE_CHECKING:
+    from .database import CarlosDatabase
+
+_OPS: Mapping[str, Callable[[Any, Any], Any]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+}
+
+
+class Predicate:
+    """Base class of filter expressions; combine with `&`, `|` and `~`."""
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        """Boolean mask aligned with `db.vector_matrix()` rows."""
+        raise NotImplementedError
+
+    def __and__(self, other: "Predicate") -> "Predicate":
+        return And((self, _as_predicate(other)))
+
+    def __or__(self, other: "Predicate") -> "Predicate":
+        return Or((self, _as_predicate(other)))
+
+    def __invert__(self) -> "Predicate":
+        return Not(self)
+
+
+def _as_predicate(obj: Any) -> Predicate:
+    if not isinstance(obj, Predicate):
+        raise TypeError(f"Expected a filter expression, got {type(obj).__name__}")
+    return obj
+
+
+def _present(values: np.ndarray) -> np.ndarray:
+    if values.dtype.kind == "f":
+        return ~np.isnan(values)
+    return np.asarray([v is not None and v == v for v in values], dtype=bool)
+
+
+@dataclass(frozen=True)
+class Compare(Predicate):
+    column: str
+    op: str
+    value: Any
+    memoize: bool = field(default=True, compare=False)
+
+    def __post_init__(self) -> None:
+        if self.op not in _OPS:
+            raise ValueError(f"Unknown comparison {self.op!r}; expected one of {tuple(_OPS)}")
+        if self.value is None:
+            raise ValueError("Cannot compare against None; missing values never match")
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        if not self.memoize:
+            return self._compute(db)
+        return db.memoize_filter(self, lambda: self._compute(db))
+
+    def _compute(self, db: "CarlosDatabase") -> np.ndarray:
+        values = db.column_values(self.column)
+        present = _present(values)
+        out = np.zeros(values.shape[0], dtype=bool)
+        out[present] = np.asarray(_OPS[self.op](values[present], self.value), dtype=bool)
+        return out
+
+
+@dataclass(frozen=True)
+class IsIn(Predicate):
+    column: str
+    values: tuple
+    memoize: bool = field(default=True, compare=False)
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        if not self.memoize:
+            return self._compute(db)
+        return db.memoize_filter(self, lambda: self._compute(db))
+
+    def _compute(self, db: "CarlosDatabase") -> np.ndarray:
+        values = db.column_values(self.column)
+        wanted = [v for v in self.values if v is not None]
+        present = _present(values)
+        out = np.zeros(values.shape[0], dtype=bool)
+        if wanted:
+            out[present] = np.isin(values[present], np.asarray(wanted, dtype=values.dtype))
+        return out
+
+
+@dataclass(frozen=True)
+class And(Predicate):
+    terms: tuple[Predicate, ...]
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        out = self.terms[0].mask(db).copy()
+        for term in self.terms[1:]:
+            out &= term.mask(db)
+        return out
+
+    def __and__(self, other: Predicate) -> Predicate:
+        return And(self.terms + (_as_predicate(other),))
+
+
+@dataclass(frozen=True)
+class Or(Predicate):
+    terms: tuple[Predicate, ...]
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        out = self.terms[0].mask(db).copy()
+        for term in self.terms[1:]:
+            out |= term.mask(db)
+        return out
+
+    def __or__(self, other: Predicate) -> Predicate:
+        return Or(self.terms + (_as_predicate(other),))
+
+
+@dataclass(frozen=True)
+class Not(Predicate):
+    term: Predicate
+
+    def mask(self, db: "CarlosDatabase") -> np.ndarray:
+        return ~self.term.mask(db)
+
+
+class Column:
+    """Builder for predicates on one column; see `col()`."""
+
+    __slots__ = ("name",)
+
+    def __init__(self, name: str) -> None:
+        self.name = name
+
+    def __eq__(self, value: Any) -> Predicate:  # type: ignore[override]
+        return Compare(self.name, "==", value)
+
+    def __ne__(self, value: Any) -> Predicate:  # type: ignore[override]
+        return Compare(self.name, "!=", value)
+
+    def __lt__(self, value: Any) -> Predicate:
+        return Compare(self.name, "<", value)
+
+    def __le__(self, value: Any) -> Predicate:
+        return Compare(self.name, "<=", value)
+
+    def __gt__(self, value: Any) -> Predicate:
+        return Compare(self.name, ">", value)
+
+    def __ge__(self, value: Any) -> Predicate:
+        return Compare(self.name, ">=", value)
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def isin(self, values: Iterable[Any]) -> Predicate:
+        return IsIn(self.name, tuple(values))
+
+    def between(self, low: Any, high: Any) -> Predicate:
+        """Inclusive on both ends."""
+        return (self >= low) & (self <= high)
+
+    def __repr__(self) -> str:
+        return f"col({self.name!r})"
+
+
+def col(name: str) -> Column:
+    """Start a filter expression on column `name`, e.g. `col("model_nsfw_level") <= 1`."""
+    return Column(name)
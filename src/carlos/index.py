@@ -5,7 +5,6 @@ from dataclasses import dataclass
 from pathlib import Path
 import shutil
 import tempfile
-import time
 from typing import Optional, Any, Dict
 import zipfile
 import os
@@ -24,6 +23,8 @@ from transformers import CLIPProcessor, CLIPModel
 from .generative_prompts import prompts_for_indexing, mini_set_of_prompts_for_quick_tests, micro_set_of_prompts_for_quick_tests
 from .config import IndexingConfig, CIVITAI_API_KEY_ENV
 from .database import * 
+from .model_loading import LoadPolicy, load_concurrently, retry_call
+from .model_registry import MODEL_REGISTRY
 from .types import CarlosVector, IndexingResult
 
 
@@ -167,58 +168,62 @@ def _download_lora(model_id, version_id, download_directory, debug=False, civita
     print(f"Downloaded LoRA version {version_id} for model {model_id} to {target_saved_file_path}")
     return target_saved_file_path, version_metadata, model_metadata
 
-def _load_lora_weights_with_retries(pipe, lora_model_path, max_retries=5, wait_seconds=10):
+def _load_lora_weights_with_retries(pipe, lora_model_path, max_retries=3):
     if lora_model_path is not None:
-        for i in range(max_retries):
-            try:
-                pipe.load_lora_weights(lora_model_path, adapter_name=os.path.basename(lora_model_path).replace(".safetensors", ""))
-                success = True
-                break
-            except:
-                print("Retrying to load LoRA weights...")
-                time.sleep(wait_seconds)
-                success = False
-        
-        if not success:
-            raise RuntimeError(f"Failed to load LoRA weights from {lora_model_path} after multiple attempts.")
+        # A local file: only transient I/O errors are retried (see carlos.model_loading).
+        retry_call(
+            lambda: pipe.load_lora_weights(lora_model_path, adapter_name=os.path.basename(lora_model_path).replace(".safetensors", "")),
+            what=f"LoRA weights from {lora_model_path}",
+            policy=LoadPolicy(max_attempts=max_retries),
+        )
     else:
-        success = True
         print("No LoRA weights to load, proceeding without LoRA.")
     return pipe
     
-def _get_SDXL_pipeline(models_cache_dir=None, device="cuda"):
+def _get_SDXL_pipeline(models_cache_dir=None, device="cuda", local_files_only=False, max_retries=3):
     model_id = "stabilityai/stable-diffusion-xl-base-1.0"
-    pipe = StableDiffusionXLPipeline.from_pretrained(model_id, torch_dtype=torch.float16, cache_dir=models_cache_dir)
+    policy = LoadPolicy(local_files_only=local_files_only, max_attempts=max_retries)
+    pipe = retry_call(
+        lambda: StableDiffusionXLPipeline.from_pretrained(
+            model_id, torch_dtype=torch.float16, cache_dir=models_cache_dir, **policy.pretrained_kwargs()
+        ),
+        what=f"SDXL pipeline {model_id}",
+        policy=policy,
+    )
     pipe = pipe.to(device)
     pipe.safety_checker = None
     return pipe
 
-def _load_clip_model(models_cache_dir=None, device="cuda", max_retries=5, wait_seconds=10):
-    model_name = "openai/clip-vit-base-patch32"  # You can replace with another CLIP model
-    for i in range(max_retries):
-        try:
-            model = CLIPModel.from_pretrained(model_name, cache_dir=models_cache_dir).to(device)
-            success = True
-            break
-        except:
-            print("Retrying to load CLIP model...")
-            time.sleep(wait_seconds)
-            success = False
-    if not success:
-            raise RuntimeError(f"Failed to load CLIP model from {model_name} after multiple attempts.")
-            
-    for i in range(max_retries):
-        try:
-            processor = CLIPProcessor.from_pretrained(model_name, cache_dir=models_cache_dir)
-            success = True
-            break
-        except:
-            print("Retrying to load CLIP processor...")
-            time.sleep(wait_seconds)
-            success = False
-    if not success:
-            raise RuntimeError(f"Failed to load CLIP processor from {model_name} after multiple attempts.")
-
+_CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"  # You can replace with another CLIP model
+
+def _load_clip_model(models_cache_dir=None, device="cuda", max_retries=3, local_files_only=False):
+    # Cached in the shared model registry: loaded once per process, not once per LoRA.
+    return MODEL_REGISTRY.get(*_clip_registry_entry(models_cache_dir, device, max_retries, local_files_only))
+
+def _clip_model_lease(models_cache_dir=None, device="cuda", max_retries=3, local_files_only=False):
+    # Like _load_clip_model, but pinned (never evicted) for the duration of a `with` block.
+    return MODEL_REGISTRY.lease(*_clip_registry_entry(models_cache_dir, device, max_retries, local_files_only))
+
+def _clip_registry_entry(models_cache_dir, device, max_retries, local_files_only):
+    key = ("clip", _CLIP_MODEL_NAME, str(models_cache_dir or ""), device, "float32")
+    return key, lambda: _load_clip_model_from_disk(models_cache_dir, device, max_retries, local_files_only)
+
+def _load_clip_model_from_disk(models_cache_dir=None, device="cuda", max_retries=3, local_files_only=False):
+    model_name = _CLIP_MODEL_NAME
+    policy = LoadPolicy(local_files_only=local_files_only, max_attempts=max_retries)
+    # Weights and processor files are fetched / read in parallel.
+    model, processor = load_concurrently(
+        lambda: retry_call(
+            lambda: CLIPModel.from_pretrained(model_name, cache_dir=models_cache_dir, **policy.pretrained_kwargs()),
+            what=f"CLIP model {model_name}",
+            policy=policy,
+        ).to(device),
+        lambda: retry_call(
+            lambda: CLIPProcessor.from_pretrained(model_name, cache_dir=models_cache_dir, **policy.pretrained_kwargs()),
+            what=f"CLIP processor {model_name}",
+            policy=policy,
+        ),
+    )
     return model, processor
 
 def _is_single_prompt_dir_complete(prompt_dir, lora_name=None, number_of_images=16):
@@ -389,10 +394,12 @@ def _single_prompt_handling(pipe, with_lora, triggers, clip_model, clip_processo
                     img.save(image_path, format="PNG")
 
 def _single_lora_handling(downloaded_lora_path, lora_name, triggers, prompts, cfg: IndexingConfig = IndexingConfig()):
-    pipe = _get_SDXL_pipeline(models_cache_dir=cfg.models_cache_dir, device=cfg.device)
+    pipe = _get_SDXL_pipeline(models_cache_dir=cfg.models_cache_dir, device=cfg.device, local_files_only=cfg.local_files_only)
     pipe = _load_lora_weights_with_retries(pipe, lora_model_path=downloaded_lora_path)
-    clip_model, clip_processor = _load_clip_model(models_cache_dir=cfg.models_cache_dir, device=cfg.device)
+    with _clip_model_lease(models_cache_dir=cfg.models_cache_dir, device=cfg.device, local_files_only=cfg.local_files_only) as (clip_model, clip_processor):
+        return _generate_and_embed_all_prompts(pipe, clip_model, clip_processor, lora_name, triggers, prompts, cfg=cfg)
 
+def _generate_and_embed_all_prompts(pipe, clip_model, clip_processor, lora_name, triggers, prompts, cfg: IndexingConfig = IndexingConfig()):
     lora_dir = os.path.join(cfg.working_directory, lora_name if lora_name is not None else "no_lora")
     os.makedirs(lora_dir, exist_ok=True)
 
@@ -544,11 +551,12 @@ def index_lora(
         raise RuntimeError("CUDA device specified but not available. CUDA is required for indexing.")
 
     # If already exists and not overwriting, return existing vector/row
-    df = db.to_dataframe()
-    if "version_id" in df.columns:
-        hit = df[df["version_id"] == version_id]
-        if not hit.empty and not overwrite:
-            row = hit.iloc[0].to_dict()
+    if not overwrite:
+        try:
+            row = db.get_row(key="version_id", value=version_id)
+        except KeyError:
+            row = None
+        if row is not None:
             vec = db.get_vector(key="version_id", value=version_id)
             return IndexingResult(
                 lora_id=str(version_id),
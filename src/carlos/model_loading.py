@@ -0,0 +1,140 @@
+# src/carlos/model_loading.py
+"""
+Loading pretrained artifacts (CLIP, tokenizers / processors, SDXL, LoRA weights).
+
+- Offline first: with `local_files_only` (or `HF_HUB_OFFLINE=1`) loaders only read the
+  local Hugging Face cache and never touch the network. A cache miss fails at once
+  instead of waiting on retries; fetch the models on a connected machine and copy the
+  cache (`models_cache_dir`) to air-gapped nodes.
+- Retries only for transient failures: dropped or refused connections, timeouts,
+  HTTP 408/429/5xx. They back off exponentially with full jitter (a random delay up to
+  `base_delay_s * 2**attempt`, capped at `max_delay_s`). Missing files, missing or gated
+  repos, unresolvable hosts (no network at all) and programming errors fail on the
+  first attempt.
+- `load_concurrently` runs independent loads (model weights, tokenizer files) in
+  parallel threads.
+
+Failures are raised as RuntimeError chained to the original exception. This module
+imports neither torch nor the Hugging Face libraries; errors are classified by type
+name, HTTP status and cause chain.
+"""
+from __future__ import annotations
+
+import os
+import random
+import socket
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, Optional, Tuple, TypeVar
+
+T = TypeVar("T")
+
+RETRYABLE_HTTP_STATUS: frozenset = frozenset({408, 429, 500, 502, 503, 504})
+
+# Type names (anywhere in an exception's MRO) of transient transport errors raised by
+# requests / httpx / urllib3 / http.client.
+_TRANSIENT_ERROR_NAMES = frozenset({
+    "ConnectionError", "ConnectError", "ConnectTimeout", "ReadTimeout", "WriteTimeout", "PoolTimeout",
+    "Timeout", "TimeoutException", "RemoteProtocolError", "ProtocolError", "ChunkedEncodingError",
+    "IncompleteRead", "ReadError", "WriteError",
+})
+# Errors that no retry can fix, even when raised while talking to the hub.
+_PERMANENT_ERROR_NAMES = frozenset({
+    "RepositoryNotFoundError", "GatedRepoError", "RevisionNotFoundError", "DisabledRepoError",
+})
+
+
+def hub_offline() -> bool:
+    """Whether `HF_HUB_OFFLINE` disables network access for the Hugging Face libraries."""
+    return os.getenv("HF_HUB_OFFLINE", "").strip().lower() in ("1", "true", "yes", "on")
+
+
+@dataclass(frozen=True)
+class LoadPolicy:
+    """How a loader reaches the hub and retries; see the module docstring."""
+
+    local_files_only: bool = False
+    max_attempts: int = 3
+    base_delay_s: float = 1.0
+    max_delay_s: float = 16.0
+
+    def __post_init__(self) -> None:
+        if self.max_attempts < 1:
+            raise ValueError(f"max_attempts must be >= 1, got {self.max_attempts}")
+
+    @property
+    def offline(self) -> bool:
+        return self.local_files_only or hub_offline()
+
+    def pretrained_kwargs(self) -> Dict[str, Any]:
+        """Extra keyword arguments for `from_pretrained` calls."""
+        return {"local_files_only": True} if self.local_files_only else {}
+
+    def delay(self, attempt: int, rng: Optional[random.Random] = None) -> float:
+        """Seconds to wait after failed attempt number `attempt` (0-based)."""
+        cap = min(self.max_delay_s, self.base_delay_s * (2 ** attempt))
+        return (rng or random).uniform(0.0, cap)
+
+
+def is_retryable(error: BaseException) -> bool:
+    """Whether `error` (or an exception in its cause chain) is a transient failure."""
+    seen = set()
+    e: Optional[BaseException] = error
+    retryable = False
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        names = {cls.__name__ for cls in type(e).__mro__}
+        if names & _PERMANENT_ERROR_NAMES or isinstance(e, socket.gaierror):
+            return False  # gaierror: the host name does not resolve, i.e. no network
+        status = getattr(getattr(e, "response", None), "status_code", None)
+        if status is not None:
+            if int(status) not in RETRYABLE_HTTP_STATUS:
+                return False
+            retryable = True
+        elif isinstance(e, (ConnectionError, TimeoutError)) or names & _TRANSIENT_ERROR_NAMES:
+            retryable = True
+        e = e.__cause__ or e.__context__
+    return retryable
+
+
+def retry_call(
+    load: Callable[[], T],
+    *,
+    what: str,
+    policy: LoadPolicy = LoadPolicy(),
+    sleep: Callable[[float], None] = time.sleep,
+    rng: Optional[random.Random] = None,
+    ) -> T:
+    """
+    `load()`, retried with jittered exponential backoff while it fails with a retryable
+    error (never in offline mode). Raises RuntimeError naming `what` otherwise.
+    """
+    for attempt in range(policy.max_attempts):
+        try:
+            return load()
+        except Exception as e:
+            retry = not policy.offline and is_retryable(e) and attempt + 1 < policy.max_attempts
+            if not retry:
+                hint = ""
+                if policy.offline:
+                    hint = " (offline: only the local model cache was searched; populate models_cache_dir on a connected machine)"
+                raise RuntimeError(
+                    f"Failed to load {what} after {attempt + 1} attempt(s){hint}: {type(e).__name__}: {e}"
+                ) from e
+            wait = policy.delay(attempt, rng)
+            print(f"Retrying to load {what} in {wait:.1f}s ({type(e).__name__}: {e})")
+            sleep(wait)
+    raise AssertionError("unreachable")
+
+
+def load_concurrently(*loads: Callable[[], Any]) -> Tuple[Any, ...]:
+    """Run independent loaders in parallel threads; results in argument order.
+
+    Every loader runs to completion; the first failure (in argument order) is raised.
+    """
+    if len(loads) <= 1:
+        return tuple(load() for load in loads)
+    with ThreadPoolExecutor(max_workers=len(loads), thread_name_prefix="carlos-load") as pool:
+        futures = [pool.submit(load) for load in loads]
+        return tuple(f.result() for f in futures)
@@ -0,0 +1,190 @@
+# src/carlos/model_registry.py
+"""
+Process-wide registry of loaded models (CLIP for retrieval and indexing).
+
+- Single-flight: concurrent requests for the same key wait for one load instead of
+  loading in parallel.
+- Reference counting: `lease()` / `acquire()` pin an entry while it is in use; pinned
+  entries are never evicted. `get()` returns a cached entry without pinning it.
+- Memory budget: when the estimated size of all entries exceeds the budget, unpinned
+  entries are evicted least recently used first (the most recently used one is always
+  kept). An evicted model is freed once its last caller drops it. Caches built from a
+  model (e.g. prompt key/values) are charged to its entry with `add_nbytes()`. The
+  budget comes from `CARLOS_MODEL_MEMORY_BUDGET_MB` or
+  `MODEL_REGISTRY.set_memory_budget(...)`; unset means unbounded.
+
+Keys are tuples such as `(kind, model name, cache dir, device, dtype)`.
+"""
+from __future__ import annotations
+
+import os
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Hashable, Iterator, Optional
+
+MODEL_MEMORY_BUDGET_ENV = "CARLOS_MODEL_MEMORY_BUDGET_MB"
+
+
+def estimate_nbytes(obj: Any) -> int:
+    """Bytes held by the tensors of a model (or a tuple of models / tokenizers)."""
+    if isinstance(obj, (tuple, list)):
+        return sum(estimate_nbytes(x) for x in obj)
+    state_dict = getattr(obj, "state_dict", None)
+    if not callable(state_dict):
+        return 0
+    return sum(_tensor_nbytes(v) for v in state_dict().values())
+
+
+def _tensor_nbytes(value: Any) -> int:
+    if isinstance(value, (tuple, list)):  # e.g. packed params of quantized linears
+        return sum(_tensor_nbytes(v) for v in value)
+    if hasattr(value, "numel") and hasattr(value, "element_size"):
+        return int(value.numel()) * int(value.element_size())
+    return 0
+
+
+@dataclass
+class _Entry:
+    ready: threading.Event = field(default_factory=threading.Event)
+    value: Any = None
+    error: Optional[BaseException] = None
+    nbytes: int = 0
+    refs: int = 0
+
+
+class ModelRegistry:
+    """Thread-safe key -> loaded model cache (see the module docstring)."""
+
+    def __init__(self, memory_budget_bytes: Optional[int] = None) -> None:
+        self._budget = memory_budget_bytes
+        self._entries: "OrderedDict[Hashable, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._counts = {"loads": 0, "hits": 0, "waits": 0, "evictions": 0, "failures": 0}
+
+    def set_memory_budget(self, memory_budget_bytes: Optional[int]) -> None:
+        with self._lock:
+            self._budget = memory_budget_bytes
+            self._evict_locked()
+
+    def get(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """The model for `key`, loading it with `load()` on a miss (not pinned)."""
+        value = self.acquire(key, load)
+        self.release(key)
+        return value
+
+    def acquire(self, key: Hashable, load: Callable[[], Any]) -> Any:
+        """Like `get`, but pins the entry until the matching `release(key)`."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                entry.refs += 1
+                self._entries.move_to_end(key)
+                if entry.ready.is_set():
+                    self._counts["hits"] += 1
+                    return entry.value
+                self._counts["waits"] += 1
+                loader = False
+            else:
+                entry = self._entries[key] = _Entry(refs=1)
+                loader = True
+
+        if not loader:
+            entry.ready.wait()
+            if entry.error is not None:
+                with self._lock:
+                    entry.refs -= 1
+                raise entry.error
+            return entry.value
+
+        try:
+            value = load()
+        except BaseException as e:
+            with self._lock:
+                self._counts["failures"] += 1
+                entry.error = e
+                entry.refs -= 1
+                if self._entries.get(key) is entry:
+                    del self._entries[key]  # the next caller retries
+            entry.ready.set()
+            raise
+        nbytes = estimate_nbytes(value)
+        with self._lock:
+            self._counts["loads"] += 1
+            entry.value, entry.nbytes = value, nbytes
+            entry.ready.set()
+            self._evict_locked()
+        return value
+
+    def release(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry.refs <= 0:
+                raise KeyError(f"release() without acquire() for {key!r}")
+            entry.refs -= 1
+            self._evict_locked()
+
+    def add_nbytes(self, key: Hashable, nbytes: int, *, owner: Any = None) -> None:
+        """
+        Charge `nbytes` (negative to refund) of data derived from a loaded entry to the
+        budget. Ignored unless `key` is loaded and, with `owner`, holds that object.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or not entry.ready.is_set():
+                return
+            held = entry.value if isinstance(entry.value, (tuple, list)) else (entry.value,)
+            if owner is not None and not any(v is owner for v in held):
+                return
+            entry.nbytes = max(0, entry.nbytes + int(nbytes))
+            self._evict_locked()
+
+    @contextmanager
+    def lease(self, key: Hashable, load: Callable[[], Any]) -> Iterator[Any]:
+        """`acquire` for the duration of a `with` block."""
+        value = self.acquire(key, load)
+        try:
+            yield value
+        finally:
+            self.release(key)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            ready = [e for e in self._entries.values() if e.ready.is_set()]
+            return dict(
+                self._counts,
+                entries=len(ready),
+                in_use=sum(1 for e in ready if e.refs > 0),
+                bytes=sum(e.nbytes for e in ready),
+                budget_bytes=-1 if self._budget is None else int(self._budget),
+            )
+
+    def clear(self) -> None:
+        """Drop every unpinned entry (pinned ones stay until released)."""
+        with self._lock:
+            for key in [k for k, e in self._entries.items() if e.ready.is_set() and e.refs == 0]:
+                del self._entries[key]
+
+    def _evict_locked(self) -> None:
+        if self._budget is None:
+            return
+        total = sum(e.nbytes for e in self._entries.values())
+        for key in list(self._entries)[:-1]:  # least recently used first; keep the newest
+            if total <= self._budget:
+                break
+            entry = self._entries[key]
+            if entry.refs == 0 and entry.ready.is_set():
+                del self._entries[key]
+                total -= entry.nbytes
+                self._counts["evictions"] += 1
+
+
+def _budget_from_env() -> Optional[int]:
+    raw = os.getenv(MODEL_MEMORY_BUDGET_ENV)
+    if raw is None or raw.strip() == "":
+        return None
+    return int(float(raw) * 1024 * 1024)
+
+
+MODEL_REGISTRY = ModelRegistry(memory_budget_bytes=_budget_from_env())
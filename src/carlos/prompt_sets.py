@@ -0,0 +1,111 @@
+# src/carlos/prompt_sets.py
+"""
+Named retrieval-prompt sets and subset selection.
+
+The query representation averages per-prompt diffs `emb(prompt + " " + query) - emb(prompt)`
+over every retrieval prompt, so its cost grows with the number of prompts. A named
+prompt set is a subset chosen on calibration queries to preserve that average (and the
+rankings it produces), saved as `<name>.json` and selected with
+`RetrievalConfig(prompt_set=<name>)`. "all" is the full `prompts_for_retrieval()` list.
+
+Selection is greedy forward selection: each step adds the prompt whose inclusion brings
+the subset average closest (by cosine, summed over calibration queries) to the full one.
+"""
+from __future__ import annotations
+
+import json
+import os
+import re
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Dict, Mapping, Optional, Sequence
+
+import numpy as np
+
+from .fast_query import fidelity_report
+from .types import VectorMatrix
+
+ALL_PROMPTS = "all"
+# Prompt set names become file names in `prompt_sets_dir`: no separators, no leading dot.
+_NAME_RE = re.compile(r"[A-Za-z0-9_][A-Za-z0-9_.-]*")
+
+
+def _check_name(name: str) -> str:
+    if not isinstance(name, str) or not _NAME_RE.fullmatch(name):
+        raise ValueError(f"Invalid prompt set name {name!r}: use letters, digits, '_', '.' or '-'")
+    return name
+
+
+@dataclass(frozen=True)
+class PromptSet:
+    name: str
+    prompts: tuple[str, ...]
+    meta: Mapping[str, Any] = field(default_factory=dict)  # source hash, fidelity report, ...
+
+    def save(self, directory: str | Path) -> Path:
+        directory = Path(directory)
+        path = directory / f"{_check_name(self.name)}.json"
+        directory.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"name": self.name, "prompts": list(self.prompts), "meta": dict(self.meta)}, indent=2))
+        os.replace(tmp, path)
+        return path
+
+    @classmethod
+    def load(cls, path: str | Path) -> "PromptSet":
+        data = json.loads(Path(path).read_text())
+        return cls(name=str(data["name"]), prompts=tuple(data["prompts"]), meta=data.get("meta", {}))
+
+
+def find_prompt_set(name: str, directories: Sequence[Optional[Path]]) -> Path:
+    """Path of `<name>.json` in the first directory that has it."""
+    _check_name(name)
+    for d in directories:
+        if d is not None and (Path(d) / f"{name}.json").exists():
+            return Path(d) / f"{name}.json"
+    searched = [str(d) for d in directories if d is not None]
+    raise KeyError(f"Unknown prompt set {name!r} (searched {searched})")
+
+
+def greedy_prompt_subset(diffs: np.ndarray, size: int) -> np.ndarray:
+    """
+    Greedy order of up to `size` prompt indices for per-prompt diffs [Q, N, D], chosen
+    to keep each query's subset average aligned with its full average.
+    """
+    d = np.asarray(diffs, dtype=np.float32)
+    q, n, _ = d.shape
+    size = min(int(size), n)
+    target = d.mean(axis=1)
+    target /= np.maximum(np.linalg.norm(target, axis=1, keepdims=True), 1e-8)
+    proj = np.einsum("qnd,qd->qn", d, target)  # each prompt's contribution along the target
+    sq = np.einsum("qnd,qnd->qn", d, d)
+
+    chosen: list[int] = []
+    total = np.zeros_like(target)  # running sum of chosen diffs, per query
+    available = np.ones(n, dtype=bool)
+    for _ in range(size):
+        # cos(total + d_i, target) for every candidate i, without materializing total + d_i
+        dot = (total * target).sum(axis=1)[:, None] + proj
+        norm2 = (total * total).sum(axis=1)[:, None] + 2.0 * np.einsum("qd,qnd->qn", total, d) + sq
+        score = (dot / np.sqrt(np.maximum(norm2, 1e-12))).sum(axis=0)
+        score[~available] = -np.inf
+        best = int(np.argmax(score))
+        chosen.append(best)
+        available[best] = False
+        total += d[:, best]
+    return np.asarray(chosen, dtype=np.int64)
+
+
+def subset_fidelity(
+    matrix: VectorMatrix,
+    diffs: np.ndarray,
+    subset: Sequence[int],
+    *,
+    k: int = 10,
+) -> Dict[str, float]:
+    """`fidelity_report` of the subset average against the full average, plus its relative cost."""
+    d = np.asarray(diffs, dtype=np.float32)
+    report = dict(fidelity_report(matrix, d.mean(axis=1), d[:, list(subset)].mean(axis=1), k=k))
+    report["prompts"] = float(len(subset))
+    report["relative_cost"] = len(subset) / float(d.shape[1])
+    return report
@@ -0,0 +1,263 @@
+# src/carlos/quantize.py
+"""
+Compressed representations of the CARLoS direction matrix for first-pass scoring.
+
+All codecs quantize the *unit-normalized* directions, so their scores approximate the
+cosine similarity that `retrieve()` ranks by. Exact float32 scores are recomputed for a
+shortlist afterwards (see `retrieve(..., quantization=..., rerank=...)`).
+
+Kinds:
+  - "float16": half-precision copy (2 bytes/dim)
+  - "int8":    per-vector scaled int8 codes (1 byte/dim + one float32 scale per row)
+  - "pq":      product quantization, `m` sub-spaces x 256 centroids (m bytes/row)
+
+Codecs are updated row by row as the database changes (`update`; pq keeps its trained
+codebooks) and persisted with `save_codec` / `load_codec`, tagged with the generation of
+the database file whose rows they encode.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, fields
+from pathlib import Path
+from typing import Any, Mapping, Optional, Sequence
+
+import numpy as np
+
+from ._kmeans import assign, kmeans
+from .types import VectorMatrix
+
+QUANTIZATION_KINDS: tuple[str, ...] = ("float16", "int8", "pq")
+
+# Rows normalized and encoded at a time when building a codec, so a memory-mapped
+# direction matrix is never copied whole.
+_ENCODE_CHUNK = 65_536
+
+
+def _grown(a: np.ndarray, n: int) -> np.ndarray:
+    # `a` with zero rows appended up to `n` rows (inserts extend the codes).
+    if n <= a.shape[0]:
+        return a
+    return np.concatenate([a, np.zeros((n - a.shape[0],) + a.shape[1:], dtype=a.dtype)])
+
+
+@dataclass
+class Float16Directions:
+    codes: np.ndarray  # (N, D) float16
+
+    @property
+    def dim(self) -> int:
+        return int(self.codes.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes)
+
+    def scores(self, query_unit: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        return self.codes[positions].astype(np.float32) @ query_unit
+
+    def update(self, positions: np.ndarray, unit_directions: np.ndarray) -> None:
+        """(Re)encode rows at `positions` (inserts may extend the codes)."""
+        self.codes = _grown(self.codes, int(positions.max()) + 1)
+        self.codes[positions] = unit_directions.astype(np.float16)
+
+
+@dataclass
+class Int8Directions:
+    codes: np.ndarray  # (N, D) int8
+    scales: np.ndarray  # (N,) float32, row = codes * scale
+
+    @property
+    def dim(self) -> int:
+        return int(self.codes.shape[1])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.scales.nbytes)
+
+    def scores(self, query_unit: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        return (self.codes[positions].astype(np.float32) @ query_unit) * self.scales[positions]
+
+    def update(self, positions: np.ndarray, unit_directions: np.ndarray) -> None:
+        """(Re)encode rows at `positions` (inserts may extend the codes)."""
+        end = int(positions.max()) + 1
+        self.codes, self.scales = _grown(self.codes, end), _grown(self.scales, end)
+        scales = np.abs(unit_directions).max(axis=1) / 127.0
+        safe = np.where(scales > 0, scales, 1.0)
+        self.codes[positions] = np.clip(np.rint(unit_directions / safe[:, None]), -127, 127).astype(np.int8)
+        self.scales[positions] = scales
+
+
+@dataclass
+class PQDirections:
+    codebooks: np.ndarray  # (M, K, D/M) float32
+    codes: np.ndarray  # (N, M) uint8
+
+    @property
+    def dim(self) -> int:
+        return int(self.codebooks.shape[0] * self.codebooks.shape[2])
+
+    @property
+    def nbytes(self) -> int:
+        return int(self.codes.nbytes + self.codebooks.nbytes)
+
+    def scores(self, query_unit: np.ndarray, positions: np.ndarray) -> np.ndarray:
+        m, _, sub = self.codebooks.shape
+        # Asymmetric distance computation: one (M, K) lookup table per query.
+        table = np.einsum("mkd,md->mk", self.codebooks, query_unit.reshape(m, sub))
+        return table[np.arange(m), self.codes[positions]].sum(axis=1, dtype=np.float32)
+
+    def update(self, positions: np.ndarray, unit_directions: np.ndarray) -> None:
+        """(Re)encode rows at `positions` with the trained codebooks (inserts may extend the codes)."""
+        m, _, sub = self.codebooks.shape
+        self.codes = _grown(self.codes, int(positions.max()) + 1)
+        for j in range(m):
+            block = np.ascontiguousarray(unit_directions[:, j * sub : (j + 1) * sub])
+            self.codes[positions, j] = assign(block, self.codebooks[j])
+
+
+_CODECS = {"float16": Float16Directions, "int8": Int8Directions, "pq": PQDirections}
+
+
+def quantize_directions(matrix: VectorMatrix, kind: str, *, pq_subspaces: int = 64, seed: int = 0) -> Any:
+    """
+    Build the `kind` codec over the unit-normalized directions of `matrix`, normalizing
+    them in chunks (`matrix.normalized` is not used).
+
+    pq_subspaces must divide the direction dim; it is reduced to the largest divisor
+    that does otherwise.
+    """
+    n, dim = len(matrix), matrix.dim
+    if kind == "float16":
+        codec: Any = Float16Directions(codes=np.zeros((0, dim), dtype=np.float16))
+    elif kind == "int8":
+        codec = Int8Directions(codes=np.zeros((0, dim), dtype=np.int8), scales=np.zeros(0, dtype=np.float32))
+    elif kind == "pq":
+        if n == 0:
+            raise ValueError("Cannot train product quantization on an empty database")
+        m = max(d for d in range(1, min(pq_subspaces, dim) + 1) if dim % d == 0)
+        sub = dim // m
+        k = min(256, n)
+        codebooks = np.zeros((m, k, sub), dtype=np.float32)
+        codes = np.empty((n, m), dtype=np.uint8)
+        safe = np.where(matrix.norms > 0, matrix.norms, np.float32(1.0))
+        for j in range(m):
+            # One sub-space at a time: (N, D/M) floats resident, not (N, D).
+            cols = slice(j * sub, (j + 1) * sub)
+            block = np.ascontiguousarray(matrix.directions[:, cols] / safe[:, None], dtype=np.float32)
+            centroids, labels = kmeans(block, k, iters=15, seed=seed + j)
+            codebooks[j, : centroids.shape[0]] = centroids
+            codes[:, j] = labels
+        return PQDirections(codebooks=codebooks, codes=codes)
+    else:
+        raise ValueError(f"Unknown quantization kind {kind!r}; expected one of {QUANTIZATION_KINDS}")
+    for start in range(0, n, _ENCODE_CHUNK):
+        positions = np.arange(start, min(start + _ENCODE_CHUNK, n))
+        codec.update(positions, matrix.unit_rows(positions))
+    return codec
+
+
+def codec_kind(codec: Any) -> str:
+    """The QUANTIZATION_KINDS name of `codec`."""
+    return next(kind for kind, cls in _CODECS.items() if isinstance(codec, cls))
+
+
+def save_codec(codec: Any, path: str | Path, *, generation: str) -> Path:
+    """Write `codec`, tagged with the generation of the database file it encodes."""
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    arrays = {f.name: getattr(codec, f.name) for f in fields(codec)}
+    with open(tmp, "wb") as f:
+        np.savez(f, kind=codec_kind(codec), generation=generation, **arrays)
+    tmp.replace(path)
+    return path
+
+
+def load_codec(path: str | Path) -> tuple[Any, str]:
+    """(codec, generation) as written by `save_codec`."""
+    with np.load(Path(path), allow_pickle=False) as z:
+        cls = _CODECS[str(z["kind"])]
+        return cls(**{f.name: z[f.name] for f in fields(cls)}), str(z["generation"])
+
+
+def shortlist(scores: np.ndarray, size: int) -> np.ndarray:
+    """Indices of the `size` highest scores (unordered)."""
+    if size >= scores.size:
+        return np.arange(scores.size)
+    return np.argpartition(-scores, size - 1)[:size]
+
+
+def recall_at_k(
+    matrix: VectorMatrix,
+    codec: Any,
+    queries: np.ndarray,
+    *,
+    k: int = 10,
+    rerank: Optional[int] = None,
+) -> float:
+    """
+    Mean fraction of the exact top-k (cosine over float32) recovered by the codec.
+
+    With `rerank`, the codec picks a shortlist of that size and it is re-scored exactly,
+    which is what `retrieve()` does; without it, the codec's own top-k is compared.
+    """
+    positions = np.arange(len(matrix))
+    hits = 0
+    for q in np.asarray(queries, dtype=np.float32):
+        q = q / max(float(np.linalg.norm(q)), 1e-8)
+        exact = matrix.normalized @ q
+        truth = set(shortlist(exact, k).tolist())
+        approx = codec.scores(q, positions)
+        if rerank is None:
+            got = shortlist(approx, k)
+        else:
+            cand = shortlist(approx, max(rerank, k))
+            got = cand[shortlist(exact[cand], k)]
+        hits += len(truth.intersection(got.tolist()))
+    return hits / float(k * len(queries))
+
+
+def proxy_queries(matrix: VectorMatrix, *, num_queries: int = 200, noise: float = 0.5, seed: int = 0) -> np.ndarray:
+    """
+    Query vectors for recall measurements that need no text encoder: stored directions
+    perturbed with Gaussian noise of relative scale `noise`, which lands them between
+    neighbours rather than on top of a single row.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), size=min(num_queries, len(matrix)), replace=False)
+    base = matrix.normalized[picks]
+    return base + noise * rng.normal(size=base.shape).astype(np.float32) / np.sqrt(matrix.dim)
+
+
+def recall_report(
+    matrix: VectorMatrix,
+    *,
+    kinds: Sequence[str] = QUANTIZATION_KINDS,
+    k: int = 10,
+    rerank: int = 100,
+    num_queries: int = 200,
+    noise: float = 0.5,
+    seed: int = 0,
+) -> Mapping[str, Mapping[str, float]]:
+    """
+    Recall@k of each codec against exact scoring, with and without exact rerank,
+    over `proxy_queries`.
+    """
+    queries = proxy_queries(matrix, num_queries=num_queries, noise=noise, seed=seed)
+    report: dict[str, dict[str, float]] = {}
+    for kind in kinds:
+        codec = quantize_directions(matrix, kind, seed=seed)
+        report[kind] = {
+            "bytes_per_vector": codec.nbytes / max(len(matrix), 1),
+            f"recall@{k}": recall_at_k(matrix, codec, queries, k=k),
+            f"recall@{k}_rerank{rerank}": recall_at_k(matrix, codec, queries, k=k, rerank=rerank),
+        }
+    return report
+
+
+if __name__ == "__main__":
+    from .bundled_db import load_bundled_database
+
+    m = load_bundled_database().vector_matrix()
+    print(f"Bundled database: {len(m)} vectors x {m.dim} dims (float32: {4 * m.dim} bytes/vector)")
+    for kind, stats in recall_report(m).items():
+        print(kind, {name: round(value, 4) for name, value in stats.items()})
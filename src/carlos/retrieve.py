@@ -1,20 +1,74 @@
 # src/carlos/retrieve.py
 from __future__ import annotations
 
-from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
 import numpy as np
 import threading
-from transformers import CLIPProcessor, CLIPModel
+import weakref
+from transformers import AutoTokenizer, CLIPTextModelWithProjection, PreTrainedTokenizerBase
 import torch
 import time
+from collections import OrderedDict
+from dataclasses import replace
+from pathlib import Path
 
 from .database import CarlosDatabase
-from .types import CarlosVector, RetrievalResult
+from .types import RetrievalResult, VectorMatrix
 from .generative_prompts import prompts_for_retrieval
 from .config import RetrievalConfig
+from .cpu_inference import configure_threads, quantize_text_encoder
+from .embedding_cache import (
+    BaselineEmbeddingCache,
+    QueryEmbeddingCache,
+    model_fingerprint,
+    prompt_set_hash,
+    query_cache_key,
+)
+from .fast_query import (
+    FastQueryEncoder,
+    fidelity_report,
+    fit_fast_query_encoder,
+    query_encoder_path,
+    split_queries,
+)
+from .filters import Predicate
+from .prompt_sets import (
+    ALL_PROMPTS,
+    PromptSet,
+    find_prompt_set,
+    greedy_prompt_subset,
+    subset_fidelity,
+    _check_name as _check_prompt_set_name,
+)
+from .model_loading import LoadPolicy, load_concurrently, retry_call
+from .model_registry import MODEL_REGISTRY
+from .prefix_encoder import PrefixKVTextEncoder, encode_queries, prefix_encoder_from_prompts
+from .vector_search import (
+    _candidate_positions,
+    _check_search_args,
+    _cosine_scores,
+    _rank_many,
+    _ranked_results,
+    _shortlist_positions,
+)
 
-_CLIP_CACHE: Dict[Tuple[str, str], Tuple[CLIPModel, CLIPProcessor]] = {}
-_CLIP_CACHE_LOCK = threading.Lock()
+_CLIP_MODEL_NAME = "openai/clip-vit-base-patch32"  # You can replace with another CLIP model
+_BASELINE_CACHE = BaselineEmbeddingCache()
+_QUERY_CACHES: Dict[Tuple[int, Optional[Path]], QueryEmbeddingCache] = {}
+_QUERY_CACHES_LOCK = threading.Lock()
+# model -> (prompt set hash, device) -> encoder. Weak on the model: dropped with it once the
+# registry evicts it and callers let go; at most _PREFIX_ENCODERS_PER_MODEL per model.
+_PREFIX_ENCODERS: "weakref.WeakKeyDictionary[Any, OrderedDict[Tuple[str, str], PrefixKVTextEncoder]]" = (
+    weakref.WeakKeyDictionary()
+)
+_PREFIX_ENCODERS_PER_MODEL = 4
+_PREFIX_ENCODERS_LOCK = threading.Lock()
+_FAST_ENCODERS: Dict[Tuple[str, int], FastQueryEncoder] = {}
+_FAST_ENCODERS_LOCK = threading.Lock()
+_PROMPT_SETS: Dict[Tuple[str, int], PromptSet] = {}
+_PROMPT_SETS_LOCK = threading.Lock()
+
+QUERY_MODES: Tuple[str, ...] = ("exact", "fast")
 
 def retrieve(
     db: CarlosDatabase,
@@ -24,16 +78,20 @@ def retrieve(
     max_strength: float = 9.8,
     min_consistency: float = 0.041,
     cfg: RetrievalConfig = RetrievalConfig(),
+    quantization: Optional[str] = None,
+    rerank: int = 100,
+    search: str = "exact",
+    nprobe: int = 16,
+    where: Optional[Predicate] = None,
+    query_mode: str = "exact",
     ) -> List[RetrievalResult]:
     """
     Retrieve top-k LoRAs from the database that best match `query`.
 
-    This file intentionally provides infrastructure only:
-      - filtering
-      - result construction
-      - ranking / top-k selection
-
-    Embedding + similarity are stubs and must be implemented later.
+    The query is turned into a CLIP text-direction representation (the mean difference
+    between the retrieval prompts with and without the query appended, or the learned
+    fast encoder), candidates are filtered on metadata, and the survivors are ranked by
+    cosine similarity to their LoRA direction with one matrix-vector product.
 
     Parameters
     ----------
@@ -47,130 +105,221 @@ def retrieve(
       Filter out rows with strength > max_strength (if provided).
     min_consistency:
       Filter out rows with consistency < min_consistency (if provided).
+    where:
+      Optional filter expression on any column, e.g.
+      `(col("model_nsfw_level") <= 1) & (col("model_download_count") >= 1000)`
+      (see `carlos.filters`). Applied as a boolean mask before scoring.
+    quantization:
+      Optional first-pass codec ("float16", "int8" or "pq", see `carlos.quantize`).
+      Candidates are scored on the compressed codes, then the best `rerank` of them are
+      re-scored exactly in float32. None scores every candidate exactly.
+    rerank:
+      Shortlist size for the exact float32 rerank when `quantization` is set.
+    search:
+      "exact" scores every candidate; "ann" only scores candidates in the `nprobe`
+      IVF cells nearest to the query (see `carlos.ann`, `db.ann_index()`).
+    nprobe:
+      Number of IVF cells probed when search="ann".
+    query_mode:
+      "exact" averages prompt diffs over all retrieval prompts; "fast" maps a single
+      text embedding of the query through the learned encoder stored with the database
+      (see `train_fast_query_encoder`, `carlos.fast_query`).
 
     Returns
     -------
     List[RetrievalResult]
-      Sorted by descending score, with rank set to 1..N.
-
-    Notes
-    -----
-    Scoring is currently a stub and will raise NotImplementedError.
+      Sorted by descending cosine score, with rank set to 1..N.
     """
     if not isinstance(query, str) or query.strip() == "":
         raise ValueError("query must be a non-empty string")
-    if top_k <= 0:
-        raise ValueError(f"top_k must be > 0, got {top_k}")
+    _check_search_args(top_k, search)
+    if query_mode not in QUERY_MODES:
+        raise ValueError(f"query_mode must be one of {QUERY_MODES}, got {query_mode!r}")
 
-    candidates = list(_iter_candidates(db, max_strength=max_strength, min_consistency=min_consistency))
-    if not candidates:
+    matrix = db.vector_matrix()
+    positions = _candidate_positions(
+        db, matrix, max_strength=max_strength, min_consistency=min_consistency, where=where
+    )
+    if positions.size == 0:
         return []
 
     if "cuda" in cfg.device and not torch.cuda.is_available():
         print("Warning: CUDA device requested but not available; falling back to CPU.")
         cfg = cfg.with_overrides(device="cpu")
 
-    # ---- Scoring stub (to be replaced by your actual embedding + similarity) ----
-    query_repr = _embed_query_stub(query, cfg=cfg)
-
-    scored: List[Tuple[float, Dict[str, Any], CarlosVector]] = []
-    for row, vec in candidates:
-        score = _score_stub(query_repr, vec, row=row)
-        scored.append((float(score), row, vec))
-
-    # Sort: high score first. Keep deterministic tie-breaking by lora_id (version_id).
-    scored.sort(key=lambda t: (-t[0], str(t[1].get("version_id", ""))))
-
-    # Top-k and build RetrievalResult with ranks
-    out: List[RetrievalResult] = []
-    for i, (score, row, vec) in enumerate(scored[:top_k], start=1):
-        out.append(
-            RetrievalResult.from_row(
-                row,
-                score=score,
-                rank=i,
-                vector=vec,
-                id_column="version_id",
-            )
-        )
-    return out
+    if query_mode == "fast":
+        query_repr = torch.from_numpy(_embed_queries_fast(db, [query], cfg=cfg)[0])
+    else:
+        query_repr = _embed_query_stub(query, cfg=cfg)
+    positions = _shortlist_positions(
+        db,
+        query_repr.detach().to("cpu").numpy(),
+        positions,
+        search=search,
+        nprobe=nprobe,
+        quantization=quantization,
+        size=max(int(rerank), top_k),
+    )
+    if positions.size == 0:
+        return []
+    scores = _score_matrix(query_repr, matrix, positions)
+
+    return _ranked_results(db, matrix, positions, scores, top_k)
 
-def _iter_candidates(
+def retrieve_many(
     db: CarlosDatabase,
+    queries: Sequence[str],
     *,
-    max_strength: float,
-    min_consistency: float,
-    ) -> Iterable[tuple[Dict[str, Any], CarlosVector]]:
-    """
-    Yield (row, CarlosVector) pairs satisfying the constraints.
-    """
-    for row, vec in db.iter_vectors():
-        # Defensive: tolerate missing fields in row; vec should be authoritative.
-        strength = float(vec.strength)
-        consistency = float(vec.consistency)
-
-        if strength > float(max_strength):
-            continue
-        if consistency < float(min_consistency):
-            continue
-
-        # Ensure row is mutable plain dict for result serialization
-        yield dict(row), vec
-
-def _load_clip_model(models_cache_dir=None, device="cuda", max_retries=5, wait_seconds=10):
-    model_name = "openai/clip-vit-base-patch32"  # You can replace with another CLIP model
-    cache_dir_key = models_cache_dir or ""
-    cache_key = (cache_dir_key, device)
-    
-    # Fast path: cached
-    with _CLIP_CACHE_LOCK:
-        cached = _CLIP_CACHE.get(cache_key)
-        if cached is not None:
-            return cached
-    
+    top_k: int = 5,
+    max_strength: float = 9.8,
+    min_consistency: float = 0.041,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    where: Optional[Predicate] = None,
+    query_mode: str = "exact",
+    batch_size: int = 2048,
+    ) -> List[List[RetrievalResult]]:
+    """
+    Batched `retrieve()` for many queries (offline jobs, evaluation sets).
+
+    The suffixed prompts of all queries are embedded in batches of about `batch_size`
+    texts (whole queries per batch, which bounds encoder memory), and every query is
+    scored against the candidates with one matrix-matrix product per chunk of queries.
+    Query representations go through the same cache as `retrieve()`.
+
+    Exact search only; filters and ranking match `retrieve()`. Returns one result list
+    per query, in input order.
+    """
+    queries = list(queries)
+    for q in queries:
+        if not isinstance(q, str) or q.strip() == "":
+            raise ValueError("queries must be non-empty strings")
+    if top_k <= 0:
+        raise ValueError(f"top_k must be > 0, got {top_k}")
+    if query_mode not in QUERY_MODES:
+        raise ValueError(f"query_mode must be one of {QUERY_MODES}, got {query_mode!r}")
+    if not queries:
+        return []
+
+    matrix = db.vector_matrix()
+    positions = _candidate_positions(
+        db, matrix, max_strength=max_strength, min_consistency=min_consistency, where=where
+    )
+    if positions.size == 0:
+        return [[] for _ in queries]
+
+    if "cuda" in cfg.device and not torch.cuda.is_available():
+        print("Warning: CUDA device requested but not available; falling back to CPU.")
+        cfg = cfg.with_overrides(device="cpu")
+
+    if query_mode == "fast":
+        reprs = _embed_queries_fast(db, queries, cfg=cfg, batch_size=batch_size)  # [Q, D]
+    else:
+        reprs = _embed_queries(queries, cfg=cfg, batch_size=batch_size)  # [Q, D]
+    return _rank_many(db, matrix, positions, reprs, top_k)
+
+class _CLIPTextTower(CLIPTextModelWithProjection):
+    # Loaded from full CLIP checkpoints: the vision weights are skipped, not reported.
+    _keys_to_ignore_on_load_unexpected = [r"^vision_model\.", r"^visual_projection\.", r"^logit_scale$"]
+
+def _clip_for(cfg: RetrievalConfig) -> Tuple[CLIPTextModelWithProjection, PreTrainedTokenizerBase]:
+    # Not pinned: the registry may evict it under its memory budget. Encode under _clip_lease.
+    return _load_clip_model(**_clip_kwargs(cfg))
+
+def _clip_lease(cfg: RetrievalConfig):
+    # Like _clip_for, but pinned (never evicted) for the duration of a `with` block.
+    return MODEL_REGISTRY.lease(*_clip_registry_entry(**_clip_kwargs(cfg)))
+
+def _clip_kwargs(cfg: RetrievalConfig) -> Dict[str, Any]:
+    on_cpu = str(cfg.device).startswith("cpu")
+    return dict(
+        models_cache_dir=cfg.models_cache_dir,
+        device=cfg.device,
+        quantize=on_cpu and cfg.cpu_quantize,
+        num_threads=cfg.cpu_threads if on_cpu else None,
+        warmup=cfg.warmup,
+        local_files_only=cfg.local_files_only,
+    )
+
+def _load_clip_model(
+    models_cache_dir=None,
+    device="cuda",
+    max_retries=3,
+    quantize=False,
+    num_threads=None,
+    warmup=False,
+    local_files_only=False,
+    ):
+    # Shared with indexing; concurrent first calls wait for a single load.
+    return MODEL_REGISTRY.get(*_clip_registry_entry(
+        models_cache_dir=models_cache_dir,
+        device=device,
+        max_retries=max_retries,
+        quantize=quantize,
+        num_threads=num_threads,
+        warmup=warmup,
+        local_files_only=local_files_only,
+    ))
+
+def _clip_key(cfg: RetrievalConfig) -> Tuple[str, ...]:
+    kwargs = _clip_kwargs(cfg)
+    return _clip_registry_key(kwargs["models_cache_dir"], kwargs["device"], kwargs["quantize"])
+
+def _clip_registry_key(models_cache_dir, device, quantize) -> Tuple[str, ...]:
+    return ("clip-text", _CLIP_MODEL_NAME, str(models_cache_dir or ""), device, "int8" if quantize else "float32")
+
+def _clip_registry_entry(*, models_cache_dir=None, device="cuda", quantize=False, num_threads=None, **load_kwargs):
+    configure_threads(num_threads)  # per call: the cached model is shared across configs
+    key = _clip_registry_key(models_cache_dir, device, quantize)
+    return key, lambda: _load_clip_model_from_disk(
+        models_cache_dir=models_cache_dir, device=device, quantize=quantize, num_threads=num_threads, **load_kwargs
+    )
+
+def _load_clip_model_from_disk(
+    models_cache_dir=None,
+    device="cuda",
+    max_retries=3,
+    quantize=False,
+    num_threads=None,
+    warmup=False,
+    local_files_only=False,
+    ):
+    model_name = _CLIP_MODEL_NAME
     if device.startswith("cuda") and not torch.cuda.is_available():
         raise RuntimeError(
             f"Requested device='{device}' but torch.cuda.is_available() is False. "
             "Install a CUDA-enabled PyTorch build (via conda) and ensure an NVIDIA GPU is available."
         )
+    policy = LoadPolicy(local_files_only=local_files_only, max_attempts=max_retries)
+    # Weights and tokenizer files are fetched / read in parallel (see carlos.model_loading).
+    model, tokenizer = load_concurrently(
+        lambda: retry_call(
+            lambda: _CLIPTextTower.from_pretrained(model_name, cache_dir=models_cache_dir, **policy.pretrained_kwargs()),
+            what=f"CLIP model {model_name}",
+            policy=policy,
+        ).to(device),
+        lambda: retry_call(
+            lambda: AutoTokenizer.from_pretrained(model_name, cache_dir=models_cache_dir, **policy.pretrained_kwargs()),
+            what=f"CLIP tokenizer {model_name}",
+            policy=policy,
+        ),
+    )
+    if quantize:
+        quantize_text_encoder(model)
+    if warmup:
+        # First calls pay for kernel selection and allocator growth; do it before serving.
+        _get_text_embeddings(["a photo of a cat"], model, tokenizer, device=device)
+    return model, tokenizer
 
-    for i in range(max_retries):
-        try:
-            model = CLIPModel.from_pretrained(model_name, cache_dir=models_cache_dir).to(device)
-            success = True
-            break
-        except:
-            print("Retrying to load CLIP model...")
-            time.sleep(wait_seconds)
-            success = False
-    if not success:
-            raise RuntimeError(f"Failed to load CLIP model from {model_name} after multiple attempts.")
-            
-    for i in range(max_retries):
-        try:
-            processor = CLIPProcessor.from_pretrained(model_name, cache_dir=models_cache_dir)
-            success = True
-            break
-        except:
-            print("Retrying to load CLIP processor...")
-            time.sleep(wait_seconds)
-            success = False
-    if not success:
-            raise RuntimeError(f"Failed to load CLIP processor from {model_name} after multiple attempts.")
-            
-    # Store in cache (double-checked under lock)
-    with _CLIP_CACHE_LOCK:
-        existing = _CLIP_CACHE.get(cache_key)
-        if existing is not None:
-            return existing
-        _CLIP_CACHE[cache_key] = (model, processor)
-        return model, processor
-
-def _get_text_embeddings(texts: List[str], model: CLIPModel, processor: CLIPProcessor, device: str) -> torch.Tensor:
+def _get_text_embeddings(
+    texts: List[str],
+    model: CLIPTextModelWithProjection,
+    tokenizer: PreTrainedTokenizerBase,
+    device: str,
+    ) -> torch.Tensor:
     """
     Returns a tensor of shape [N, D] on CPU.
     """
-    inputs = processor(
+    inputs = tokenizer(
         text=texts,
         return_tensors="pt",
         truncation=True,
@@ -179,44 +328,416 @@ def _get_text_embeddings(texts: List[str], model: CLIPModel, processor: CLIPProc
     inputs = {k: v.to(device) for k, v in inputs.items()}
 
     model.eval()
-    with torch.no_grad():
-        feats = model.get_text_features(**inputs)  # [N, D] on device
+    with torch.inference_mode():
+        if hasattr(model, "get_text_features"):  # full CLIPModel
+            feats = model.get_text_features(**inputs)  # [N, D] on device
+            if not isinstance(feats, torch.Tensor):
+                feats = feats.pooler_output  # transformers >= 5 returns the model output
+        else:
+            feats = model(**inputs).text_embeds
 
     return feats.detach().to("cpu")
 
-def _embed_query_stub(query: str, cfg: RetrievalConfig) -> torch.Tensor:
+def _baseline_embeddings(
+    prompts: List[str],
+    model: CLIPTextModelWithProjection,
+    tokenizer: PreTrainedTokenizerBase,
+    *,
+    device: str,
+    cfg: RetrievalConfig,
+    ) -> torch.Tensor:
     """
-    Stub: turn a text query into whatever representation your scorer uses.
-    Replace with your actual text->embedding pipeline.
+    Embeddings [N, D] (CPU) of the query-independent retrieval prompts, from the
+    in-memory / on-disk baseline cache (see `carlos.embedding_cache`).
     """
-    prompts = prompts_for_retrieval()
-    model, processor = _load_clip_model(models_cache_dir=cfg.models_cache_dir, device=cfg.device)
+    emb = _BASELINE_CACHE.get(
+        model_fingerprint(model),
+        prompts,
+        lambda: _get_text_embeddings(prompts, model, tokenizer, device=device).numpy(),
+        cache_dir=cfg.embeddings_cache_dir,
+    )
+    return torch.from_numpy(np.array(emb))
 
-    # Decide device (prefer cfg.device if you have it; otherwise keep old behavior)
-    device = getattr(cfg, "device", "cuda")
-    model = model.to(device)
+def query_cache(cfg: RetrievalConfig = RetrievalConfig()) -> QueryEmbeddingCache:
+    """
+    The query representation cache used for `cfg` (shared by all configs with the same
+    `query_cache_size` / `query_cache_dir`); `.stats()` has the hit/miss counters.
+    """
+    key = (int(cfg.query_cache_size), cfg.query_cache_dir)
+    with _QUERY_CACHES_LOCK:
+        cache = _QUERY_CACHES.get(key)
+        if cache is None:
+            cache = _QUERY_CACHES[key] = QueryEmbeddingCache(key[0], cache_dir=key[1])
+        return cache
 
+def _flat_retrieval_prompts() -> List[str]:
+    prompts = prompts_for_retrieval()
     prompts_flatten_list: List[str] = []
     for category in prompts:
         for sub_category in prompts[category]:
             for prompt in prompts[category][sub_category]:
                 prompts_flatten_list.append(prompt)
+    return prompts_flatten_list
 
-    prompts_with_additive_suffix = [p + " " + query for p in prompts_flatten_list]
+def _retrieval_prompts(cfg: RetrievalConfig) -> List[str]:
+    """Prompts of the configured set: all retrieval prompts, or a saved subset."""
+    if cfg.prompt_set in (None, ALL_PROMPTS):
+        return _flat_retrieval_prompts()
+    path = find_prompt_set(cfg.prompt_set, [cfg.prompt_sets_dir])
+    key = (str(path), path.stat().st_mtime_ns)
+    with _PROMPT_SETS_LOCK:
+        prompt_set = _PROMPT_SETS.get(key)
+        if prompt_set is None:
+            prompt_set = _PROMPT_SETS[key] = PromptSet.load(path)
+    return list(prompt_set.prompts)
 
-    # Batch embed (2 batches total instead of 2*N calls)
-    raw_embeddings = _get_text_embeddings(prompts_flatten_list, model, processor, device=device)              # [N, D]
-    with_suffix_embeddings = _get_text_embeddings(prompts_with_additive_suffix, model, processor, device=device)  # [N, D]
+def _prompt_diffs(
+    queries: Sequence[str],
+    prompts: List[str],
+    cfg: RetrievalConfig,
+    *,
+    batch_size: int = 2048,
+    ) -> np.ndarray:
+    """Per-prompt diffs [Q, N, D] of `prompt + " " + query` minus `prompt`, for calibration."""
+    with _clip_lease(cfg) as (model, tokenizer):
+        device = getattr(cfg, "device", "cuda")
+        model = model.to(device)
+        baseline = _baseline_embeddings(prompts, model, tokenizer, device=device, cfg=cfg).numpy()
+        per_batch = max(1, int(batch_size) // max(len(prompts), 1))
+        out = []
+        for start in range(0, len(queries), per_batch):
+            part = list(queries[start : start + per_batch])
+            emb = _suffixed_embeddings(part, prompts, model, tokenizer, device=device, cfg=cfg).numpy()
+            out.append(emb.reshape(len(part), len(prompts), -1) - baseline[None])
+        return np.concatenate(out).astype(np.float32, copy=False)
 
-    diffs = with_suffix_embeddings - raw_embeddings  # [N, D]
-    average_diff = diffs.mean(dim=0)                 # [D]
-    return average_diff.flatten()
+def build_prompt_set(
+    db: CarlosDatabase,
+    queries: Sequence[str],
+    *,
+    name: str,
+    size: Optional[int] = None,
+    target_recall: Optional[float] = None,
+    top_k: int = 10,
+    holdout: float = 0.2,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    save: bool = True,
+    batch_size: int = 2048,
+    ) -> Tuple[PromptSet, Mapping[str, float]]:
+    """
+    Pick a representative subset of all retrieval prompts on calibration `queries` and
+    save it as prompt set `name` (in `cfg.prompt_sets_dir`), for
+    `RetrievalConfig(prompt_set=name)`.
 
-def _score_stub(query_repr: torch.Tensor, vec: CarlosVector, *, row: Mapping[str, Any]) -> float:
+    Give either `size` (number of prompts) or `target_recall`: the smallest greedy prefix
+    whose recall@top_k of the full-set rankings on the calibration queries reaches it.
+    Returns the set and its fidelity on held-out queries (see
+    `carlos.prompt_sets.subset_fidelity`; `relative_cost` is the encoder work per query
+    relative to the full set).
     """
-    Stub: compute similarity between the query representation and a CARLoS vector.
-    Replace with your actual scoring logic (e.g., cosine between query direction and vec.direction,
-    weighted by strength/consistency, etc).
+    if (size is None) == (target_recall is None):
+        raise ValueError("Pass exactly one of size / target_recall")
+    if name == ALL_PROMPTS:
+        raise ValueError(f"{ALL_PROMPTS!r} is reserved for the full prompt list")
+    if save:
+        _check_prompt_set_name(name)
+    if "cuda" in cfg.device and not torch.cuda.is_available():
+        cfg = cfg.with_overrides(device="cpu")
+
+    prompts = _flat_retrieval_prompts()
+    train, held_out = split_queries(queries, holdout=holdout)
+    if not train:
+        raise ValueError("Need at least one calibration query")
+    diffs = _prompt_diffs(train + held_out, prompts, cfg, batch_size=batch_size)
+    fit = diffs[: len(train)]
+    check = diffs[len(train) :] if held_out else fit
+    matrix = db.vector_matrix()
+
+    if size is not None:
+        chosen = greedy_prompt_subset(fit, size)
+    else:
+        # Try 1, 2, 4, ... prompts of the greedy order; the full list always reaches 1.0.
+        order = greedy_prompt_subset(fit, len(prompts))
+        sizes = sorted({min(2**i, len(order)) for i in range(len(order).bit_length() + 1)})
+        chosen = order
+        for m in sizes:
+            if subset_fidelity(matrix, fit, order[:m], k=top_k)[f"recall@{top_k}"] >= float(target_recall):
+                chosen = order[:m]
+                break
+
+    report = subset_fidelity(matrix, check, chosen, k=top_k)
+    subset = [prompts[i] for i in sorted(chosen.tolist())]  # keep the original prompt order
+    prompt_set = PromptSet(
+        name=name,
+        prompts=tuple(subset),
+        meta={
+            "source_prompts_hash": prompt_set_hash(prompts),
+            "calibration_queries": len(train),
+            "held_out_queries": len(held_out),
+            "report": report,
+        },
+    )
+    if save:
+        if cfg.prompt_sets_dir is None:
+            raise ValueError("cfg.prompt_sets_dir is None; nowhere to save the prompt set")
+        prompt_set.save(cfg.prompt_sets_dir)
+    return prompt_set, report
+
+def _suffixed_embeddings(
+    queries: Sequence[str],
+    prompts: List[str],
+    model: CLIPTextModelWithProjection,
+    tokenizer: PreTrainedTokenizerBase,
+    *,
+    device: str,
+    cfg: RetrievalConfig,
+    ) -> torch.Tensor:
+    """
+    Features [len(queries) * N, D] (CPU) of `prompt + " " + query` for every query and
+    prompt, query-major. With `cfg.reuse_prompt_prefix`, only the query tokens are run
+    through the encoder on top of cached prompt keys/values (see `carlos.prefix_encoder`).
+    """
+    if cfg.reuse_prompt_prefix and hasattr(model, "text_model") and hasattr(model, "text_projection"):
+        encoder = _prefix_encoder(prompts, model, tokenizer, device=device, registry_key=_clip_key(cfg))
+        return encode_queries(encoder, tokenizer, queries)
+    texts = [p + " " + q for q in queries for p in prompts]
+    return _get_text_embeddings(texts, model, tokenizer, device=device)
+
+def _prefix_encoder(
+    prompts: List[str],
+    model: CLIPTextModelWithProjection,
+    tokenizer: PreTrainedTokenizerBase,
+    *,
+    device: str,
+    registry_key: Optional[Tuple[str, ...]] = None,
+    ) -> PrefixKVTextEncoder:
+    # The cached keys/values count against the model's registry entry under `registry_key`.
+    key = (prompt_set_hash(prompts), str(device))
+    with _PREFIX_ENCODERS_LOCK:
+        per_model = _PREFIX_ENCODERS.get(model)
+        if per_model is None:
+            per_model = _PREFIX_ENCODERS[model] = OrderedDict()
+        encoder = per_model.get(key)
+        if encoder is not None:
+            per_model.move_to_end(key)
+            return encoder
+        model.eval()
+        encoder = per_model[key] = prefix_encoder_from_prompts(model, tokenizer, prompts)
+        charged = encoder.nbytes
+        while len(per_model) > _PREFIX_ENCODERS_PER_MODEL:
+            charged -= per_model.popitem(last=False)[1].nbytes  # least recently used
+    if registry_key is not None:
+        MODEL_REGISTRY.add_nbytes(registry_key, charged, owner=model)
+    return encoder
+
+def _embed_queries(queries: Sequence[str], cfg: RetrievalConfig, *, batch_size: int) -> np.ndarray:
+    """
+    Query representations [Q, D] (float32) for many queries, as `_embed_query_stub` computes
+    them one at a time: cached ones are reused, the rest are embedded in large batches.
+    """
+    prompts_flatten_list = _retrieval_prompts(cfg)
+    with _clip_lease(cfg) as (model, tokenizer):
+        device = getattr(cfg, "device", "cuda")
+        model = model.to(device)
+
+        cache = query_cache(cfg)
+        model_key = model_fingerprint(model)
+        prompts_hash = prompt_set_hash(prompts_flatten_list)
+        keys = [query_cache_key(q, model_key, prompts_hash) for q in queries]
+        found: Dict[str, np.ndarray] = {}
+        todo: Dict[str, str] = {}  # cache key -> first query text with it
+        for q, key in zip(queries, keys):
+            if key in found or key in todo:
+                continue
+            cached = cache.get(key)
+            if cached is not None:
+                found[key] = cached
+            else:
+                todo[key] = q
+
+        if todo:
+            n = len(prompts_flatten_list)
+            baseline_mean = _baseline_embeddings(prompts_flatten_list, model, tokenizer, device=device, cfg=cfg).mean(dim=0)
+            per_batch = max(1, int(batch_size) // max(n, 1))
+            pending = list(todo.items())
+            for start in range(0, len(pending), per_batch):
+                part = pending[start : start + per_batch]
+                emb = _suffixed_embeddings([q for _, q in part], prompts_flatten_list, model, tokenizer, device=device, cfg=cfg)
+                # mean(with_suffix - raw) == mean(with_suffix) - mean(raw)
+                reprs = emb.reshape(len(part), n, -1).mean(dim=1) - baseline_mean
+                for (key, _), vec in zip(part, reprs.numpy()):
+                    cache.put(key, vec)
+                    found[key] = vec
+
+        return np.stack([np.asarray(found[k], dtype=np.float32) for k in keys])
+
+def _query_text_embeddings(
+    queries: Sequence[str],
+    cfg: RetrievalConfig,
+    *,
+    batch_size: int = 2048,
+    ) -> Tuple[np.ndarray, str]:
+    """CLIP text embeddings [Q, D] of the bare queries, plus the model fingerprint."""
+    with _clip_lease(cfg) as (model, tokenizer):
+        device = getattr(cfg, "device", "cuda")
+        model = model.to(device)
+        step = max(1, int(batch_size))
+        parts = [
+            _get_text_embeddings(list(queries[i : i + step]), model, tokenizer, device=device).numpy()
+            for i in range(0, len(queries), step)
+        ]
+        return np.concatenate(parts).astype(np.float32, copy=False), model_fingerprint(model)
+
+def _fast_query_encoder(db: CarlosDatabase) -> FastQueryEncoder:
+    db_path = getattr(db, "path", None)
+    path = None if db_path is None else query_encoder_path(db_path)
+    if path is None or not path.exists():
+        raise FileNotFoundError(
+            "query_mode='fast' needs a fast query encoder stored with the database; "
+            "create one with carlos.retrieve.train_fast_query_encoder(db, queries)"
+        )
+    key = (str(path), path.stat().st_mtime_ns)
+    with _FAST_ENCODERS_LOCK:
+        encoder = _FAST_ENCODERS.get(key)
+        if encoder is None:
+            encoder = _FAST_ENCODERS[key] = FastQueryEncoder.load(path)
+        return encoder
+
+def _embed_queries_fast(
+    db: CarlosDatabase,
+    queries: Sequence[str],
+    cfg: RetrievalConfig,
+    *,
+    batch_size: int = 2048,
+    ) -> np.ndarray:
+    """Fast-mode query representations [Q, D]: one text-encoder pass per query."""
+    encoder = _fast_query_encoder(db)
+    emb, model_key = _query_text_embeddings(queries, cfg, batch_size=batch_size)
+    encoder.check_compatible(model_key, prompt_set_hash(_retrieval_prompts(cfg)))
+    return encoder.predict(emb)
+
+def train_fast_query_encoder(
+    db: CarlosDatabase,
+    queries: Sequence[str],
+    *,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    rank: Optional[int] = None,
+    ridge: float = 1e-2,
+    holdout: float = 0.2,
+    top_k: int = 10,
+    persist: bool = True,
+    batch_size: int = 2048,
+    ) -> Tuple[FastQueryEncoder, Mapping[str, float]]:
+    """
+    Fit the fast query encoder on `queries` (logged or generated) against the exact
+    representations, and report its fidelity on a held-out `holdout` fraction of them.
+
+    The encoder is written next to the database file (`<stem>.query_encoder.npz`) when
+    `persist` is set and the database has a path. Returns (encoder, held-out report; see
+    `carlos.fast_query.fidelity_report`).
+    """
+    train, held_out = split_queries(queries, holdout=holdout)
+    if not train:
+        raise ValueError("Need at least one training query")
+    if "cuda" in cfg.device and not torch.cuda.is_available():
+        cfg = cfg.with_overrides(device="cpu")
+
+    emb, model_key = _query_text_embeddings(train + held_out, cfg, batch_size=batch_size)
+    targets = _embed_queries(train + held_out, cfg=cfg, batch_size=batch_size)
+    n = len(train)
+    encoder = fit_fast_query_encoder(
+        emb[:n],
+        targets[:n],
+        model_key=model_key,
+        prompts_hash=prompt_set_hash(_retrieval_prompts(cfg)),
+        rank=rank,
+        ridge=ridge,
+    )
+    evaluate = slice(n, None) if held_out else slice(0, n)
+    report = fidelity_report(db.vector_matrix(), targets[evaluate], encoder.predict(emb[evaluate]), k=top_k)
+
+    db_path = getattr(db, "path", None)
+    if persist and db_path is not None:
+        encoder.save(query_encoder_path(db_path))
+    return encoder, report
+
+def fast_query_fidelity(
+    db: CarlosDatabase,
+    queries: Sequence[str],
+    *,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    top_k: int = 10,
+    batch_size: int = 2048,
+    ) -> Mapping[str, float]:
+    """Fidelity of the database's stored fast encoder against exact mode on `queries`."""
+    if "cuda" in cfg.device and not torch.cuda.is_available():
+        cfg = cfg.with_overrides(device="cpu")
+    queries = list(queries)
+    exact = _embed_queries(queries, cfg=cfg, batch_size=batch_size)
+    fast = _embed_queries_fast(db, queries, cfg=cfg, batch_size=batch_size)
+    return fidelity_report(db.vector_matrix(), exact, fast, k=top_k)
+
+def cpu_quantization_report(
+    db: CarlosDatabase,
+    queries: Sequence[str],
+    *,
+    cfg: RetrievalConfig = RetrievalConfig(device="cpu"),
+    top_k: int = 10,
+    batch_size: int = 2048,
+    ) -> Mapping[str, float]:
+    """
+    Accuracy and speed of the int8 CPU text encoder against float32 on `queries`:
+    `carlos.fast_query.fidelity_report` of the int8 query representations (exact mode)
+    against the float32 ones, plus milliseconds per query for each (query cache off).
+    """
+    queries = list(dict.fromkeys(queries))
+    if not queries:
+        raise ValueError("Need at least one query")
+    uncached = replace(cfg, device="cpu", query_cache_size=0, query_cache_dir=None)
+    reprs, report_ms = {}, {}
+    for name, quantize in (("float32", False), ("int8", True)):
+        variant = replace(uncached, cpu_quantize=quantize)
+        _embed_queries(["warm-up"], cfg=variant, batch_size=batch_size)  # loads the model and baseline
+        start = time.perf_counter()
+        reprs[name] = _embed_queries(queries, cfg=variant, batch_size=batch_size)
+        report_ms[f"{name}_ms_per_query"] = 1000.0 * (time.perf_counter() - start) / len(queries)
+    report = dict(fidelity_report(db.vector_matrix(), reprs["float32"], reprs["int8"], k=top_k))
+    report.update(report_ms)
+    return report
+
+def _embed_query_stub(query: str, cfg: RetrievalConfig) -> torch.Tensor:
+    """
+    Query representation [D] for one query: mean over the retrieval prompts of
+    CLIP(prompt + " " + query) - CLIP(prompt), served from the query cache when present.
+    (The name predates the implementation; tests patch it under this name.)
+    """
+    with _clip_lease(cfg) as (model, tokenizer):
+        # Decide device (prefer cfg.device if you have it; otherwise keep old behavior)
+        device = getattr(cfg, "device", "cuda")
+        model = model.to(device)
+
+        prompts_flatten_list = _retrieval_prompts(cfg)
+
+        cache = query_cache(cfg)
+        cache_key = query_cache_key(query, model_fingerprint(model), prompt_set_hash(prompts_flatten_list))
+        cached = cache.get(cache_key)
+        if cached is not None:
+            return torch.from_numpy(np.array(cached))
+
+        # The baseline prompts do not depend on the query: embedded once per model (cached)
+        raw_embeddings = _baseline_embeddings(prompts_flatten_list, model, tokenizer, device=device, cfg=cfg)  # [N, D]
+        with_suffix_embeddings = _suffixed_embeddings([query], prompts_flatten_list, model, tokenizer, device=device, cfg=cfg)  # [N, D]
+
+        diffs = with_suffix_embeddings - raw_embeddings  # [N, D]
+        average_diff = diffs.mean(dim=0)                 # [D]
+        cache.put(cache_key, average_diff.numpy())
+        return average_diff.flatten()
+
+def _score_matrix(query_repr: torch.Tensor, matrix: VectorMatrix, positions: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity between the query representation and every candidate row, as a
+    single matrix-vector product over the pre-normalized direction matrix.
+
+    Matches the legacy per-row torch.cosine_similarity (eps=1e-8) row for row.
     """
-    lora_direction = torch.tensor(vec.direction)
-    return float(torch.cosine_similarity(lora_direction, query_repr, dim=0).item())
\ No newline at end of file
+    return _cosine_scores(query_repr.detach().to("cpu").numpy(), matrix, positions)
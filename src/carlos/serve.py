@@ -0,0 +1,389 @@
+# src/carlos/serve.py
+"""
+HTTP retrieval service (`carlos serve`).
+
+A single asyncio process that loads the database matrix and the query encoder once at
+startup and serves:
+
+  GET  /health           {"status": "ok", "rows": ..., "in_flight": ...}
+  POST /retrieve         {"query": "...", "top_k": 5, "max_strength": 9.8,
+                          "min_consistency": 0.041, "where": [["model_nsfw_level", "<=", 1]]}
+  POST /retrieve_batch   same, with "queries": [...] instead of "query"
+
+`where` is a list of [column, op, value] conditions, all of which must hold (op is one
+of ==, !=, <, <=, >, >=, in; see MAX_WHERE_* for size limits). Request filters are
+evaluated without caching their masks, so clients cannot grow server memory. Responses carry `results` (or one list per query for the
+batch endpoint) with lora_id, rank, score and the row's metadata.
+
+Encoding and scoring run on a bounded thread pool. Requests beyond `max_pending` get
+503 (with Retry-After) instead of queueing without limit; requests slower than
+`timeout_s` get 504. Standard library only; the CLIP encoder (torch) is imported only
+when it is used, so `FakeQueryEncoder` serves without torch, e.g. for local tests.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from .config import RetrievalConfig
+from .database import CarlosDatabase
+from .filters import Compare, IsIn, Predicate
+from .types import RetrievalResult
+from .vector_search import retrieve_many_by_vector
+
+MAX_BODY_BYTES = 1 << 20
+# Bounds on a request's `where`: conditions, values of one `in` list, characters of a string value
+MAX_WHERE_CONDITIONS = 16
+MAX_WHERE_VALUES = 256
+MAX_WHERE_VALUE_CHARS = 256
+_REASONS = {
+    200: "OK", 400: "Bad Request", 404: "Not Found", 405: "Method Not Allowed",
+    413: "Payload Too Large", 500: "Internal Server Error", 503: "Service Unavailable",
+    504: "Gateway Timeout",
+}
+
+
+class ClipQueryEncoder:
+    """Query representations from the CLIP pipeline of `carlos.retrieve` (exact or fast mode)."""
+
+    def __init__(self, db: CarlosDatabase, *, cfg: RetrievalConfig = RetrievalConfig(), query_mode: str = "exact") -> None:
+        import torch
+
+        from . import retrieve as _retrieve
+
+        if query_mode not in _retrieve.QUERY_MODES:
+            raise ValueError(f"query_mode must be one of {_retrieve.QUERY_MODES}, got {query_mode!r}")
+        if "cuda" in cfg.device and not torch.cuda.is_available():
+            print("Warning: CUDA device requested but not available; falling back to CPU.")
+            cfg = cfg.with_overrides(device="cpu")
+        self._retrieve = _retrieve
+        self.db, self.cfg, self.query_mode = db, cfg, query_mode
+
+    def warm_up(self) -> None:
+        from .startup import warmup
+
+        print(warmup(self.db, self.cfg, query_mode=self.query_mode, query="warm-up").format())
+
+    def encode(self, queries: Sequence[str]) -> np.ndarray:
+        if self.query_mode == "fast":
+            return self._retrieve._embed_queries_fast(self.db, list(queries), cfg=self.cfg)
+        return self._retrieve._embed_queries(list(queries), cfg=self.cfg, batch_size=2048)
+
+
+class FakeQueryEncoder:
+    """Deterministic pseudo-random query vectors (no model); for local testing of the service."""
+
+    def __init__(self, dim: int) -> None:
+        self.dim = int(dim)
+
+    def encode(self, queries: Sequence[str]) -> np.ndarray:
+        out = np.empty((len(queries), self.dim), dtype=np.float32)
+        for i, q in enumerate(queries):
+            seed = int.from_bytes(hashlib.sha256(q.strip().lower().encode("utf-8")).digest()[:8], "little")
+            out[i] = np.random.default_rng(seed).standard_normal(self.dim)
+        return out
+
+
+class _HTTPError(Exception):
+    def __init__(self, status: int, message: str, headers: Optional[Dict[str, str]] = None) -> None:
+        super().__init__(message)
+        self.status = status
+        self.headers = headers or {}
+
+
+class RetrievalService:
+    """
+    The `carlos serve` application; `start()` / `serve_forever()` run it on asyncio.
+
+    workers:
+      Threads for encoding and scoring.
+    max_pending:
+      Requests admitted at once (running or waiting for a worker, including timed-out
+      ones still running); more get 503.
+    timeout_s:
+      Per-request deadline for encoding and scoring; slower requests get 504.
+    max_batch_queries:
+      Largest accepted /retrieve_batch request.
+    """
+
+    def __init__(
+        self,
+        db: CarlosDatabase,
+        encoder: Any,
+        *,
+        workers: int = 2,
+        max_pending: int = 64,
+        timeout_s: float = 30.0,
+        max_batch_queries: int = 256,
+    ) -> None:
+        self.db = db
+        self.encoder = encoder
+        self.workers = int(workers)
+        self.max_pending = int(max_pending)
+        self.timeout_s = float(timeout_s)
+        self.max_batch_queries = int(max_batch_queries)
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self.ready = False
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    async def start(self, host: str = "127.0.0.1", port: int = 8080) -> Tuple[str, int]:
+        """Warm up (database matrix, encoder), then listen. Returns the bound (host, port)."""
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="carlos-serve")
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self._executor, self._warm_up)
+        self.ready = True
+        self._server = await asyncio.start_server(self._handle_connection, host, port)
+        bound = self._server.sockets[0].getsockname()
+        return str(bound[0]), int(bound[1])
+
+    async def serve_forever(self, host: str = "127.0.0.1", port: int = 8080) -> None:
+        bound_host, bound_port = await self.start(host, port)
+        print(f"carlos serve: listening on http://{bound_host}:{bound_port}")
+        try:
+            async with self._server:
+                await self._server.serve_forever()
+        finally:
+            await self.stop()
+
+    async def stop(self) -> None:
+        self.ready = False
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _warm_up(self) -> None:
+        warm_up = getattr(self.encoder, "warm_up", None)
+        if callable(warm_up):
+            warm_up()  # per-stage timings (see carlos.startup)
+        else:
+            self.db.vector_matrix()
+            self.encoder.encode(["warm-up"])
+
+    # -- HTTP -------------------------------------------------------------------------
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            while True:
+                try:
+                    request = await _read_request(reader)
+                except _HTTPError as e:
+                    await _write_response(writer, e.status, {"error": str(e)}, keep_alive=False)
+                    return
+                if request is None:
+                    return
+                method, path, headers, body = request
+                keep_alive = headers.get("connection", "").lower() != "close"
+                status, payload, extra = await self._dispatch(method, path, body)
+                await _write_response(writer, status, payload, keep_alive=keep_alive, headers=extra)
+                if not keep_alive:
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+        finally:
+            writer.close()
+
+    async def _dispatch(self, method: str, path: str, body: bytes) -> Tuple[int, Dict[str, Any], Dict[str, str]]:
+        try:
+            if path == "/health":
+                if method != "GET":
+                    raise _HTTPError(405, "use GET")
+                status = 200 if self.ready else 503
+                rows = len(self.db.vector_matrix())
+                return status, {"status": "ok" if self.ready else "starting", "rows": rows, "in_flight": self.in_flight}, {}
+            if path not in ("/retrieve", "/retrieve_batch"):
+                raise _HTTPError(404, f"no route for {path}")
+            if method != "POST":
+                raise _HTTPError(405, "use POST")
+            return 200, await self._retrieve(path, _parse_json(body)), {}
+        except _HTTPError as e:
+            return e.status, {"error": str(e)}, e.headers
+        except (ValueError, KeyError, TypeError) as e:
+            return 400, {"error": f"{type(e).__name__}: {e}"}, {}
+        except Exception as e:  # noqa: BLE001 - reported to the client, the server keeps running
+            return 500, {"error": f"{type(e).__name__}: {e}"}, {}
+
+    async def _retrieve(self, path: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        batch = path == "/retrieve_batch"
+        queries = _queries(params, batch=batch, limit=self.max_batch_queries)
+        kwargs = dict(
+            top_k=int(params.get("top_k", 5)),
+            max_strength=float(params.get("max_strength", 9.8)),
+            min_consistency=float(params.get("min_consistency", 0.041)),
+            where=_parse_where(params.get("where")),
+        )
+        if kwargs["top_k"] <= 0:
+            raise ValueError(f"top_k must be > 0, got {kwargs['top_k']}")
+        if not self.ready:
+            raise _HTTPError(503, "starting up", {"Retry-After": "1"})
+        if self.in_flight >= self.max_pending:
+            raise _HTTPError(503, "overloaded, retry later", {"Retry-After": "1"})
+
+        # A timed-out job keeps its slot until its worker finishes, so slow encodes
+        # cannot pile up behind the pool.
+        with self._lock:
+            self.in_flight += 1
+        job = self._executor.submit(self._run, queries, kwargs)
+        job.add_done_callback(self._job_done)
+        try:
+            results = await asyncio.wait_for(asyncio.wrap_future(job), timeout=self.timeout_s)
+        except asyncio.TimeoutError:
+            raise _HTTPError(504, f"request exceeded {self.timeout_s:g}s") from None
+        encoded = [[_result_json(r) for r in rs] for rs in results]
+        return {"results": encoded} if batch else {"results": encoded[0]}
+
+    def _job_done(self, _job: Any) -> None:
+        with self._lock:
+            self.in_flight -= 1
+
+    def _run(self, queries: List[str], kwargs: Dict[str, Any]) -> List[List[RetrievalResult]]:
+        reprs = np.asarray(self.encoder.encode(queries), dtype=np.float32)
+        return retrieve_many_by_vector(self.db, reprs, **kwargs)
+
+
+def _queries(params: Dict[str, Any], *, batch: bool, limit: int) -> List[str]:
+    queries = params.get("queries") if batch else [params.get("query")]
+    if not isinstance(queries, list) or not queries:
+        raise ValueError("'queries' must be a non-empty list" if batch else "'query' is required")
+    if len(queries) > limit:
+        raise ValueError(f"at most {limit} queries per batch, got {len(queries)}")
+    for q in queries:
+        if not isinstance(q, str) or q.strip() == "":
+            raise ValueError("queries must be non-empty strings")
+    return queries
+
+
+_OPS = ("==", "!=", "<", "<=", ">", ">=", "in")
+
+
+def _parse_where(spec: Any) -> Optional[Predicate]:
+    if spec is None:
+        return None
+    if not isinstance(spec, list):
+        raise ValueError("'where' must be a list of [column, op, value] conditions")
+    if len(spec) > MAX_WHERE_CONDITIONS:
+        raise ValueError(f"at most {MAX_WHERE_CONDITIONS} 'where' conditions, got {len(spec)}")
+    predicate: Optional[Predicate] = None
+    for cond in spec:
+        if not (isinstance(cond, list) and len(cond) == 3 and isinstance(cond[0], str) and cond[1] in _OPS):
+            raise ValueError(f"bad condition {cond!r}; expected [column, op, value] with op in {sorted(_OPS)}")
+        column, op, value = cond
+        if op == "in":
+            if not isinstance(value, list):
+                raise ValueError(f"'in' needs a list of values, got {value!r}")
+            if len(value) > MAX_WHERE_VALUES:
+                raise ValueError(f"at most {MAX_WHERE_VALUES} values per 'in', got {len(value)}")
+            for v in value:
+                _check_where_value(v)
+            p: Predicate = IsIn(column, tuple(value), memoize=False)
+        else:
+            _check_where_value(value)
+            p = Compare(column, op, value, memoize=False)
+        predicate = p if predicate is None else predicate & p
+    return predicate
+
+
+def _check_where_value(value: Any) -> None:
+    if value is not None and not isinstance(value, (str, int, float)):
+        raise ValueError(f"'where' values must be strings or numbers, got {value!r}")
+    if isinstance(value, str) and len(value) > MAX_WHERE_VALUE_CHARS:
+        raise ValueError(f"'where' string values are limited to {MAX_WHERE_VALUE_CHARS} characters")
+
+
+def _result_json(result: RetrievalResult) -> Dict[str, Any]:
+    row = {k: v for k, v in result.row.items() if k != "direction"}
+    return {"lora_id": result.lora_id, "rank": result.rank, "score": result.score, "row": row}
+
+
+def _parse_json(body: bytes) -> Dict[str, Any]:
+    try:
+        params = json.loads(body or b"{}")
+    except json.JSONDecodeError as e:
+        raise ValueError(f"invalid JSON body: {e}") from None
+    if not isinstance(params, dict):
+        raise ValueError("JSON body must be an object")
+    return params
+
+
+def _json_default(value: Any) -> Any:
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    return str(value)
+
+
+async def _read_request(reader: asyncio.StreamReader) -> Optional[Tuple[str, str, Dict[str, str], bytes]]:
+    try:
+        head = await reader.readuntil(b"\r\n\r\n")
+    except asyncio.IncompleteReadError as e:
+        if e.partial.strip():
+            raise _HTTPError(400, "incomplete request") from None
+        return None  # client closed the connection
+    except asyncio.LimitOverrunError:
+        raise _HTTPError(413, "request headers too large") from None
+    lines = head.decode("latin-1").split("\r\n")
+    parts = lines[0].split()
+    if len(parts) != 3:
+        raise _HTTPError(400, f"bad request line {lines[0]!r}")
+    method, target, _ = parts
+    headers = {}
+    for line in lines[1:]:
+        if ":" in line:
+            name, value = line.split(":", 1)
+            headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length", "0") or 0)
+    if length > MAX_BODY_BYTES:
+        raise _HTTPError(413, f"body larger than {MAX_BODY_BYTES} bytes")
+    body = await reader.readexactly(length) if length else b""
+    return method.upper(), target.split("?", 1)[0], headers, body
+
+
+async def _write_response(
+    writer: asyncio.StreamWriter,
+    status: int,
+    payload: Dict[str, Any],
+    *,
+    keep_alive: bool,
+    headers: Optional[Dict[str, str]] = None,
+) -> None:
+    body = json.dumps(payload, default=_json_default).encode("utf-8")
+    lines = [
+        f"HTTP/1.1 {status} {_REASONS.get(status, 'Error')}",
+        "Content-Type: application/json",
+        f"Content-Length: {len(body)}",
+        f"Connection: {'keep-alive' if keep_alive else 'close'}",
+    ]
+    lines += [f"{k}: {v}" for k, v in (headers or {}).items()]
+    writer.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1") + body)
+    await writer.drain()
+
+
+def serve(
+    db: CarlosDatabase,
+    *,
+    host: str = "127.0.0.1",
+    port: int = 8080,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    query_mode: str = "exact",
+    fake_encoder: bool = False,
+    workers: int = 2,
+    max_pending: int = 64,
+    timeout_s: float = 30.0,
+) -> None:
+    """Run the retrieval service until interrupted."""
+    encoder = FakeQueryEncoder(db.vector_matrix().dim) if fake_encoder else ClipQueryEncoder(db, cfg=cfg, query_mode=query_mode)
+    service = RetrievalService(db, encoder, workers=workers, max_pending=max_pending, timeout_s=timeout_s)
+    try:
+        asyncio.run(service.serve_forever(host, port))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,107 @@
+# src/carlos/startup.py
+"""
+Process warm-up for retrieval.
+
+The first `retrieve()` in a process pays, in order, for:
+
+  import              torch / transformers (`import carlos` alone does not load them)
+  model_load          the CLIP text tower and tokenizer (download retries, opt-in int8
+                      quantization and `cfg.warmup`'s first encoder pass included)
+  baseline            embeddings of the query-independent retrieval prompts
+  prefix_encoder      cached prompt keys/values (`cfg.reuse_prompt_prefix`), or
+  fast_encoder        the learned query encoder stored with the database (query_mode="fast")
+  db_matrix           the database's float32 direction matrix
+  first_query         one retrieval end to end (optional)
+
+`warmup(db, cfg)` runs these stages up front and times each one, so that a service can
+report ready only after them. Every stage fills a process-wide cache that `retrieve()`
+reuses; calling `warmup` again is cheap.
+"""
+from __future__ import annotations
+
+import importlib
+import time
+from dataclasses import dataclass
+from typing import Callable, Mapping, Optional
+
+from .config import RetrievalConfig
+from .database import CarlosDatabase
+
+
+@dataclass(frozen=True)
+class WarmupReport:
+    """Seconds spent per warm-up stage, in the order they ran."""
+
+    stages: Mapping[str, float]
+    device: str
+    query_mode: str
+
+    @property
+    def total_s(self) -> float:
+        return float(sum(self.stages.values()))
+
+    def format(self) -> str:
+        """Aligned per-stage table (milliseconds and share of the total)."""
+        total = self.total_s
+        width = max([len(name) for name in self.stages] + [len("total")])
+        lines = [f"{'stage':<{width}}  {'ms':>9}  {'share':>6}"]
+        for name, seconds in self.stages.items():
+            share = seconds / total if total > 0 else 0.0
+            lines.append(f"{name:<{width}}  {seconds * 1000:9.1f}  {share:6.1%}")
+        lines.append(f"{'total':<{width}}  {total * 1000:9.1f}")
+        return "\n".join(lines)
+
+
+def warmup(
+    db: CarlosDatabase,
+    cfg: RetrievalConfig = RetrievalConfig(),
+    *,
+    query_mode: str = "exact",
+    query: Optional[str] = None,
+    ) -> WarmupReport:
+    """
+    Run and time the cold-start stages of `retrieve()` (see the module docstring).
+
+    Parameters
+    ----------
+    db:
+      Database that will be served.
+    cfg:
+      Retrieval config of the later `retrieve()` calls; the models, prompt set and caches
+      warmed are the ones it selects. A CUDA device falls back to CPU as in `retrieve()`.
+    query_mode:
+      "exact" warms the baseline and prefix encoder; "fast" the fast query encoder.
+    query:
+      If given, also time one `retrieve(db, query)` (stage "first_query").
+    """
+    stages = {}
+
+    def timed(name: str, fn: Callable[[], object]) -> object:
+        start = time.perf_counter()
+        value = fn()
+        stages[name] = time.perf_counter() - start
+        return value
+
+    r = timed("import", lambda: importlib.import_module(".retrieve", __package__))
+    if query_mode not in r.QUERY_MODES:
+        raise ValueError(f"query_mode must be one of {r.QUERY_MODES}, got {query_mode!r}")
+    import torch  # loaded by the import stage
+
+    if "cuda" in cfg.device and not torch.cuda.is_available():
+        print("Warning: CUDA device requested but not available; falling back to CPU.")
+        cfg = cfg.with_overrides(device="cpu")
+
+    model, tokenizer = timed("model_load", lambda: r._clip_for(cfg))
+    model = model.to(cfg.device)
+    prompts = r._retrieval_prompts(cfg)
+    if query_mode == "fast":
+        timed("fast_encoder", lambda: r._fast_query_encoder(db))
+    else:
+        timed("baseline", lambda: r._baseline_embeddings(prompts, model, tokenizer, device=cfg.device, cfg=cfg))
+        if cfg.reuse_prompt_prefix and hasattr(model, "text_model") and hasattr(model, "text_projection"):
+            key = r._clip_key(cfg)
+            timed("prefix_encoder", lambda: r._prefix_encoder(prompts, model, tokenizer, device=cfg.device, registry_key=key))
+    timed("db_matrix", db.vector_matrix)
+    if query is not None:
+        timed("first_query", lambda: r.retrieve(db, query, cfg=cfg, query_mode=query_mode))
+    return WarmupReport(stages=stages, device=cfg.device, query_mode=query_mode)
@@ -3,7 +3,7 @@ from __future__ import annotations
 
 from dataclasses import dataclass, field, replace
 import numpy as np
-from typing import Any, Mapping, Optional, Sequence
+from typing import Any, Iterator, Mapping, Optional, Sequence
 
 _EMBED_DIM_DEFAULT = 512
 
@@ -63,6 +63,77 @@ class CarlosVector:
         return cls(direction=d, strength=float(strength), consistency=float(consistency))
 
 
+@dataclass(frozen=True)
+class VectorMatrix:
+    """
+    Columnar view of every CARLoS vector in a database, aligned with row positions.
+
+    - keys: (N,) key-column values (typically `version_id`)
+    - directions: (N, D) float32 direction matrix
+    - norms: (N,) float32 L2 norms of `directions`
+    - strength / consistency: (N,) float64 scalars (NaN where missing)
+    - normalized: (N, D) float32 unit-norm copy of `directions` (all-zero rows stay zero),
+      computed on first access; scoring uses `directions` and `norms` and never needs it
+    """
+
+    keys: np.ndarray
+    directions: np.ndarray
+    norms: np.ndarray
+    strength: np.ndarray
+    consistency: np.ndarray
+    _normalized: Optional[np.ndarray] = field(default=None, repr=False, compare=False)
+
+    @property
+    def normalized(self) -> np.ndarray:
+        if self._normalized is None:
+            object.__setattr__(self, "_normalized", self.unit_rows(slice(None)))
+        return self._normalized
+
+    def unit_rows(self, positions: Any) -> np.ndarray:
+        """Unit-normalized copy of the directions at `positions` (all-zero rows stay zero)."""
+        safe = np.where(self.norms[positions] > 0, self.norms[positions], np.float32(1.0))
+        return (self.directions[positions] / safe[..., None]).astype(np.float32, copy=False)
+
+    def __len__(self) -> int:
+        return int(self.directions.shape[0])
+
+    @property
+    def dim(self) -> int:
+        return int(self.directions.shape[1]) if self.directions.ndim == 2 else 0
+
+    def copy(self) -> "VectorMatrix":
+        """Deep copy (the cached matrix is patched in place by database upserts)."""
+        values = {f: getattr(self, f) for f in self.__dataclass_fields__}
+        return VectorMatrix(**{f: None if v is None else np.array(v) for f, v in values.items()})
+
+    def vector(self, position: int) -> CarlosVector:
+        """Build the CarlosVector stored at row `position`."""
+        return CarlosVector(
+            direction=np.array(self.directions[position], dtype=np.float32),
+            strength=float(self.strength[position]),
+            consistency=float(self.consistency[position]),
+        )
+
+    @classmethod
+    def from_arrays(
+        cls,
+        keys: Sequence[Any] | np.ndarray,
+        directions: np.ndarray,
+        strength: Sequence[float] | np.ndarray,
+        consistency: Sequence[float] | np.ndarray,
+    ) -> "VectorMatrix":
+        d = np.asarray(directions, dtype=np.float32)
+        if d.ndim != 2:
+            raise ValueError(f"directions must be 2D, got shape {d.shape}")
+        return cls(
+            keys=np.asarray(keys),
+            directions=d,
+            norms=np.linalg.norm(d, axis=1).astype(np.float32, copy=False),
+            strength=np.asarray(strength, dtype=np.float64).reshape(-1),
+            consistency=np.asarray(consistency, dtype=np.float64).reshape(-1),
+        )
+
+
 @dataclass(frozen=True)
 class IndexingResult:
     """
@@ -88,6 +159,34 @@ class IndexingResult:
 # ... keep CarlosVector + IndexingResult above as-is ...
 
 
+class RowView(Mapping[str, Any]):
+    """
+    Read-only row of a columnar snapshot (`{column: array}`), read on access.
+
+    Creating one copies nothing; numpy scalars are returned as Python scalars, like
+    the values of a pandas row dict.
+    """
+
+    __slots__ = ("_columns", "_position")
+
+    def __init__(self, columns: Mapping[str, np.ndarray], position: int) -> None:
+        self._columns = columns
+        self._position = int(position)
+
+    def __getitem__(self, key: str) -> Any:
+        value = self._columns[key][self._position]
+        return value.item() if isinstance(value, np.generic) else value
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._columns)
+
+    def __len__(self) -> int:
+        return len(self._columns)
+
+    def __repr__(self) -> str:
+        return f"RowView({dict(self)!r})"
+
+
 @dataclass(frozen=True)
 class RetrievalResult:
     """
@@ -104,7 +203,8 @@ class RetrievalResult:
     score:
       A higher-is-better score. The absolute scale is not a stable contract.
     row:
-      The original row payload (parquet-friendly primitives recommended).
+      The original row payload (parquet-friendly primitives recommended). `retrieve()`
+      returns a read-only `RowView` into the database's column snapshot.
     rank:
       Optional 1-based rank among returned results.
     vector:
@@ -175,8 +275,9 @@ class RetrievalResult:
     ) -> "RetrievalResult":
         """
         Helper constructor for the common case of building results from DB rows.
+        Rows are copied into a dict, except read-only `RowView`s, which are kept as-is.
         """
-        _row = dict(row)
+        _row = row if isinstance(row, RowView) else dict(row)
         _id = lora_id
         if _id is None:
             if id_column not in _row:
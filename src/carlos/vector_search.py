@@ -0,0 +1,239 @@
+# src/carlos/vector_search.py
+"""
+Retrieval from a precomputed query vector, in numpy only.
+
+`retrieve()` turns text into a query representation with CLIP (torch, transformers);
+everything after that (metadata filters, IVF / quantized shortlists, cosine scoring,
+top-k, result rows) lives here. `retrieve_by_vector` is the entry point for callers that
+already have the vector (a cache, another service). This module does not import torch.
+"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+import numpy as np
+
+from .database import CarlosDatabase
+from .filters import Predicate
+from .quantize import shortlist
+from .types import RetrievalResult, VectorMatrix
+
+SEARCH_MODES: tuple[str, ...] = ("exact", "ann")
+
+
+def retrieve_by_vector(
+    db: CarlosDatabase,
+    query_vector: np.ndarray,
+    *,
+    top_k: int = 5,
+    max_strength: float = 9.8,
+    min_consistency: float = 0.041,
+    quantization: Optional[str] = None,
+    rerank: int = 100,
+    search: str = "exact",
+    nprobe: int = 16,
+    where: Optional[Predicate] = None,
+    ) -> List[RetrievalResult]:
+    """
+    Retrieve top-k LoRAs for a query representation (the vector `retrieve()` builds from
+    text, e.g. `carlos.retrieve.query_cache(cfg)` entries).
+
+    Parameters
+    ----------
+    db:
+      Loaded CARLoS database.
+    query_vector:
+      Query representation, shape [D] (D = direction dimension). Need not be normalized.
+
+    The remaining parameters are those of `carlos.retrieve.retrieve`.
+
+    Returns
+    -------
+    List[RetrievalResult]
+      Sorted by descending cosine score, with rank set to 1..N.
+    """
+    _check_search_args(top_k, search)
+    matrix = db.vector_matrix()
+    q = np.asarray(query_vector, dtype=np.float32).reshape(-1)
+    if matrix.dim and q.size != matrix.dim:
+        raise ValueError(f"query_vector has {q.size} dimensions, the database has {matrix.dim}")
+
+    positions = _candidate_positions(
+        db, matrix, max_strength=max_strength, min_consistency=min_consistency, where=where
+    )
+    if positions.size == 0:
+        return []
+    positions = _shortlist_positions(
+        db, q, positions, search=search, nprobe=nprobe, quantization=quantization, size=max(int(rerank), top_k)
+    )
+    if positions.size == 0:
+        return []
+    return _ranked_results(db, matrix, positions, _cosine_scores(q, matrix, positions), top_k)
+
+
+def retrieve_many_by_vector(
+    db: CarlosDatabase,
+    query_vectors: np.ndarray,
+    *,
+    top_k: int = 5,
+    max_strength: float = 9.8,
+    min_consistency: float = 0.041,
+    where: Optional[Predicate] = None,
+    ) -> List[List[RetrievalResult]]:
+    """
+    `retrieve_by_vector` for query representations [Q, D], scored with one matrix-matrix
+    product per chunk of queries. Exact search only; one result list per row.
+    """
+    _check_search_args(top_k, "exact")
+    matrix = db.vector_matrix()
+    reprs = np.asarray(query_vectors, dtype=np.float32)
+    if reprs.ndim != 2 or (matrix.dim and reprs.shape[1] != matrix.dim):
+        raise ValueError(f"query_vectors must have shape [Q, {matrix.dim}], got {reprs.shape}")
+    positions = _candidate_positions(
+        db, matrix, max_strength=max_strength, min_consistency=min_consistency, where=where
+    )
+    if positions.size == 0:
+        return [[] for _ in range(reprs.shape[0])]
+    return _rank_many(db, matrix, positions, reprs, top_k)
+
+
+def _check_search_args(top_k: int, search: str) -> None:
+    if top_k <= 0:
+        raise ValueError(f"top_k must be > 0, got {top_k}")
+    if search not in SEARCH_MODES:
+        raise ValueError(f"search must be one of {SEARCH_MODES}, got {search!r}")
+
+
+def _candidate_positions(
+    db: CarlosDatabase,
+    matrix: VectorMatrix,
+    *,
+    max_strength: float,
+    min_consistency: float,
+    where: Optional[Predicate] = None,
+    ) -> np.ndarray:
+    """
+    Row positions (into `matrix`) satisfying the constraints, in database order.
+    """
+    strength = matrix.strength
+    consistency = matrix.consistency
+    mask = np.isfinite(strength) & np.isfinite(consistency)
+    mask &= strength <= float(max_strength)
+    mask &= consistency >= float(min_consistency)
+    if where is not None:
+        mask &= where.mask(db)
+    return np.flatnonzero(mask)
+
+
+def _shortlist_positions(
+    db: CarlosDatabase,
+    query: np.ndarray,
+    positions: np.ndarray,
+    *,
+    search: str,
+    nprobe: int,
+    quantization: Optional[str],
+    size: int,
+    ) -> np.ndarray:
+    """
+    Candidates left for exact scoring after the optional IVF probe and quantized
+    first pass, in database order.
+    """
+    q = _unit(query)
+    if search == "ann":
+        probed = db.ann_index().probe(q, nprobe)
+        positions = positions[np.isin(positions, probed, assume_unique=True)]
+    if quantization is not None and positions.size:
+        codec = db.quantized_directions(quantization)
+        keep = shortlist(codec.scores(q, positions), size)
+        positions = positions[np.sort(keep)]
+    return positions
+
+
+def _cosine_scores(query: np.ndarray, matrix: VectorMatrix, positions: np.ndarray) -> np.ndarray:
+    """
+    Cosine similarity of the query to each candidate row (eps=1e-8 on the query norm).
+    Reads only the candidates' raw directions (memory-mapped rows stay on disk otherwise)
+    and divides by their norms; no normalized copy of the matrix is needed.
+    """
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    q_norm = max(float(np.linalg.norm(q)), 1e-8)
+    return (matrix.directions[positions] @ q) / (_safe_norms(matrix, positions) * np.float32(q_norm))
+
+
+def _safe_norms(matrix: VectorMatrix, positions: np.ndarray) -> np.ndarray:
+    norms = matrix.norms[positions]
+    return np.where(norms > 0, norms, np.float32(1.0))
+
+
+def _rank_many(
+    db: CarlosDatabase,
+    matrix: VectorMatrix,
+    positions: np.ndarray,
+    reprs: np.ndarray,
+    top_k: int,
+    ) -> List[List[RetrievalResult]]:
+    """Ranked results for every query representation in `reprs` [Q, D] over `positions`."""
+    reprs = np.asarray(reprs, dtype=np.float32)
+    reprs = reprs / np.maximum(np.linalg.norm(reprs, axis=1, keepdims=True), 1e-8)
+    candidates = matrix.directions[positions]
+    norms = _safe_norms(matrix, positions)[:, None]
+
+    out: List[List[RetrievalResult]] = []
+    # Bound the [P, chunk] score block to ~16M floats.
+    chunk = max(1, (1 << 24) // max(positions.size, 1))
+    for start in range(0, reprs.shape[0], chunk):
+        scores = (candidates @ reprs[start : start + chunk].T) / norms
+        for j in range(scores.shape[1]):
+            out.append(_ranked_results(db, matrix, positions, np.ascontiguousarray(scores[:, j]), top_k))
+    return out
+
+
+def _unit(query: np.ndarray) -> np.ndarray:
+    q = np.asarray(query, dtype=np.float32).reshape(-1)
+    return q / max(float(np.linalg.norm(q)), 1e-8)
+
+
+def _top_k(scores: np.ndarray, keys: np.ndarray, k: int) -> np.ndarray:
+    """
+    Indices of the k best scores, ordered by descending score then str(key).
+
+    Same order as a full lexsort, but only rows scoring at least the k-th best score
+    (including every row tied with it) are sorted.
+    """
+    if k < scores.size:
+        ranked = np.where(np.isnan(scores), -np.inf, scores)  # NaN sorts last, as in lexsort
+        kth = np.partition(ranked, scores.size - k)[scores.size - k]
+        cand = np.flatnonzero(ranked >= kth)
+    else:
+        cand = np.arange(scores.size)
+    tie_break = np.asarray([str(key) for key in keys[cand]])
+    return cand[np.lexsort((tie_break, -scores[cand]))[:k]]
+
+
+def _ranked_results(
+    db: CarlosDatabase,
+    matrix: VectorMatrix,
+    positions: np.ndarray,
+    scores: np.ndarray,
+    top_k: int,
+    ) -> List[RetrievalResult]:
+    # High score first, ties broken by lora_id (version_id); only the top_k are sorted.
+    order = _top_k(scores, matrix.keys[positions], top_k)
+
+    # Build RetrievalResult with ranks (rows are only materialized for winners, as
+    # read-only views; lazily-loaded databases read their deferred metadata columns here)
+    rows = db.row_views([int(positions[j]) for j in order])
+    out: List[RetrievalResult] = []
+    for i, (j, row) in enumerate(zip(order, rows), start=1):
+        pos = int(positions[j])
+        out.append(
+            RetrievalResult.from_row(
+                row,
+                score=float(scores[j]),
+                rank=i,
+                vector=matrix.vector(pos),
+                id_column="version_id",
+            )
+        )
+    return out
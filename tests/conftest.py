@@ -0,0 +1,187 @@
+"""
+Shared test fixtures: database rows, random databases, and a tiny randomly initialized
+CLIP text stack (model, toy tokenizer) wired into `carlos.retrieve` without the hub.
+
+torch / transformers are imported only by the fixtures that need them, so torch-free
+tests (and their "does not import torch" checks) are unaffected.
+"""
+import importlib
+import json
+import string
+import weakref
+import zlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from carlos.database import DEFAULT_REQUIRED_COLUMNS, PandasCarlosDatabase
+from carlos.embedding_cache import BaselineEmbeddingCache
+from carlos.model_registry import ModelRegistry
+
+BOS, EOS, MAX_LEN = 98, 99, 16
+TEXT_CONFIG = dict(
+    vocab_size=100,
+    hidden_size=32,
+    intermediate_size=64,
+    num_hidden_layers=2,
+    num_attention_heads=4,
+    max_position_embeddings=MAX_LEN,
+    bos_token_id=BOS,
+    eos_token_id=EOS,
+    pad_token_id=0,
+    projection_dim=8,
+)
+VISION_CONFIG = dict(
+    hidden_size=32, intermediate_size=64, num_hidden_layers=1, num_attention_heads=4, image_size=8, patch_size=4
+)
+
+
+def _row(version_id: int, direction, **overrides):
+    row = {
+        "version_id": version_id,
+        "model_id": 1,
+        "model_name": "M",
+        "folder_name": f"F{version_id}",
+        "model_description": "D",
+        "model_download_count": 1,
+        "model_nsfw_level": 0,
+        "direction": np.asarray(direction, dtype=np.float32),
+        "strength": 1.0,
+        "consistency": 0.5,
+    }
+    row.update(overrides)
+    return row
+
+
+class WordTokenizer:
+    """Toy whitespace tokenizer with CLIP's special-token and truncation conventions."""
+
+    bos_token_id, eos_token_id = BOS, EOS
+
+    @property
+    def tokenizer(self):
+        return self
+
+    def _ids(self, text):
+        return [zlib.crc32(w.encode()) % 90 + 1 for w in text.lower().split()]
+
+    def __call__(self, text=None, *, return_tensors=None, truncation=False, padding=False,
+                 add_special_tokens=True, max_length=MAX_LEN):
+        texts = [text] if isinstance(text, str) else list(text)
+        rows = []
+        for t in texts:
+            ids = self._ids(t)
+            if add_special_tokens:
+                ids = [BOS] + (ids[: max_length - 2] if truncation else ids) + [EOS]
+            rows.append(ids)
+        if return_tensors != "pt":
+            return {"input_ids": rows[0] if isinstance(text, str) else rows}
+        import torch
+
+        width = max(len(r) for r in rows)
+        ids = torch.zeros(len(rows), width, dtype=torch.long)
+        mask = torch.zeros_like(ids)
+        for i, r in enumerate(rows):
+            ids[i, : len(r)] = torch.tensor(r)
+            mask[i, : len(r)] = 1
+        return {"input_ids": ids, "attention_mask": mask}
+
+
+@pytest.fixture
+def make_row():
+    """`make_row(version_id, direction, **column_overrides)` -> one database row."""
+    return _row
+
+
+@pytest.fixture
+def random_db():
+    """
+    `random_db(n=200, dim=16, seed=0, first_id=1, **column_overrides)` -> database of `n`
+    rows with standard normal directions. A callable override is called with the
+    version id (e.g. `model_nsfw_level=lambda i: i % 3`).
+    """
+
+    def build(n: int = 200, dim: int = 16, seed: int = 0, first_id: int = 1, **overrides) -> PandasCarlosDatabase:
+        rng = np.random.default_rng(seed)
+        rows = []
+        for i in range(first_id, first_id + n):
+            values = {k: (v(i) if callable(v) else v) for k, v in overrides.items()}
+            rows.append(_row(i, rng.normal(size=dim), **values))
+        return PandasCarlosDatabase(df=pd.DataFrame(rows, columns=list(DEFAULT_REQUIRED_COLUMNS)))
+
+    return build
+
+
+@pytest.fixture
+def clip_text_config():
+    """Text config of the tiny CLIP (a copy; `bos_token_id` / `eos_token_id` match `word_tokenizer`)."""
+    return dict(TEXT_CONFIG)
+
+
+@pytest.fixture
+def word_tokenizer():
+    return WordTokenizer()
+
+
+@pytest.fixture
+def tiny_clip():
+    """`tiny_clip(text_only=False)` -> a seeded, randomly initialized tiny CLIP in eval mode."""
+    torch = pytest.importorskip("torch")
+    transformers = pytest.importorskip("transformers")
+
+    def build(text_only: bool = False):
+        torch.manual_seed(0)
+        if text_only:
+            model = transformers.CLIPTextModelWithProjection(transformers.CLIPTextConfig(**TEXT_CONFIG))
+        else:
+            config = transformers.CLIPConfig(text_config=TEXT_CONFIG, vision_config=VISION_CONFIG, projection_dim=8)
+            model = transformers.CLIPModel(config)
+        model.config._name_or_path = "tiny-clip"
+        return model.eval()
+
+    return build
+
+
+@pytest.fixture
+def tiny_clip_dir(tmp_path, tiny_clip):
+    """
+    Directory with the full tiny CLIP and a real `CLIPTokenizer` over a small BPE vocab
+    (letters, a few merges, punctuation), loadable with `from_pretrained`.
+    """
+    path = tmp_path / "tiny-clip"
+    tiny_clip().save_pretrained(path)
+    merges = [("c", "a"), ("ca", "t</w>"), ("o", "i"), ("oi", "l</w>"), ("a", "r"), ("ar", "t</w>")]
+    tokens = list(string.ascii_lowercase) + [c + "</w>" for c in string.ascii_lowercase]
+    tokens += [a + b for a, b in merges] + [",</w>", "!</w>"]
+    tokens += [f"t{i}" for i in range(BOS - len(tokens))] + ["<|startoftext|>", "<|endoftext|>"]
+    (path / "vocab.json").write_text(json.dumps({t: i for i, t in enumerate(tokens)}))
+    (path / "merges.txt").write_text("#version: 0.2\n" + "".join(f"{a} {b}\n" for a, b in merges))
+    (path / "tokenizer_config.json").write_text(
+        json.dumps({"tokenizer_class": "CLIPTokenizer", "model_max_length": MAX_LEN})
+    )
+    return path
+
+
+@pytest.fixture
+def fake_clip(monkeypatch):
+    """
+    `fake_clip(model, tokenizer=None, *, prompts=None, loader=None)` makes
+    `carlos.retrieve` load `model` / `tokenizer` instead of CLIP, into a fresh model
+    registry with empty embedding caches, and returns the module. `prompts` replaces the
+    retrieval prompts; `loader(**load_kwargs) -> (model, tokenizer)` the fixed pair.
+    """
+    pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    def install(model=None, tokenizer=None, *, prompts=None, loader=None):
+        monkeypatch.setattr(r, "_load_clip_model_from_disk", loader or (lambda **kwargs: (model, tokenizer)))
+        monkeypatch.setattr(r, "MODEL_REGISTRY", ModelRegistry())
+        if prompts is not None:
+            monkeypatch.setattr(r, "_flat_retrieval_prompts", lambda: list(prompts))
+        monkeypatch.setattr(r, "_BASELINE_CACHE", BaselineEmbeddingCache())
+        monkeypatch.setattr(r, "_QUERY_CACHES", {})
+        monkeypatch.setattr(r, "_PREFIX_ENCODERS", weakref.WeakKeyDictionary())
+        return r
+
+    return install
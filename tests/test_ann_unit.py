@@ -0,0 +1,93 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from carlos.ann import recall_report
+from carlos.bundled_db import load_bundled_database
+from carlos.database import ann_index_path, load_database
+
+
+def test_recall_on_bundled_database():
+    report = recall_report(load_bundled_database().vector_matrix(), nprobes=(16,), num_queries=50)
+    assert report[16]["recall@10"] >= 0.95
+    assert report[16]["fraction_scanned"] < 0.5
+
+
+def test_probe_with_all_cells_returns_every_row(random_db):
+    db = random_db(n=300)
+    index = db.build_ann_index(nlist=8)
+    assert index.nlist == 8
+    np.testing.assert_array_equal(index.probe(np.ones(16, dtype=np.float32), 8), np.arange(300))
+    assert db.vector_matrix()._normalized is None  # built without a normalized copy
+
+
+def test_large_builds_train_on_a_sample_and_assign_every_row(random_db, monkeypatch):
+    import carlos.ann as ann
+
+    monkeypatch.setattr(ann, "_TRAIN_ROWS", 100)
+    monkeypatch.setattr(ann, "_ASSIGN_CHUNK", 64)
+    m = random_db(n=300).vector_matrix()
+    index = ann.IVFIndex.build(m, nlist=8)
+    nearest = ((m.normalized[:, None, :] - index.centroids[None]) ** 2).sum(axis=2).argmin(axis=1)
+    np.testing.assert_array_equal(index.assignments, nearest)
+
+
+def test_upserts_update_the_index_incrementally(random_db, make_row):
+    db = random_db(n=300)
+    index = db.ann_index()
+    centroids = index.centroids
+
+    new = index.centroids[3] * 10.0
+    db.upsert_row(make_row(1000, new))
+    db.upsert_many([make_row(1, index.centroids[5]), make_row(1001, index.centroids[7])])
+
+    assert db.ann_index() is index
+    assert index.centroids is centroids  # not retrained
+    assert index.matches(db.vector_matrix())
+    assert index.assignments[db.position_of(1000)] == 3
+    assert index.assignments[db.position_of(1)] == 5
+    assert index.assignments[db.position_of(1001)] == 7
+
+
+def test_index_persists_and_is_dropped_when_stale(tmp_path, random_db, make_row):
+    db = random_db(n=300)
+    path = tmp_path / "db.parquet"
+    db.save_parquet(path)
+    index = db.build_ann_index(nlist=8)
+    assert ann_index_path(path).exists()
+
+    loaded = load_database(path)
+    assert loaded._ann is not None
+    np.testing.assert_array_equal(loaded._ann.assignments, index.assignments)
+
+    # Checkpointed upserts are replayed through the incremental path on load.
+    db.upsert_row(make_row(5000, np.ones(16)))
+    db.checkpoint()
+    replayed = load_database(path)
+    assert replayed._ann is not None and replayed._ann.matches(replayed.vector_matrix())
+
+    # A base file rewritten without the index must not pick up an old one.
+    other = random_db(n=50, seed=1)
+    other.save_parquet(path)
+    assert not ann_index_path(path).exists()
+    index.save(ann_index_path(path))
+    assert load_database(path)._ann is None
+
+
+def test_retrieve_ann_matches_exact_with_enough_probes(monkeypatch, random_db):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    db = random_db(n=300)
+    db.build_ann_index(nlist=8, persist=False)
+    q = torch.tensor(np.random.default_rng(2).normal(size=16).astype(np.float32))
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: q)
+
+    exact = r.retrieve(db, "x", top_k=5, min_consistency=0.0)
+    got = r.retrieve(db, "x", top_k=5, min_consistency=0.0, search="ann", nprobe=8)
+    assert [x.version_id for x in got] == [x.version_id for x in exact]
+    assert len(r.retrieve(db, "x", top_k=5, min_consistency=0.0, search="ann", nprobe=1)) == 5
+
+    with pytest.raises(ValueError):
+        r.retrieve(db, "x", search="hnsw")
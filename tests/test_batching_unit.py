@@ -0,0 +1,64 @@
+import threading
+
+import numpy as np
+import pytest
+
+pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from carlos.batching import RetrievalBatcher  # noqa: E402
+from carlos.config import RetrievalConfig  # noqa: E402
+from carlos.filters import col  # noqa: E402
+
+QUERIES = [f"{a} {b}" for a in ("watercolor", "pixel", "oil", "neon") for b in ("cat", "city", "portrait", "forest")]
+
+
+@pytest.fixture
+def tiny_retrieval(fake_clip, tiny_clip, word_tokenizer, random_db):
+    r = fake_clip(tiny_clip(text_only=True), word_tokenizer, prompts=["a portrait of a woman", "oil painting", "a cat"])
+    db = random_db(n=79, dim=8, model_nsfw_level=lambda i: i % 3)
+    return r, db, RetrievalConfig(device="cpu", embeddings_cache_dir=None, query_cache_size=0)
+
+
+def test_concurrent_calls_are_coalesced(tiny_retrieval):
+    r, db, cfg = tiny_retrieval
+    start = threading.Barrier(len(QUERIES))
+    got = {}
+
+    with RetrievalBatcher(db, cfg=cfg, max_batch_size=8, max_wait_ms=200) as batcher:
+        def call(i, q):
+            start.wait()
+            where = col("model_nsfw_level") <= 1 if i % 2 else None
+            got[i] = batcher.retrieve(q, top_k=3 + i % 3, min_consistency=0.0, where=where, timeout=30)
+
+        threads = [threading.Thread(target=call, args=(i, q)) for i, q in enumerate(QUERIES)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        stats = batcher.stats()
+
+    assert stats["queries"] == len(QUERIES)
+    assert stats["batches"] < len(QUERIES) and stats["largest_batch"] <= 8
+    for i, q in enumerate(QUERIES):
+        where = col("model_nsfw_level") <= 1 if i % 2 else None
+        want = r.retrieve(db, q, top_k=3 + i % 3, min_consistency=0.0, where=where, cfg=cfg)
+        assert [x.version_id for x in got[i]] == [x.version_id for x in want]
+        np.testing.assert_allclose([x.score for x in got[i]], [x.score for x in want], atol=1e-5)
+
+
+def test_errors_reach_the_caller_and_close_is_final(tiny_retrieval, monkeypatch):
+    r, db, cfg = tiny_retrieval
+    batcher = RetrievalBatcher(db, cfg=cfg, max_wait_ms=0)
+    with pytest.raises(ValueError):
+        batcher.submit("", top_k=3)
+
+    def broken(*args, **kwargs):
+        raise RuntimeError("encoder down")
+
+    monkeypatch.setattr("carlos.batching._embed_queries", broken)
+    with pytest.raises(RuntimeError, match="encoder down"):
+        batcher.retrieve("cat", timeout=30)
+    batcher.close()
+    with pytest.raises(RuntimeError):
+        batcher.submit("cat")
@@ -0,0 +1,51 @@
+import copy
+
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+from carlos.config import RetrievalConfig  # noqa: E402
+from carlos.cpu_inference import quantize_text_encoder  # noqa: E402
+from carlos.embedding_cache import model_fingerprint  # noqa: E402
+
+
+def test_quantization_touches_only_the_text_tower(tiny_clip):
+    model = tiny_clip()
+    ids = torch.randint(1, 90, (4, 10))
+    with torch.inference_mode():
+        want = model.get_text_features(input_ids=ids).pooler_output
+    quantized = quantize_text_encoder(copy.deepcopy(model))
+    with torch.inference_mode():
+        got = quantized.get_text_features(input_ids=ids).pooler_output
+
+    assert torch.cosine_similarity(want, got).min() > 0.99
+    assert type(quantized.text_model.encoder.layers[0].mlp.fc1) is not torch.nn.Linear
+    assert type(quantized.visual_projection) is torch.nn.Linear
+    assert model_fingerprint(quantized) == model_fingerprint(model) + "+int8"
+
+
+def test_cpu_config_selects_quantized_model(fake_clip):
+    calls = []
+    r = fake_clip(loader=lambda **kwargs: calls.append(kwargs) or (None, None))
+
+    r._clip_for(RetrievalConfig(device="cpu", cpu_threads=2, cpu_quantize=True))
+    r._clip_for(RetrievalConfig(device="cpu"))
+    r._clip_for(RetrievalConfig(device="cuda", cpu_threads=2, cpu_quantize=True))
+    assert [(c["quantize"], c["num_threads"]) for c in calls] == [(True, 2), (False, None), (False, None)]
+
+
+def test_cpu_quantization_report(fake_clip, tiny_clip, word_tokenizer, random_db):
+    model = tiny_clip()
+    variants = {False: model, True: quantize_text_encoder(copy.deepcopy(model))}
+    r = fake_clip(
+        loader=lambda **kwargs: (variants[kwargs["quantize"]], word_tokenizer),
+        prompts=["a portrait of a woman", "oil painting", "a cat on a sofa"],
+    )
+    db = random_db(n=49, dim=8)
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=None)
+    report = r.cpu_quantization_report(db, ["watercolor", "pixel art", "watercolor"], cfg=cfg, top_k=5)
+
+    assert report["queries"] == 2.0
+    assert report["cosine_mean"] > 0.95
+    assert report["float32_ms_per_query"] > 0 and report["int8_ms_per_query"] > 0
@@ -1,3 +1,6 @@
+import threading
+import time
+
 import numpy as np
 import pandas as pd
 import pytest
@@ -5,6 +8,9 @@ import pytest
 from carlos.database import (
     DEFAULT_REQUIRED_COLUMNS,
     PandasCarlosDatabase,
+    convert_to_columnar,
+    deltas_dir_path,
+    directions_sidecar_path,
     load_database,
 )
 from carlos.types import CarlosVector, IndexingResult
@@ -118,4 +124,386 @@ def test_upsert_indexing_result_inserts_vector_fields():
     got = db.get_vector(key="version_id", value=55)
     assert np.allclose(got.direction, np.array([0, 0, 1], dtype=np.float32))
     assert got.strength == pytest.approx(3.0)
-    assert got.consistency == pytest.approx(0.9)
\ No newline at end of file
+    assert got.consistency == pytest.approx(0.9)
+
+def test_vector_matrix_matches_get_vector():
+    df = pd.DataFrame([_min_row(1, direction=[3, 4, 0]), _min_row(2, direction=[0, 0, 2], strength=2.0)])
+    db = PandasCarlosDatabase(df=df)
+
+    m = db.vector_matrix()
+    assert m.directions.shape == (2, 3)
+    assert m.directions.dtype == np.float32
+    assert m.directions.flags["C_CONTIGUOUS"]
+    assert list(m.keys) == [1, 2]
+    assert np.allclose(m.norms, [5.0, 2.0])
+    assert np.allclose(m.normalized[0], [0.6, 0.8, 0.0])
+    assert np.allclose(m.strength, [1.0, 2.0])
+    assert np.allclose(m.vector(1).direction, db.get_vector(key="version_id", value=2).direction)
+    # cached between calls
+    assert db.vector_matrix() is m
+
+
+def test_vector_matrix_patched_on_update_and_rebuilt_on_insert():
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1), _min_row(2)]))
+    m = db.vector_matrix()
+
+    db.upsert_row(_min_row(2, direction=[0, 2, 0], strength=7.0, consistency=0.25))
+    assert db.vector_matrix() is m
+    assert np.allclose(m.directions[1], [0, 2, 0])
+    assert np.allclose(m.normalized[1], [0, 1, 0])
+    assert m.strength[1] == pytest.approx(7.0)
+    assert m.consistency[1] == pytest.approx(0.25)
+
+    db.upsert_row(_min_row(3, direction=[0, 0, 1]))
+    m2 = db.vector_matrix()
+    assert m2 is not m
+    assert m2.directions.shape == (3, 3)
+    assert list(m2.keys) == [1, 2, 3]
+
+
+def test_columnar_sidecar_roundtrip_is_memory_mapped(tmp_path):
+    df = pd.DataFrame([_min_row(10), _min_row(20, direction=[0, 1, 0], strength=2.0)])
+    src = tmp_path / "db.parquet"
+    PandasCarlosDatabase(df=df).save_parquet(src)
+
+    dest = convert_to_columnar(src, tmp_path / "columnar.parquet")
+    assert directions_sidecar_path(dest).exists()
+    assert "direction" not in pd.read_parquet(dest).columns
+
+    db = load_database(dest)
+    assert db.direction_storage == "npy"
+    m = db.vector_matrix()
+    assert m.directions.dtype == np.float32
+    assert not m.directions.flags.writeable  # read-only memory map, not a copy
+    assert np.allclose(m.directions, [[1, 0, 0], [0, 1, 0]])
+    assert np.allclose(db.get_vector(key="version_id", value=20).direction, [0, 1, 0])
+
+    # Updates work on top of the read-only map and persist in the same layout.
+    db.upsert_row(_min_row(20, direction=[0, 0, 1], strength=3.0))
+    db.upsert_row(_min_row(30, direction=[1, 1, 0]))
+    db.save_parquet()
+    db2 = load_database(dest)
+    assert len(db2) == 3
+    assert np.allclose(db2.get_vector(key="version_id", value=20).direction, [0, 0, 1])
+    assert db2.get_vector(key="version_id", value=20).strength == pytest.approx(3.0)
+
+
+def test_replayed_deltas_keep_the_sidecar_memory_mapped(tmp_path):
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1), _min_row(2)]))
+    db.save_parquet(p, direction_storage="npy")
+    sidecar = directions_sidecar_path(p)
+    on_disk = np.load(sidecar).copy()
+
+    # Updates only: patched into a copy-on-write mapping, the file is untouched.
+    db.upsert_row(_min_row(2, direction=[0, 1, 0]))
+    db.checkpoint()
+    loaded = load_database(p)
+    m = loaded.vector_matrix()
+    assert not m.directions.flags.owndata  # a view of the mapping, not a copy
+    assert np.allclose(m.directions[1], [0, 1, 0])
+    assert np.array_equal(np.load(sidecar), on_disk)
+    assert len(list(deltas_dir_path(p).glob("*.parquet"))) == 1
+
+    # Inserts: folded into a new base, which is mapped.
+    db.upsert_row(_min_row(3, direction=[0, 0, 1]))
+    db.checkpoint()
+    loaded = load_database(p)
+    m = loaded.vector_matrix()
+    assert not m.directions.flags.owndata and not m.directions.flags.writeable
+    assert np.allclose(m.directions, [[1, 0, 0], [0, 1, 0], [0, 0, 1]])
+    assert list(deltas_dir_path(p).glob("*.parquet")) == []
+
+
+def test_saving_list_layout_removes_stale_sidecar(tmp_path):
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1)]))
+    db.save_parquet(p, direction_storage="npy")
+    assert directions_sidecar_path(p).exists()
+
+    db.save_parquet(p, direction_storage="list")
+    assert list(tmp_path.glob("*.directions.npy")) == []
+    assert load_database(p).direction_storage == "list"
+
+
+def test_sidecar_is_committed_with_its_parquet(tmp_path, monkeypatch):
+    import carlos.database as database
+
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1), _min_row(2, direction=[0, 1, 0])]))
+    db.save_parquet(p, direction_storage="npy")
+    first = directions_sidecar_path(p)
+
+    # Crash after the new sidecar is written but before the parquet is replaced: the
+    # old pair stays consistent and the orphan is ignored, then removed by the next save.
+    db.upsert_row(_min_row(3, direction=[0, 0, 1]))
+    real_write = database._atomic_write
+
+    def crash_on_parquet(dst, write):
+        if dst == p:
+            raise OSError("disk full")
+        real_write(dst, write)
+
+    monkeypatch.setattr(database, "_atomic_write", crash_on_parquet)
+    with pytest.raises(OSError):
+        db.save_parquet()
+    monkeypatch.undo()
+    assert len(list(tmp_path.glob("*.directions.npy"))) == 2
+    assert directions_sidecar_path(p) == first
+    assert len(load_database(p)) == 2
+
+    db.save_parquet()
+    assert list(tmp_path.glob("*.directions.npy")) == [directions_sidecar_path(p)]
+    assert np.allclose(load_database(p).vector_matrix().directions[2], [0, 0, 1])
+
+    # A parquet whose sidecar is missing or of another size fails loudly.
+    np.save(directions_sidecar_path(p), np.zeros((2, 3), dtype=np.float32))
+    with pytest.raises(ValueError, match="sidecar"):
+        load_database(p)
+    directions_sidecar_path(p).unlink()
+    with pytest.raises(FileNotFoundError, match="sidecar"):
+        load_database(p)
+
+
+def test_key_index_normalizes_str_and_int_keys():
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(5)]))
+
+    assert db.position_of("5") == 0
+    assert db.position_of(np.int64(5)) == 0
+    assert db.position_of(6) is None
+    assert db.get_row(key="version_id", value=" 5 ")["folder_name"] == "folder_5"
+    assert db.get_vector(key="version_id", value="5").strength == pytest.approx(1.0)
+
+    # A string key must update the int64 row, not append a duplicate.
+    db.upsert_row(_min_row("5", strength=4.0))
+    assert len(db) == 1
+    assert db.get_vector(key="version_id", value=5).strength == pytest.approx(4.0)
+
+    db.upsert_row(_min_row(6))
+    assert db.position_of(6) == 1
+    with pytest.raises(KeyError):
+        db.get_row(key="version_id", value=7)
+
+
+def test_upsert_many_matches_sequential_upserts():
+    base = [_min_row(1), _min_row(2, direction=[0, 1, 0])]
+    batch = [
+        _min_row("2", direction=[0, 0, 1], strength=5.0),  # update via str key
+        _min_row(3, direction=[1, 1, 0]),
+        _min_row(3, direction=[1, 0, 1], strength=9.0),  # later row wins
+        IndexingResult(
+            lora_id="4",
+            vector=CarlosVector.from_direction_strength_consistency([0, 1, 1], 2.0, 0.3, expected_dim=3),
+            row=_min_row(4),
+        ),
+    ]
+
+    bulk = PandasCarlosDatabase(df=pd.DataFrame(base))
+    bulk.vector_matrix()
+    bulk.upsert_many(batch)
+
+    seq = PandasCarlosDatabase(df=pd.DataFrame(base))
+    for item in batch:
+        if isinstance(item, IndexingResult):
+            seq.upsert_indexing_result(item)
+        else:
+            seq.upsert_row(item)
+
+    assert len(bulk) == len(seq) == 4
+    assert bulk.df["version_id"].tolist() == [1, 2, 3, 4]
+    for v in (1, 2, 3, 4):
+        a = bulk.get_vector(key="version_id", value=v)
+        b = seq.get_vector(key="version_id", value=v)
+        assert np.allclose(a.direction, b.direction)
+        assert a.strength == pytest.approx(b.strength)
+        assert a.consistency == pytest.approx(b.consistency)
+    assert np.allclose(bulk.vector_matrix().directions, seq.vector_matrix().directions)
+
+
+def test_upsert_many_validates_batch():
+    db = PandasCarlosDatabase(df=pd.DataFrame(columns=list(DEFAULT_REQUIRED_COLUMNS)))
+    row = _min_row(1)
+    del row["model_name"]
+    with pytest.raises(KeyError, match="model_name"):
+        db.upsert_many([_min_row(2), row])
+    assert len(db) == 0
+
+    with pytest.raises(ValueError):
+        db.upsert_many([_min_row("")])
+
+    corrupt = PandasCarlosDatabase(df=pd.DataFrame([_min_row(7), _min_row(7)]))
+    with pytest.raises(ValueError, match="multiple rows"):
+        corrupt.upsert_many([_min_row(7)])
+
+
+@pytest.mark.parametrize("bulk", [False, True])
+def test_upsert_paths_coerce_ids_alike(bulk):
+    db = PandasCarlosDatabase(df=pd.DataFrame(columns=list(DEFAULT_REQUIRED_COLUMNS)))
+    upsert = (lambda row: db.upsert_many([row])) if bulk else db.upsert_row
+
+    upsert(dict(_min_row(" 4 "), model_id=7.0, model_nsfw_level="2", model_download_count=None))
+    row = db.get_row(key="version_id", value=4)
+    assert (row["model_id"], row["model_nsfw_level"]) == (7, 2)
+    assert pd.isna(row["model_download_count"])
+
+    for bad in (dict(_min_row(5), model_id=1.5), _min_row(5.5), dict(_min_row(5), model_id="x")):
+        with pytest.raises(TypeError):
+            upsert(bad)
+    with pytest.raises(ValueError):
+        upsert(_min_row(None))
+    assert len(db) == 1
+
+
+def test_checkpoint_writes_delta_segments_replayed_on_load(tmp_path):
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1), _min_row(2)]))
+    db.save_parquet(p)
+    base_bytes = p.read_bytes()
+
+    assert db.checkpoint() is None  # nothing changed
+    db.upsert_row(_min_row(2, strength=5.0))
+    seg1 = db.checkpoint()
+    db.upsert_row(_min_row(3, direction=[0, 0, 1]))
+    db.upsert_row(_min_row(2, strength=6.0))
+    seg2 = db.checkpoint()
+    assert db._matrix is None  # only the dirty rows' directions were stacked
+
+    assert p.read_bytes() == base_bytes  # base untouched
+    assert [s.name for s in sorted(deltas_dir_path(p).iterdir())] == [seg1.name, seg2.name]
+    assert len(pd.read_parquet(seg2)) == 2  # only the changed rows
+
+    db2 = load_database(p)
+    assert len(db2) == 3
+    assert db2.get_vector(key="version_id", value=2).strength == pytest.approx(6.0)
+    assert np.allclose(db2.get_vector(key="version_id", value=3).direction, [0, 0, 1])
+    assert len(load_database(p, apply_deltas=False)) == 2
+
+
+def test_overlapping_compactions_run_one_at_a_time(tmp_path, monkeypatch):
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1)]))
+    db.save_parquet(p)
+
+    writers, peak = [], []
+    write_base = PandasCarlosDatabase._write_base
+
+    def slow_write_base(snapshot, out, storage):
+        writers.append(1)
+        peak.append(len(writers))
+        time.sleep(0.05)
+        write_base(snapshot, out, storage)
+        writers.pop()
+
+    monkeypatch.setattr(PandasCarlosDatabase, "_write_base", slow_write_base)
+    threads = set()
+    for v in range(2, 12):
+        db.upsert_row(_min_row(v))
+        db.checkpoint(compact_after=2)
+        if db._compact_thread is not None:
+            threads.add(db._compact_thread)
+    db.compact()
+    for t in threads:
+        t.join()
+
+    assert max(peak) == 1
+    assert len(threads) < 10  # requests made while one was running were skipped
+    assert list(tmp_path.glob("*.tmp")) == []
+    assert sorted(load_database(p).df["version_id"]) == list(range(1, 12))
+
+
+def test_compact_folds_deltas_into_base(tmp_path):
+    p = tmp_path / "db.parquet"
+    db = PandasCarlosDatabase(df=pd.DataFrame([_min_row(1)]))
+    db.save_parquet(p)
+    for v in (2, 3):
+        db.upsert_row(_min_row(v))
+        db.checkpoint()
+
+    db.compact(background=True).join()
+    assert list(deltas_dir_path(p).glob("*.parquet")) == []
+    assert len(pd.read_parquet(p)) == 3
+
+    # A segment written after compaction is replayed on top of the new base.
+    db.upsert_row(_min_row(1, strength=9.0))
+    db.checkpoint()
+    db2 = load_database(p)
+    assert len(db2) == 3
+    assert db2.get_vector(key="version_id", value=1).strength == pytest.approx(9.0)
+
+
+def test_lazy_load_reads_metadata_only_for_requested_rows(tmp_path):
+    p = tmp_path / "db.parquet"
+    rows = [_min_row(v, direction=[v, 1, 0]) for v in (1, 2, 3)]
+    for r in rows:
+        r["model_description"] = f"long description {r['version_id']}"
+        r["notes"] = f"note {r['version_id']}"
+    PandasCarlosDatabase(df=pd.DataFrame(rows)).save_parquet(p)
+    schema = list(pd.read_parquet(p).columns)
+
+    db = load_database(p, lazy=True)
+    assert "model_description" in db.deferred_columns
+    assert db.df["model_description"].isna().all()
+    assert np.allclose(db.vector_matrix().directions[:, 0], [1, 2, 3])
+
+    got = db.rows_at([2])[0]
+    assert got["model_description"] == "long description 3"
+    assert int(got["model_id"]) == 111
+    assert db.get_row(key="version_id", value=1)["folder_name"] == "folder_1"
+    # Read values are kept beside the frame, which is never re-cast on reads.
+    assert db.df["model_description"].isna().all()
+    assert db._hydrated_rows.tolist() == [True, False, True]
+
+    # Updating a row keeps the deferred values its new data does not carry.
+    db.upsert_row(_min_row(2, strength=3.0))
+    assert db.get_row(key="version_id", value=2)["notes"] == "note 2"
+
+    # Saving a lazily loaded database must not drop the deferred columns.
+    db.upsert_row(_min_row(4))
+    db.save_parquet()
+    assert db.deferred_columns == ()
+    back = pd.read_parquet(p)
+    assert list(back.columns) == schema  # written back in the original column order
+    assert back["model_description"].tolist()[:3] == ["long description 1", "desc", "long description 3"]
+    assert back["notes"].tolist()[:3] == ["note 1", "note 2", "note 3"]
+
+
+def test_lazy_reads_are_safe_alongside_materialize(tmp_path):
+    p = tmp_path / "db.parquet"
+    rows = [_min_row(v, direction=[v, 1, 0]) for v in range(1, 201)]
+    for r in rows:
+        r["model_description"] = f"description {r['version_id']}"
+    PandasCarlosDatabase(df=pd.DataFrame(rows)).save_parquet(p)
+    db = load_database(p, lazy=True)
+
+    errors = []
+
+    def read(seed):
+        rng = np.random.default_rng(seed)
+        try:
+            for _ in range(50):
+                pos = rng.integers(0, 200, size=5)
+                got = [r["model_description"] for r in db.rows_at(pos)]
+                assert got == [f"description {p + 1}" for p in pos]
+        except Exception as e:  # reported below
+            errors.append(e)
+
+    threads = [threading.Thread(target=read, args=(i,)) for i in range(4)]
+    for t in threads:
+        t.start()
+    db.materialize()
+    for t in threads:
+        t.join()
+    assert errors == [] and db.deferred_columns == ()
+
+
+def test_column_projection_without_lazy_keeps_deferred_columns_unloaded(tmp_path):
+    p = tmp_path / "db.parquet"
+    PandasCarlosDatabase(df=pd.DataFrame([_min_row(1)])).save_parquet(p)
+
+    db = load_database(p, columns=["model_nsfw_level"])
+    assert int(db.df["model_nsfw_level"].iloc[0]) == 0
+    assert "model_nsfw_level" not in db.deferred_columns
+    assert db.rows_at([0])[0]["model_name"] is None
+
+    with pytest.raises(KeyError):
+        load_database(p, columns=["no_such_column"])
@@ -0,0 +1,160 @@
+import importlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from carlos.config import RetrievalConfig
+from carlos.embedding_cache import (
+    BaselineEmbeddingCache,
+    QueryEmbeddingCache,
+    baseline_filename,
+    model_fingerprint,
+    prompt_set_hash,
+    query_cache_key,
+)
+
+
+def _counting(result):
+    calls = []
+
+    def compute():
+        calls.append(1)
+        return result
+
+    return compute, calls
+
+
+def test_prompt_set_hash_is_order_and_boundary_sensitive():
+    assert prompt_set_hash(["a", "b"]) == prompt_set_hash(["a", "b"])
+    assert prompt_set_hash(["a", "b"]) != prompt_set_hash(["b", "a"])
+    assert prompt_set_hash(["ab", "c"]) != prompt_set_hash(["a", "bc"])
+
+
+def test_model_fingerprint_uses_name_and_revision():
+    model = SimpleNamespace(config=SimpleNamespace(_name_or_path="openai/clip", _commit_hash="abc123"))
+    assert model_fingerprint(model) == "openai/clip@abc123"
+    assert model_fingerprint(SimpleNamespace(config=SimpleNamespace(_name_or_path="/models/clip"))) == "/models/clip@local"
+
+
+def test_baseline_is_computed_once_and_persisted(tmp_path):
+    emb = np.arange(6, dtype=np.float32).reshape(3, 2)
+    compute, calls = _counting(emb)
+    cache = BaselineEmbeddingCache()
+
+    first = cache.get("m@1", ["a", "b", "c"], compute, cache_dir=tmp_path)
+    again = cache.get("m@1", ["a", "b", "c"], compute, cache_dir=tmp_path)
+    assert again is first and len(calls) == 1
+    assert not first.flags.writeable
+    assert (tmp_path / baseline_filename("m@1", prompt_set_hash(["a", "b", "c"]))).exists()
+
+    # A new process (fresh cache) reads the file instead of computing.
+    restarted = BaselineEmbeddingCache()
+    np.testing.assert_array_equal(restarted.get("m@1", ["a", "b", "c"], compute, cache_dir=tmp_path), emb)
+    assert len(calls) == 1
+
+    # Another prompt set or model revision is a different entry.
+    cache.get("m@1", ["a", "b"], lambda: emb[:2], cache_dir=tmp_path)
+    cache.get("m@2", ["a", "b", "c"], compute, cache_dir=tmp_path)
+    assert len(calls) == 2
+
+
+def test_precomputed_embeddings_are_preferred_and_bad_files_ignored(tmp_path):
+    precomputed = tmp_path / "precomputed"
+    precomputed.mkdir()
+    shipped = np.ones((2, 4), dtype=np.float32)
+    np.save(precomputed / baseline_filename("m@1", prompt_set_hash(["a", "b"])), shipped)
+    cache = BaselineEmbeddingCache(precomputed_dir=precomputed)
+    compute, calls = _counting(np.zeros((2, 4), dtype=np.float32))
+    np.testing.assert_array_equal(cache.get("m@1", ["a", "b"], compute), shipped)
+    assert calls == []
+
+    # Wrong row count (e.g. a stale file) is recomputed.
+    np.save(tmp_path / baseline_filename("m@1", prompt_set_hash(["x"])), np.ones((5, 4), dtype=np.float32))
+    compute, calls = _counting(np.zeros((1, 4), dtype=np.float32))
+    cache.get("m@1", ["x"], compute, cache_dir=tmp_path)
+    assert len(calls) == 1
+
+
+def test_retrieval_embeds_baseline_prompts_once(monkeypatch, tmp_path, fake_clip):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    class FakeModel:
+        config = SimpleNamespace(_name_or_path="fake-clip", _commit_hash="0")
+
+        def to(self, device):
+            return self
+
+    embedded = []
+
+    def fake_embeddings(texts, model, processor, device):
+        embedded.append(len(texts))
+        return torch.stack([torch.tensor([float(len(t)), 1.0]) for t in texts])
+
+    fake_clip(FakeModel())
+    monkeypatch.setattr(r, "_get_text_embeddings", fake_embeddings)
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=tmp_path, query_cache_size=0)
+
+    q1 = r._embed_query_stub("anime", cfg=cfg)
+    q2 = r._embed_query_stub("watercolor", cfg=cfg)
+    n = embedded[0]
+    assert embedded == [n, n, n]  # baseline once, then one suffixed batch per query
+    assert torch.allclose(q1, torch.tensor([6.0, 0.0])) and torch.allclose(q2, torch.tensor([11.0, 0.0]))
+
+
+def test_query_cache_lru_eviction_and_counters():
+    cache = QueryEmbeddingCache(2)
+    a = query_cache_key("Anime  Style", "m@1", "p")
+    assert a == query_cache_key(" anime style", "m@1", "p")
+    assert a != query_cache_key("anime style", "m@2", "p")
+
+    assert cache.get(a) is None
+    cache.put(a, np.ones(3))
+    cache.put("b", np.zeros(3))
+    assert cache.get(a) is not None  # a is now most recently used
+    cache.put("c", np.zeros(3))
+    assert cache.get("b") is None
+    assert cache.stats() == {"hits": 1, "disk_hits": 0, "misses": 2, "evictions": 1, "entries": 2}
+    with pytest.raises(ValueError):
+        cache.get(a)[0] = 5.0  # cached vectors are read-only
+
+
+def test_query_cache_survives_restart_on_disk(tmp_path):
+    QueryEmbeddingCache(4, cache_dir=tmp_path).put("k", np.arange(4, dtype=np.float32))
+    restarted = QueryEmbeddingCache(4, cache_dir=tmp_path)
+    np.testing.assert_array_equal(restarted.get("k"), np.arange(4))
+    assert restarted.get("k") is not None
+    assert restarted.stats() == {"hits": 2, "disk_hits": 1, "misses": 0, "evictions": 0, "entries": 1}
+
+
+def test_repeated_queries_skip_the_text_encoder(monkeypatch, tmp_path, fake_clip):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    class FakeModel:
+        config = SimpleNamespace(_name_or_path="fake-clip", _commit_hash="0")
+
+        def to(self, device):
+            return self
+
+    embedded = []
+
+    def fake_embeddings(texts, model, processor, device):
+        embedded.append(len(texts))
+        return torch.stack([torch.tensor([float(len(t)), 1.0]) for t in texts])
+
+    fake_clip(FakeModel())
+    monkeypatch.setattr(r, "_get_text_embeddings", fake_embeddings)
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=None, query_cache_dir=tmp_path / "q")
+
+    first = r._embed_query_stub("Watercolor", cfg=cfg)
+    calls = len(embedded)
+    again = r._embed_query_stub("  watercolor ", cfg=cfg)
+    assert len(embedded) == calls and torch.equal(first, again)
+    assert r.query_cache(cfg).stats()["hits"] == 1
+
+    monkeypatch.setattr(r, "_QUERY_CACHES", {})  # restart: served from disk
+    r._embed_query_stub("watercolor", cfg=cfg)
+    assert len(embedded) == calls
+    assert r.query_cache(cfg).stats()["disk_hits"] == 1
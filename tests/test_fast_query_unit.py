@@ -0,0 +1,94 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from carlos.fast_query import (
+    FastQueryEncoder,
+    fidelity_report,
+    fit_fast_query_encoder,
+    query_encoder_path,
+    split_queries,
+)
+
+
+def _linear_problem(n=400, d_in=24, d_out=16, rank=None, seed=0):
+    rng = np.random.default_rng(seed)
+    w = rng.normal(size=(d_in, d_out))
+    if rank is not None:
+        w = rng.normal(size=(d_in, rank)) @ rng.normal(size=(rank, d_out))
+    x = rng.normal(size=(n, d_in)).astype(np.float32)
+    y = (x @ w + 0.5).astype(np.float32)
+    return x, y
+
+
+def test_fit_recovers_linear_map_and_round_trips(tmp_path):
+    x, y = _linear_problem()
+    enc = fit_fast_query_encoder(x, y, model_key="m@1", prompts_hash="p", ridge=1e-6)
+    assert enc.right is None
+    assert np.allclose(enc.predict(x[:5]), y[:5], atol=1e-2)
+
+    path = enc.save(tmp_path / "enc.npz")
+    loaded = FastQueryEncoder.load(path)
+    np.testing.assert_array_equal(loaded.predict(x[:5]), enc.predict(x[:5]))
+    assert (loaded.model_key, loaded.prompts_hash) == ("m@1", "p")
+    with pytest.raises(ValueError):
+        loaded.check_compatible("m@2", "p")
+
+
+def test_reduced_rank_fit_is_factored():
+    x, y = _linear_problem(rank=3)
+    enc = fit_fast_query_encoder(x, y, model_key="m", prompts_hash="p", rank=3, ridge=1e-6)
+    assert enc.rank == 3 and enc.left.shape == (24, 3) and enc.right.shape == (3, 16)
+    assert np.allclose(enc.predict(x[:5]), y[:5], atol=1e-2)
+
+
+def test_fidelity_report(random_db):
+    db = random_db(n=50, dim=8)
+    rng = np.random.default_rng(1)
+    exact = rng.normal(size=(20, 8))
+    perfect = fidelity_report(db.vector_matrix(), exact, 3.0 * exact, k=5)
+    assert perfect["cosine_mean"] == pytest.approx(1.0)
+    assert perfect["recall@5"] == 1.0 and perfect["top1_agreement"] == 1.0
+    noisy = fidelity_report(db.vector_matrix(), exact, exact + rng.normal(size=exact.shape), k=5)
+    assert noisy["cosine_mean"] < 0.9 and noisy["recall@5"] < 1.0
+
+
+def test_split_queries_is_deterministic_and_disjoint():
+    train, held = split_queries([f"q{i}" for i in range(10)] + ["q0"], holdout=0.2)
+    assert len(train) == 8 and len(held) == 2 and not set(train) & set(held)
+    assert split_queries([f"q{i}" for i in range(10)], holdout=0.2) == (train, held)
+
+
+def test_train_and_retrieve_in_fast_mode(monkeypatch, tmp_path, random_db):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    db = random_db(n=79, dim=8)
+    db.save_parquet(tmp_path / "db.parquet")
+
+    # "CLIP" text embedding of a query, and an exact representation that is linear in it.
+    w = np.random.default_rng(1).normal(size=(12, 8))
+    text = lambda q: np.random.default_rng(abs(hash(q)) % 2**32).normal(size=12).astype(np.float32)  # noqa: E731
+    monkeypatch.setattr(r, "_query_text_embeddings", lambda qs, cfg, batch_size=2048: (np.stack([text(q) for q in qs]), "fake@0"))
+    monkeypatch.setattr(r, "_embed_queries", lambda qs, cfg, batch_size=2048: np.stack([text(q) @ w for q in qs]).astype(np.float32))
+    monkeypatch.setattr(r, "_embed_query_stub", lambda q, cfg: torch.from_numpy((text(q) @ w).astype(np.float32)))
+
+    with pytest.raises(FileNotFoundError):
+        r.retrieve(db, "anime", query_mode="fast")
+
+    queries = [f"query {i}" for i in range(200)]
+    enc, report = r.train_fast_query_encoder(db, queries, ridge=1e-6)
+    assert query_encoder_path(db.path).exists()
+    assert report["queries"] == 40 and report["cosine_mean"] > 0.999 and report["recall@10"] == 1.0
+
+    for q in ("anime style", "watercolor"):
+        fast = r.retrieve(db, q, top_k=5, min_consistency=0.0, query_mode="fast")
+        exact = r.retrieve(db, q, top_k=5, min_consistency=0.0)
+        assert [x.version_id for x in fast] == [x.version_id for x in exact]
+    many = r.retrieve_many(db, ["anime style", "watercolor"], top_k=5, min_consistency=0.0, query_mode="fast")
+    assert [x.version_id for x in many[1]] == [x.version_id for x in fast]
+    assert r.fast_query_fidelity(db, ["a", "b", "c"])["top1_agreement"] == 1.0
+
+    with pytest.raises(ValueError):
+        r.retrieve(db, "anime", query_mode="fastest")
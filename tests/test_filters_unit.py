@@ -0,0 +1,116 @@
+import importlib
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from carlos.database import DEFAULT_REQUIRED_COLUMNS, FILTER_MASK_CACHE_SIZE, PandasCarlosDatabase, load_database
+from carlos.filters import col
+
+
+def _row(version_id: int, nsfw, downloads, name="M"):
+    return {
+        "version_id": version_id,
+        "model_id": version_id // 10,
+        "model_name": name,
+        "folder_name": f"F{version_id}",
+        "model_description": "D",
+        "model_download_count": downloads,
+        "model_nsfw_level": nsfw,
+        "direction": np.asarray([1.0, float(version_id), 0.0], dtype=np.float32),
+        "strength": 1.0,
+        "consistency": 0.5,
+    }
+
+
+def _db():
+    rows = [
+        _row(1, 0, 50_000, name="Winter"),
+        _row(2, 1, 10, name="Pixel"),
+        _row(3, 4, 90_000, name="Oil"),
+        _row(4, None, 2_000, name="Snow"),
+        _row(5, 1, None, name="Winter"),
+    ]
+    return PandasCarlosDatabase(df=pd.DataFrame(rows, columns=list(DEFAULT_REQUIRED_COLUMNS)))
+
+
+def _selected(db, where):
+    return db.vector_matrix().keys[where.mask(db)].tolist()
+
+
+def test_comparisons_and_combinators():
+    db = _db()
+    assert _selected(db, col("model_nsfw_level") <= 1) == [1, 2, 5]
+    assert _selected(db, col("model_nsfw_level") != 1) == [1, 3]  # missing never matches
+    assert _selected(db, (col("model_nsfw_level") <= 1) & (col("model_download_count") >= 1_000)) == [1]
+    assert _selected(db, (col("model_nsfw_level") > 1) | (col("model_download_count") < 100)) == [2, 3]
+    assert _selected(db, ~(col("model_nsfw_level") <= 1)) == [3, 4]
+    assert _selected(db, col("model_download_count").between(2_000, 50_000)) == [1, 4]
+    assert _selected(db, col("model_name").isin(["Winter", "Oil"])) == [1, 3, 5]
+    assert _selected(db, col("model_name") == "Pixel") == [2]
+
+
+def test_leaf_masks_are_cached_until_upsert():
+    db = _db()
+    where = col("model_nsfw_level") <= 1
+    first = where.mask(db)
+    assert where.mask(db) is first
+    assert (col("model_nsfw_level") <= 1).mask(db) is first  # equal expressions share the bitmap
+
+    db.upsert_row(_row(6, 0, 1))
+    assert _selected(db, where) == [1, 2, 5, 6]
+
+
+def test_leaf_mask_cache_is_bounded():
+    db = _db()
+    hot = col("model_nsfw_level") <= 1
+    first = hot.mask(db)
+    for i in range(5 * FILTER_MASK_CACHE_SIZE):
+        (col("model_download_count") >= i).mask(db)
+        hot.mask(db)  # recently used, so never evicted
+        assert len(db._filter_masks) <= FILTER_MASK_CACHE_SIZE
+    assert hot.mask(db) is first
+
+
+def test_invalid_expressions():
+    db = _db()
+    with pytest.raises(KeyError):
+        (col("no_such_column") == 1).mask(db)
+    with pytest.raises(ValueError):
+        col("model_nsfw_level") == None  # noqa: E711
+    with pytest.raises(TypeError):
+        (col("model_nsfw_level") <= 1) & True
+
+
+def test_filter_loads_only_the_needed_deferred_column(tmp_path):
+    path = tmp_path / "db.parquet"
+    _db().save_parquet(path)
+    db = load_database(path, lazy=True)
+    assert "model_nsfw_level" in db.deferred_columns
+
+    assert _selected(db, col("model_nsfw_level") <= 1) == [1, 2, 5]
+    assert "model_nsfw_level" not in db.deferred_columns
+    assert "model_name" in db.deferred_columns
+
+
+def test_retrieve_applies_where_before_scoring(monkeypatch):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    db = _db()
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: torch.tensor([0.0, 1.0, 0.0]))
+    scored = []
+    real = r._score_matrix
+
+    def spy(query_repr, matrix, positions):
+        scored.append(positions.tolist())
+        return real(query_repr, matrix, positions)
+
+    monkeypatch.setattr(r, "_score_matrix", spy)
+
+    where = (col("model_nsfw_level") <= 1) & (col("model_download_count") >= 1_000)
+    out = r.retrieve(db, "x", top_k=5, min_consistency=0.0, where=where)
+    assert [x.version_id for x in out] == ["1"]
+    assert scored == [[0]]
+
+    assert r.retrieve(db, "x", top_k=5, min_consistency=0.0, where=col("model_nsfw_level") > 10) == []
@@ -0,0 +1,110 @@
+import importlib
+import random
+import socket
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from carlos.model_loading import LoadPolicy, is_retryable, load_concurrently, retry_call
+from carlos.model_registry import ModelRegistry
+
+
+class HTTPError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.response = SimpleNamespace(status_code=status)
+
+
+class RepositoryNotFoundError(HTTPError):
+    pass
+
+
+def _failing(error, calls):
+    def load():
+        calls.append(1)
+        raise error
+    return load
+
+
+def _chained(outer, cause):
+    try:
+        raise outer from cause
+    except Exception as e:
+        return e
+
+
+def test_only_transient_errors_are_retryable():
+    assert is_retryable(ConnectionResetError("reset"))
+    assert is_retryable(TimeoutError())
+    assert is_retryable(HTTPError(503)) and is_retryable(HTTPError(429))
+    assert is_retryable(_chained(OSError("couldn't connect"), ConnectionRefusedError()))
+
+    assert not is_retryable(HTTPError(404))
+    assert not is_retryable(RepositoryNotFoundError(401))
+    assert not is_retryable(FileNotFoundError("no such file"))
+    assert not is_retryable(ValueError("bad config"))
+    # No network at all: the hub host does not resolve.
+    assert not is_retryable(_chained(OSError("couldn't connect"), _chained(ConnectionError(), socket.gaierror(-2))))
+
+
+def test_retry_call_backs_off_with_jitter():
+    sleeps, calls = [], []
+
+    def flaky():
+        calls.append(1)
+        if len(calls) < 4:
+            raise ConnectionResetError("reset")
+        return "model"
+
+    policy = LoadPolicy(max_attempts=5, base_delay_s=1.0, max_delay_s=3.0)
+    assert retry_call(flaky, what="x", policy=policy, sleep=sleeps.append, rng=random.Random(0)) == "model"
+    assert len(calls) == 4 and len(sleeps) == 3
+    assert all(0 <= s <= cap for s, cap in zip(sleeps, [1.0, 2.0, 3.0]))
+
+    calls.clear()
+    with pytest.raises(RuntimeError, match="after 2 attempt") as info:
+        retry_call(_failing(TimeoutError(), calls), what="x", policy=LoadPolicy(max_attempts=2), sleep=lambda s: None)
+    assert len(calls) == 2 and isinstance(info.value.__cause__, TimeoutError)
+
+
+def test_permanent_errors_and_offline_mode_fail_fast(monkeypatch):
+    def no_sleep(s):
+        raise AssertionError("should not back off")
+
+    calls = []
+    with pytest.raises(RuntimeError, match="after 1 attempt"):
+        retry_call(_failing(FileNotFoundError("missing"), calls), what="x", sleep=no_sleep)
+    with pytest.raises(RuntimeError, match="offline"):
+        retry_call(_failing(ConnectionResetError(), calls), what="x", policy=LoadPolicy(local_files_only=True), sleep=no_sleep)
+    monkeypatch.setenv("HF_HUB_OFFLINE", "1")
+    with pytest.raises(RuntimeError, match="offline"):
+        retry_call(_failing(ConnectionResetError(), calls), what="x", sleep=no_sleep)
+    assert len(calls) == 3
+    assert LoadPolicy(local_files_only=True).pretrained_kwargs() == {"local_files_only": True}
+    assert LoadPolicy().pretrained_kwargs() == {}
+
+
+def test_load_concurrently_overlaps_loads():
+    both_started = threading.Barrier(2, timeout=10)
+
+    def load(value):
+        both_started.wait()  # would time out if the loads ran one after the other
+        return value
+
+    assert load_concurrently(lambda: load("model"), lambda: load("tokenizer")) == ("model", "tokenizer")
+    with pytest.raises(KeyError):
+        load_concurrently(lambda: 1, lambda: {}["missing"])
+
+
+def test_clip_cache_miss_fails_fast_offline(monkeypatch, tmp_path):
+    pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    r = importlib.import_module("carlos.retrieve")
+    monkeypatch.setattr(r, "MODEL_REGISTRY", ModelRegistry())
+
+    start = time.perf_counter()
+    with pytest.raises(RuntimeError, match="offline"):
+        r._load_clip_model(models_cache_dir=tmp_path, device="cpu", local_files_only=True)
+    assert time.perf_counter() - start < 10
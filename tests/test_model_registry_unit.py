@@ -0,0 +1,130 @@
+import threading
+import time
+
+import pytest
+
+from carlos.config import RetrievalConfig
+from carlos.model_registry import ModelRegistry, estimate_nbytes
+
+
+class _Tensor:
+    def __init__(self, nbytes):
+        self.nbytes = nbytes
+
+    def numel(self):
+        return self.nbytes
+
+    def element_size(self):
+        return 1
+
+
+class _Model:
+    def __init__(self, nbytes):
+        self._state = {"weight": _Tensor(nbytes), "packed": (_Tensor(1), None)}
+
+    def state_dict(self):
+        return self._state
+
+
+def test_concurrent_first_calls_load_once():
+    registry = ModelRegistry()
+    started, go = threading.Event(), threading.Event()
+
+    def load():
+        started.set()
+        go.wait(5)
+        return _Model(10)
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(registry.get("clip", load))) for _ in range(8)]
+    threads[0].start()
+    started.wait(5)
+    for t in threads[1:]:
+        t.start()
+    deadline = time.monotonic() + 5
+    while registry.stats()["waits"] < 7 and time.monotonic() < deadline:
+        time.sleep(0.001)
+    go.set()
+    for t in threads:
+        t.join()
+
+    assert len(results) == 8 and all(r is results[0] for r in results)
+    stats = registry.stats()
+    assert (stats["loads"], stats["waits"], stats["entries"], stats["bytes"]) == (1, 7, 1, 11)
+    registry.get("clip", load)
+    assert registry.stats()["hits"] == 1
+
+
+def test_failed_load_is_retried_by_the_next_caller():
+    registry = ModelRegistry()
+
+    def broken():
+        raise OSError("no network")
+
+    with pytest.raises(OSError):
+        registry.get("clip", broken)
+    assert registry.get("clip", lambda: "model") == "model"
+    assert registry.stats()["failures"] == 1 and registry.stats()["loads"] == 1
+
+
+def test_lru_eviction_respects_budget_and_leases():
+    registry = ModelRegistry(memory_budget_bytes=250)
+    registry.get("a", lambda: _Model(99))
+    registry.get("b", lambda: _Model(99))
+    registry.get("a", lambda: _Model(99))  # a is now most recently used
+    registry.get("c", lambda: _Model(99))  # evicts b
+    assert registry.stats()["evictions"] == 1
+
+    loads = []
+    with registry.lease("a", lambda: loads.append("a") or _Model(99)) as model:
+        assert loads == []  # still cached
+        registry.get("d", lambda: _Model(99))  # a is pinned: c goes instead
+        registry.get("e", lambda: _Model(99))  # and then d
+        assert registry.stats()["in_use"] == 1
+        assert registry.get("a", lambda: loads.append("a")) is model
+    assert loads == []
+    assert registry.stats()["evictions"] == 3
+
+    registry.set_memory_budget(100)  # only the newest entry stays
+    assert registry.stats()["entries"] == 1
+
+    with pytest.raises(KeyError):
+        registry.release("a")
+
+
+def test_derived_bytes_count_against_the_budget():
+    registry = ModelRegistry(memory_budget_bytes=250)
+    a = registry.get("a", lambda: (_Model(99), "tokenizer"))[0]
+    registry.get("b", lambda: _Model(99))
+    registry.add_nbytes("b", 50, owner=a)  # not b's model: ignored
+    registry.add_nbytes("missing", 50)
+    assert registry.stats()["bytes"] == 200
+
+    registry.add_nbytes("a", 50, owner=a)
+    assert registry.stats()["bytes"] == 250
+    registry.add_nbytes("a", 1, owner=a)  # over budget: a is the least recently used
+    assert registry.stats()["evictions"] == 1 and registry.stats()["bytes"] == 100
+
+
+def test_estimate_nbytes():
+    assert estimate_nbytes((_Model(10), object())) == 11
+    torch = pytest.importorskip("torch")
+    assert estimate_nbytes(torch.nn.Linear(4, 2)) == (8 + 2) * 4
+
+
+def test_retrieval_pins_the_text_encoder_while_encoding(monkeypatch, fake_clip, tiny_clip, word_tokenizer):
+    r = fake_clip(tiny_clip(text_only=True), word_tokenizer, prompts=["oil painting", "a cat"])
+    encode = r._get_text_embeddings
+    in_use = []
+
+    def spy(*args, **kwargs):
+        in_use.append(r.MODEL_REGISTRY.stats()["in_use"])
+        return encode(*args, **kwargs)
+
+    monkeypatch.setattr(r, "_get_text_embeddings", spy)
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=None, query_cache_size=0, reuse_prompt_prefix=False)
+    r._embed_query_stub("watercolor", cfg=cfg)
+    r._embed_queries(["pixel art", "snow"], cfg=cfg, batch_size=64)
+    r._query_text_embeddings(["pixel art"], cfg=cfg)
+    assert in_use and set(in_use) == {1}
+    assert r.MODEL_REGISTRY.stats()["in_use"] == 0
@@ -0,0 +1,120 @@
+import gc
+import importlib
+
+import pytest
+
+torch = pytest.importorskip("torch")
+transformers = pytest.importorskip("transformers")
+
+from carlos.config import RetrievalConfig  # noqa: E402
+from carlos.model_registry import ModelRegistry  # noqa: E402
+from carlos.prefix_encoder import PrefixKVTextEncoder, encode_queries, prefix_encoder_from_prompts  # noqa: E402
+
+
+def _full_features(model, sequences):
+    width = max(len(s) for s in sequences)
+    ids = torch.zeros(len(sequences), width, dtype=torch.long)
+    mask = torch.zeros_like(ids)
+    for i, s in enumerate(sequences):
+        ids[i, : len(s)] = torch.tensor(s)
+        mask[i, : len(s)] = 1
+    with torch.no_grad():
+        return model(input_ids=ids, attention_mask=mask).text_embeds
+
+
+@pytest.mark.parametrize("suffix", [[], [40], [40, 41, 42], list(range(20, 40))])
+def test_suffix_encoding_matches_full_forward(suffix, tiny_clip, clip_text_config):
+    model = tiny_clip(text_only=True)
+    bos, eos, max_len = (clip_text_config[k] for k in ("bos_token_id", "eos_token_id", "max_position_embeddings"))
+    prefixes = [[bos, 5, 6, 7], [bos, 10], [bos] + list(range(1, 20))]  # the last one is truncated
+
+    encoder = PrefixKVTextEncoder(model, prefixes, eos_token_id=eos)
+    want = _full_features(model, [(p + suffix)[: max_len - 1] + [eos] for p in prefixes])
+    got = encoder.encode_suffix(suffix)
+    assert got.shape == want.shape
+    assert torch.allclose(got, want, atol=1e-5)
+
+
+def test_batched_suffixes_match_one_at_a_time(tiny_clip, clip_text_config):
+    model = tiny_clip(text_only=True)
+    bos, eos = clip_text_config["bos_token_id"], clip_text_config["eos_token_id"]
+    encoder = PrefixKVTextEncoder(model, [[bos, 5, 6, 7], [bos, 10], [bos] + list(range(1, 14))], eos_token_id=eos)
+    suffixes = [[40], [], list(range(20, 30)), [41, 42]]
+    want = torch.cat([encoder.encode_suffix(s) for s in suffixes])
+    assert torch.allclose(encoder.encode_suffixes(suffixes), want, atol=1e-5)
+
+
+def test_query_representation_is_unchanged_by_prefix_reuse(fake_clip, tiny_clip, word_tokenizer):
+    prompts = ["a portrait of a woman", "oil painting", "a cat on a sofa in warm light with long shadows"]
+    r = fake_clip(tiny_clip(), word_tokenizer, prompts=prompts)
+
+    base = RetrievalConfig(device="cpu", embeddings_cache_dir=None, query_cache_size=0)
+    for query in ("watercolor", "snowfall cold winter scene visible breath and more words here"):
+        full = r._embed_query_stub(query, cfg=base.with_overrides(reuse_prompt_prefix=False))
+        reused = r._embed_query_stub(query, cfg=base)
+        assert torch.allclose(full, reused, atol=1e-5)
+    assert len(r._PREFIX_ENCODERS) == 1
+
+    many = r._embed_queries(["watercolor", "pixel art"], cfg=base, batch_size=64)
+    assert torch.allclose(torch.from_numpy(many[0]), r._embed_query_stub("watercolor", cfg=base), atol=1e-5)
+
+
+def test_prefix_encoders_are_bounded_charged_and_dropped_with_the_model(monkeypatch, fake_clip, tiny_clip, word_tokenizer):
+    r = fake_clip(loader=lambda **kwargs: (tiny_clip(text_only=True), word_tokenizer))
+    monkeypatch.setattr(r, "_PREFIX_ENCODERS_PER_MODEL", 2)
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=None, query_cache_size=0)
+    model, tokenizer = r._clip_for(cfg)
+    model_bytes = r.MODEL_REGISTRY.stats()["bytes"]
+
+    prompt_sets = [["oil painting"], ["a cat", "a dog"], ["pixel art"]]
+    encoders = [r._prefix_encoder(p, model, tokenizer, device="cpu", registry_key=r._clip_key(cfg)) for p in prompt_sets]
+    assert list(r._PREFIX_ENCODERS[model].values()) == encoders[1:]  # least recently used dropped
+    assert r.MODEL_REGISTRY.stats()["bytes"] == model_bytes + encoders[1].nbytes + encoders[2].nbytes > model_bytes
+
+    del model, tokenizer, encoders
+    r.MODEL_REGISTRY.clear()  # as an eviction would
+    gc.collect()
+    assert len(r._PREFIX_ENCODERS) == 0
+
+
+def test_retrieval_loads_only_the_text_tower(monkeypatch, tiny_clip, tiny_clip_dir):
+    r = importlib.import_module("carlos.retrieve")
+    full = tiny_clip()
+
+    monkeypatch.setattr(r, "_CLIP_MODEL_NAME", str(tiny_clip_dir))
+    monkeypatch.setattr(r, "MODEL_REGISTRY", ModelRegistry())
+    model, tokenizer = r._load_clip_model(device="cpu", max_retries=1)
+    assert not hasattr(model, "vision_model")
+    assert not any(k.startswith("vision") for k in model.state_dict())
+
+    texts = ["a cat", "oil painting of a dog"]
+    inputs = tokenizer(text=texts, return_tensors="pt", padding=True, truncation=True)
+    with torch.no_grad():
+        want = full.get_text_features(**inputs)
+    want = want if isinstance(want, torch.Tensor) else want.pooler_output
+    assert torch.allclose(r._get_text_embeddings(texts, model, tokenizer, device="cpu"), want, atol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "prompt, query",
+    [("oil painting", "cat"), ("a cat, art", "oil  art!"), ("art", "CAT oil, cat"), ("portrait of a cat", " art ")],
+)
+def test_clip_tokenizer_splits_suffixed_prompts_at_the_space(tiny_clip_dir, prompt, query):
+    tokenizer = transformers.AutoTokenizer.from_pretrained(tiny_clip_dir)
+    assert type(tokenizer).__name__.startswith("CLIPTokenizer")
+
+    def ids(text, **kwargs):
+        return tokenizer(text, **kwargs)["input_ids"]
+
+    assert ids(prompt + " " + query, add_special_tokens=False) == ids(prompt, add_special_tokens=False) + ids(
+        query, add_special_tokens=False
+    )
+    # The split prefix_encoder_from_prompts / encode_queries rely on.
+    assert ids(prompt + " " + query) == ids(prompt)[:-1] + ids(query, add_special_tokens=False) + [tokenizer.eos_token_id]
+
+    model = transformers.CLIPTextModelWithProjection.from_pretrained(tiny_clip_dir).eval()
+    encoder = prefix_encoder_from_prompts(model, tokenizer, [prompt])
+    inputs = tokenizer([prompt + " " + query], return_tensors="pt", truncation=True)
+    with torch.no_grad():
+        want = model(**inputs).text_embeds
+    assert torch.allclose(encode_queries(encoder, tokenizer, [query]), want, atol=1e-5)
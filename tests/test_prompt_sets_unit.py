@@ -0,0 +1,86 @@
+import importlib
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from carlos.config import RetrievalConfig
+from carlos.prompt_sets import PromptSet, find_prompt_set, greedy_prompt_subset, subset_fidelity
+
+
+def _diffs(q=30, n=40, d=16, seed=0):
+    # Prompts share a per-query signal with prompt-specific noise; prompts 0-4 are pure noise.
+    rng = np.random.default_rng(seed)
+    signal = rng.normal(size=(q, 1, d))
+    diffs = signal + 0.3 * rng.normal(size=(q, n, d))
+    diffs[:, :5] = 3.0 * rng.normal(size=(q, 5, d))
+    return diffs.astype(np.float32)
+
+
+def test_greedy_subset_preserves_the_average(random_db):
+    diffs = _diffs()
+    order = greedy_prompt_subset(diffs, 8)
+    assert len(set(order.tolist())) == 8
+    assert not set(order.tolist()) & set(range(5))  # noisy prompts are not representative
+
+    db = random_db(n=200, seed=1)
+    greedy = subset_fidelity(db.vector_matrix(), diffs, order, k=10)
+    first = subset_fidelity(db.vector_matrix(), diffs, range(8), k=10)  # includes the noisy prompts
+    assert greedy["cosine_mean"] > first["cosine_mean"]
+    assert greedy["recall@10"] >= first["recall@10"]
+    assert greedy["relative_cost"] == pytest.approx(8 / 40)
+
+
+def test_prompt_set_round_trip(tmp_path):
+    ps = PromptSet(name="fast", prompts=("a", "b"), meta={"report": {"recall@10": 0.9}})
+    loaded = PromptSet.load(ps.save(tmp_path))
+    assert loaded == PromptSet(name="fast", prompts=("a", "b"), meta={"report": {"recall@10": 0.9}})
+
+
+@pytest.mark.parametrize("name", ["../escape", "a/b", "a\\b", "..", ".hidden", "", "/abs"])
+def test_prompt_set_names_cannot_leave_the_directory(tmp_path, name):
+    with pytest.raises(ValueError, match="Invalid prompt set name"):
+        PromptSet(name=name, prompts=("a",)).save(tmp_path / "sets")
+    with pytest.raises(ValueError, match="Invalid prompt set name"):
+        find_prompt_set(name, [tmp_path / "sets"])
+    assert not (tmp_path / "sets").exists()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_build_prompt_set_and_use_it(monkeypatch, tmp_path, random_db, fake_clip):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    prompts = [f"prompt {i}" for i in range(40)]
+    table = _diffs(q=1, n=40, d=16)[0]  # per-prompt offset, shared by all queries
+
+    def fake_suffixed(queries, prompts_, model, processor, *, device, cfg):
+        rows = []
+        for q in queries:
+            signal = np.random.default_rng(abs(hash(q)) % 2**32).normal(size=16)
+            rows += [signal + table[prompts.index(p)] for p in prompts_]
+        return torch.tensor(np.asarray(rows, dtype=np.float32))
+
+    fake_clip(SimpleNamespace(to=lambda device: None), prompts=prompts)
+    monkeypatch.setattr(r, "_baseline_embeddings", lambda prompts_, *a, **k: torch.zeros(len(prompts_), 16))
+    monkeypatch.setattr(r, "_suffixed_embeddings", fake_suffixed)
+    monkeypatch.setattr(r, "_PROMPT_SETS", {})
+
+    db = random_db(n=99)
+    cfg = RetrievalConfig(device="cpu", prompt_sets_dir=tmp_path)
+    queries = [f"query {i}" for i in range(50)]
+
+    ps, report = r.build_prompt_set(db, queries, name="small", size=6, cfg=cfg)
+    assert len(ps.prompts) == 6 and (tmp_path / "small.json").exists()
+    assert report["prompts"] == 6.0 and report["relative_cost"] == pytest.approx(6 / 40)
+    assert ps.meta["held_out_queries"] == 10
+
+    assert r._retrieval_prompts(cfg.with_overrides(prompt_set="small")) == list(ps.prompts)
+    assert r._retrieval_prompts(cfg) == prompts
+    with pytest.raises(KeyError):
+        r._retrieval_prompts(cfg.with_overrides(prompt_set="missing"))
+
+    by_recall, _ = r.build_prompt_set(db, queries, name="auto", target_recall=0.5, cfg=cfg, save=False)
+    assert 1 <= len(by_recall.prompts) <= 40
+    with pytest.raises(ValueError):
+        r.build_prompt_set(db, queries, name="x", cfg=cfg)
@@ -0,0 +1,100 @@
+import importlib
+
+import numpy as np
+import pytest
+
+from carlos.bundled_db import load_bundled_database
+from carlos.database import load_database, quantized_codes_path
+from carlos.quantize import QUANTIZATION_KINDS, quantize_directions, recall_report
+from carlos.vector_search import retrieve_by_vector
+
+
+@pytest.mark.parametrize("kind", QUANTIZATION_KINDS)
+def test_codecs_approximate_cosine(kind, random_db):
+    m = random_db(n=300).vector_matrix()
+    codec = quantize_directions(m, kind, pq_subspaces=8)
+
+    q = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    q /= np.linalg.norm(q)
+    positions = np.arange(len(m))
+    exact = m.normalized @ q
+    approx = codec.scores(q, positions)
+    tol = {"float16": 1e-3, "int8": 2e-2, "pq": 0.35}[kind]
+    assert np.abs(approx - exact).max() < tol
+    assert codec.nbytes < m.directions.nbytes
+
+
+def test_recall_report_on_bundled_database():
+    report = recall_report(load_bundled_database().vector_matrix(), k=10, rerank=100, num_queries=50)
+    assert report["float16"]["recall@10"] >= 0.99
+    assert report["int8"]["recall@10"] >= 0.95
+    for kind in QUANTIZATION_KINDS:
+        assert report[kind]["recall@10_rerank100"] >= 0.99
+
+
+@pytest.mark.parametrize("kind", QUANTIZATION_KINDS)
+def test_upserts_reencode_only_the_changed_rows(kind, random_db, make_row):
+    db = random_db(n=300, dim=16)
+    codec = db.quantized_directions(kind)
+    codebooks = getattr(codec, "codebooks", None)
+    assert db.quantized_directions(kind) is codec
+
+    db.upsert_row(make_row(5, np.ones(16)))
+    db.upsert_many([make_row(v, np.arange(16) - v) for v in (301, 302)])
+    assert db.quantized_directions(kind) is codec  # updated in place, not rebuilt
+    assert codec.codes.shape[0] == 302
+    if codebooks is not None:
+        assert codec.codebooks is codebooks  # encoded with the trained codebooks
+    else:
+        fresh = quantize_directions(db.vector_matrix(), kind)
+        assert np.array_equal(codec.codes, fresh.codes)
+
+
+def test_codecs_persist_next_to_the_database(tmp_path, monkeypatch, random_db, make_row):
+    import carlos.database as database
+
+    p = tmp_path / "db.parquet"
+    db = random_db(n=300, dim=16)
+    codec = db.quantized_directions("pq")
+    db.save_parquet(p, direction_storage="npy")
+    assert quantized_codes_path(p, "pq").exists()
+    assert not quantized_codes_path(p, "int8").exists()
+
+    monkeypatch.setattr(database, "quantize_directions", lambda *a, **k: pytest.fail("codec retrained"))
+    loaded = load_database(p).quantized_directions("pq")
+    assert np.array_equal(loaded.codebooks, codec.codebooks)
+    assert np.array_equal(loaded.codes, codec.codes)
+
+    # Checkpointed upserts are re-encoded on load; the exact rerank never builds the
+    # normalized copy of the (memory-mapped) matrix.
+    db = load_database(p)
+    db.upsert_row(make_row(301, np.ones(16)))
+    db.checkpoint()
+    db = load_database(p)
+    assert db.quantized_directions("pq").codes.shape[0] == 301
+    got = retrieve_by_vector(db, np.ones(16), top_k=1, min_consistency=0.0, quantization="pq", rerank=20)
+    assert got[0].lora_id == "301"
+    assert db.vector_matrix()._normalized is None
+
+    # Codes written for an earlier version of the base file are ignored.
+    codes = quantized_codes_path(p, "pq")
+    stale = codes.read_bytes()
+    db.save_parquet()
+    codes.write_bytes(stale)
+    with pytest.raises(pytest.fail.Exception, match="retrained"):
+        load_database(p).quantized_directions("pq")
+
+
+def test_retrieve_with_quantization_reranks_exactly(monkeypatch, random_db):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    db = random_db(n=199, dim=32, seed=1)
+    q = torch.tensor(np.random.default_rng(2).normal(size=32).astype(np.float32))
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: q)
+
+    exact = r.retrieve(db, "x", top_k=5, min_consistency=0.0)
+    for kind in ("float16", "int8"):
+        got = r.retrieve(db, "x", top_k=5, min_consistency=0.0, quantization=kind, rerank=50)
+        assert [x.version_id for x in got] == [x.version_id for x in exact]
+        assert [x.score for x in got] == pytest.approx([x.score for x in exact])
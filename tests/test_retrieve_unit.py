@@ -1,8 +1,12 @@
 import importlib
+import zlib
+from collections.abc import Mapping
+from types import SimpleNamespace
 import pytest
 import pandas as pd
 import numpy as np
 
+from carlos.config import RetrievalConfig
 from carlos.database import DEFAULT_REQUIRED_COLUMNS, PandasCarlosDatabase
 
 
@@ -42,8 +46,8 @@ def test_retrieve_filters_and_ranks_with_stubs(monkeypatch):
     monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: torch.tensor([1.0, 0.0, 0.0]))
     monkeypatch.setattr(
         r,
-        "_score_stub",
-        lambda query_repr, vec, row: float(np.dot(vec.direction, query_repr.numpy())),
+        "_score_matrix",
+        lambda query_repr, matrix, positions: matrix.directions[positions] @ query_repr.numpy(),
     )
 
     out = r.retrieve(
@@ -71,4 +75,130 @@ def test_retrieve_validates_inputs():
         r.retrieve(db, "", top_k=5)
 
     with pytest.raises(ValueError):
-        r.retrieve(db, "ok", top_k=0)
\ No newline at end of file
+        r.retrieve(db, "ok", top_k=0)
+
+def _score_per_row(query_repr, direction):
+    # The legacy per-row scorer `_score_matrix` replaced: cosine via torch, eps=1e-8.
+    import torch
+
+    return float(torch.cosine_similarity(torch.tensor(direction), query_repr, dim=0).item())
+
+
+def test_score_matrix_matches_per_row_scoring():
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        [_row(i, rng.normal(size=8), strength=1.0, consistency=0.5) for i in range(1, 40)]
+        + [_row(40, np.zeros(8), strength=1.0, consistency=0.5)],
+        columns=list(DEFAULT_REQUIRED_COLUMNS),
+    )
+    db = PandasCarlosDatabase(df=df)
+    matrix = db.vector_matrix()
+    positions = np.arange(len(matrix))
+    q = torch.tensor(rng.normal(size=8).astype(np.float32))
+
+    got = r._score_matrix(q, matrix, positions)
+    want = [_score_per_row(q, matrix.vector(i).direction) for i in positions]
+    assert np.allclose(got, want, atol=1e-6)
+
+
+def test_retrieve_ties_break_on_version_id(monkeypatch):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    df = pd.DataFrame(
+        [_row(v, [1, 0, 0], strength=1.0, consistency=0.9) for v in (30, 4, 200)]
+        + [_row(5, [0, 1, 0], strength=1.0, consistency=0.9)],
+        columns=list(DEFAULT_REQUIRED_COLUMNS),
+    )
+    db = PandasCarlosDatabase(df=df)
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: torch.tensor([1.0, 0.0, 0.0]))
+
+    out = r.retrieve(db, "whatever", top_k=3)
+    # equal scores are ordered by str(version_id), as before vectorization
+    assert [x.version_id for x in out] == ["200", "30", "4"]
+    assert out[0].vector is not None and np.allclose(out[0].vector.direction, [1, 0, 0])
+
+
+def test_top_k_matches_full_sort_with_ties():
+    from carlos.vector_search import _top_k
+
+    rng = np.random.default_rng(0)
+    scores = rng.integers(0, 20, size=500).astype(np.float32) / 4  # many ties
+    keys = rng.permutation(10_000)[:500]
+    full = np.lexsort((np.asarray([str(k) for k in keys]), -scores))
+    for k in (1, 7, 50, 500, 600):
+        np.testing.assert_array_equal(_top_k(scores, keys, k), full[:k])
+
+
+def test_retrieve_rows_are_read_only_snapshots(monkeypatch):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    df = pd.DataFrame(
+        [_row(v, [1, 0, 0], strength=1.0, consistency=0.9) for v in (1, 2)],
+        columns=list(DEFAULT_REQUIRED_COLUMNS),
+    )
+    db = PandasCarlosDatabase(df=df)
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: torch.tensor([1.0, 0.0, 0.0]))
+
+    out = r.retrieve(db, "whatever", top_k=1)
+    row = out[0].row
+    assert isinstance(row, Mapping) and not isinstance(row, dict)
+    expected = db.rows_at([0])[0]
+    assert {k: v for k, v in row.items() if k != "direction"} == {k: v for k, v in expected.items() if k != "direction"}
+    assert type(row["version_id"]) is int
+    with pytest.raises(TypeError):
+        row["model_name"] = "changed"  # type: ignore[index]
+
+    db.upsert_row({**db.rows_at([0])[0], "model_name": "Renamed"})
+    assert row["model_name"] != "Renamed"
+    assert r.retrieve(db, "whatever", top_k=1)[0].row["model_name"] == "Renamed"
+
+
+def test_retrieve_many_matches_single_queries(monkeypatch, fake_clip):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    class FakeModel:
+        config = SimpleNamespace(_name_or_path="fake-clip", _commit_hash="0")
+
+        def to(self, device):
+            return self
+
+    batches = []
+
+    def fake_embeddings(texts, model, processor, device):
+        batches.append(len(texts))
+        return torch.stack(
+            [torch.tensor(np.random.default_rng(zlib.crc32(t.encode())).normal(size=8), dtype=torch.float32) for t in texts]
+        )
+
+    fake_clip(FakeModel(), prompts=[f"prompt {i}" for i in range(10)])
+    monkeypatch.setattr(r, "_get_text_embeddings", fake_embeddings)
+
+    rng = np.random.default_rng(0)
+    df = pd.DataFrame(
+        [_row(v, rng.normal(size=8), strength=1.0, consistency=0.9) for v in range(1, 60)],
+        columns=list(DEFAULT_REQUIRED_COLUMNS),
+    )
+    db = PandasCarlosDatabase(df=df)
+    queries = ["anime style", "watercolor", "Anime Style", "pixel art", "snow"]
+
+    cfg = RetrievalConfig(device="cpu", embeddings_cache_dir=None)
+    many = r.retrieve_many(db, queries, top_k=4, cfg=cfg, batch_size=25)
+    # baseline once, then 4 distinct queries two per batch (25 texts // 10 prompts)
+    assert batches == [10, 20, 20]
+
+    monkeypatch.setattr(r, "_QUERY_CACHES", {})
+    for q, got in zip(queries, many):
+        want = r.retrieve(db, q, top_k=4, cfg=cfg)
+        assert [x.version_id for x in got] == [x.version_id for x in want]
+        assert [x.score for x in got] == pytest.approx([x.score for x in want], abs=1e-5)
+        assert [x.rank for x in got] == [1, 2, 3, 4]
+
+    assert r.retrieve_many(db, [], cfg=cfg) == []
+    with pytest.raises(ValueError):
+        r.retrieve_many(db, ["ok", " "], cfg=cfg)
@@ -0,0 +1,134 @@
+import asyncio
+import json
+import subprocess
+import sys
+import threading
+
+import numpy as np
+import pytest
+
+from carlos.filters import col
+from carlos.serve import FakeQueryEncoder, RetrievalService
+from carlos.vector_search import retrieve_by_vector
+
+
+@pytest.fixture
+def db(random_db):
+    return random_db(n=60, dim=8, model_nsfw_level=lambda i: i % 3)
+
+
+async def _request(port, method, path, payload=None, raw=None):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    body = raw if raw is not None else (b"" if payload is None else json.dumps(payload).encode())
+    head = f"{method} {path} HTTP/1.1\r\nHost: x\r\nContent-Length: {len(body)}\r\nConnection: close\r\n\r\n"
+    writer.write(head.encode() + body)
+    await writer.drain()
+    data = await reader.read()
+    writer.close()
+    head, _, body = data.partition(b"\r\n\r\n")
+    lines = head.decode().split("\r\n")
+    headers = dict(line.split(": ", 1) for line in lines[1:])
+    return int(lines[0].split()[1]), headers, json.loads(body)
+
+
+def _with_service(service, scenario):
+    async def main():
+        _, port = await service.start(port=0)
+        try:
+            return await scenario(port)
+        finally:
+            await service.stop()
+
+    return asyncio.run(main())
+
+
+def test_retrieve_matches_retrieve_by_vector(db):
+    encoder = FakeQueryEncoder(8)
+    service = RetrievalService(db, encoder)
+
+    async def scenario(port):
+        health = await _request(port, "GET", "/health")
+        one = await _request(port, "POST", "/retrieve", {
+            "query": "oil painting", "top_k": 4, "min_consistency": 0.0,
+            "where": [["model_nsfw_level", "<=", 1], ["model_name", "in", ["M"]]],
+        })
+        many = await _request(port, "POST", "/retrieve_batch", {"queries": ["oil painting", "a cat"], "top_k": 3})
+        return health, one, many
+
+    health, one, many = _with_service(service, scenario)
+    assert len(db._filter_masks) == 0  # request filters are not cached
+    assert health[0] == 200 and health[2]["status"] == "ok" and health[2]["rows"] == 60
+
+    status, _, payload = one
+    expected = retrieve_by_vector(
+        db, encoder.encode(["oil painting"])[0], top_k=4, min_consistency=0.0, where=col("model_nsfw_level") <= 1
+    )
+    assert status == 200
+    assert [r["lora_id"] for r in payload["results"]] == [r.lora_id for r in expected]
+    assert [r["rank"] for r in payload["results"]] == [1, 2, 3, 4]
+    assert np.allclose([r["score"] for r in payload["results"]], [r.score for r in expected], atol=1e-6)
+    assert "direction" not in payload["results"][0]["row"]
+    assert all(r["row"]["model_nsfw_level"] <= 1 for r in payload["results"])
+
+    status, _, payload = many
+    assert status == 200 and [len(rs) for rs in payload["results"]] == [3, 3]
+    assert payload["results"][0][0]["lora_id"] == expected[0].lora_id
+
+
+def test_client_errors(db):
+    service = RetrievalService(db, FakeQueryEncoder(8))
+
+    async def scenario(port):
+        return [
+            await _request(port, "POST", "/retrieve", raw=b"{not json"),
+            await _request(port, "POST", "/retrieve", {"top_k": 3}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["model_nsfw_level", "~", 1]]}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["no_such_column", "==", 1]]}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["model_nsfw_level", ">=", 0]] * 17}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["model_name", "==", "M" * 300]]}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["model_name", "in", ["M"] * 300]]}),
+            await _request(port, "POST", "/retrieve", {"query": "x", "where": [["model_name", "==", {"a": 1}]]}),
+            await _request(port, "POST", "/retrieve_batch", {"queries": ["x"] * 300}),
+            await _request(port, "GET", "/retrieve"),
+            await _request(port, "GET", "/nope"),
+        ]
+
+    statuses = [status for status, _, _ in _with_service(service, scenario)]
+    assert statuses == [400, 400, 400, 400, 400, 400, 400, 400, 400, 405, 404]
+
+
+class _BlockingEncoder(FakeQueryEncoder):
+    def __init__(self, dim):
+        super().__init__(dim)
+        self.release = threading.Event()
+        self.warm = False
+
+    def encode(self, queries):
+        if self.warm:
+            self.release.wait(10)
+        self.warm = True
+        return super().encode(queries)
+
+
+def test_overload_returns_503_and_slow_requests_504(db):
+    encoder = _BlockingEncoder(8)
+    service = RetrievalService(db, encoder, workers=1, max_pending=1, timeout_s=0.3)
+
+    async def scenario(port):
+        slow = asyncio.ensure_future(_request(port, "POST", "/retrieve", {"query": "a"}))
+        while service.in_flight == 0:
+            await asyncio.sleep(0.01)
+        rejected = await _request(port, "POST", "/retrieve", {"query": "b"})
+        timed_out = await slow
+        encoder.release.set()
+        return rejected, timed_out
+
+    rejected, timed_out = _with_service(service, scenario)
+    assert rejected[0] == 503 and rejected[1]["Retry-After"] == "1"
+    assert timed_out[0] == 504
+
+
+def test_serve_does_not_import_torch():
+    code = "import sys, carlos.serve, carlos.__main__; print('torch' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True)
+    assert out.stdout.strip() == "False"
@@ -0,0 +1,37 @@
+import pandas as pd
+import pytest
+
+torch = pytest.importorskip("torch")
+pytest.importorskip("transformers")
+
+import carlos  # noqa: E402
+from carlos.config import RetrievalConfig  # noqa: E402
+from carlos.database import PandasCarlosDatabase  # noqa: E402
+
+
+def test_warmup_fills_the_caches_retrieve_uses(monkeypatch, fake_clip, tiny_clip, word_tokenizer, random_db):
+    r = fake_clip(tiny_clip(text_only=True), word_tokenizer, prompts=["a portrait of a woman", "oil painting", "a cat"])
+    baseline = r._BASELINE_CACHE
+    db = random_db(n=29, dim=8)
+    cfg = RetrievalConfig(device="cuda", embeddings_cache_dir=None, query_cache_size=0)
+
+    report = carlos.warmup(db, cfg, query="a cat")
+
+    assert list(report.stages) == ["import", "model_load", "baseline", "prefix_encoder", "db_matrix", "first_query"]
+    assert all(s >= 0 for s in report.stages.values())
+    assert report.total_s == pytest.approx(sum(report.stages.values()))
+    assert report.device == ("cuda" if torch.cuda.is_available() else "cpu")
+    assert len(baseline._memory) == 1 and len(r._PREFIX_ENCODERS) == 1
+    assert "first_query" in report.format() and "total" in report.format()
+
+    # Warm caches: the first real request rebuilds nothing.
+    monkeypatch.setattr(r, "prefix_encoder_from_prompts", lambda *a, **k: pytest.fail("prefix encoder rebuilt"))
+    monkeypatch.setattr(r, "_get_text_embeddings", lambda *a, **k: pytest.fail("baseline re-embedded"))
+    r.retrieve(db, "oil painting", cfg=cfg, min_consistency=0.0)
+    assert len(baseline._memory) == 1 and len(r._PREFIX_ENCODERS) == 1
+
+
+def test_warmup_rejects_unknown_query_mode():
+    db = PandasCarlosDatabase(df=pd.DataFrame([]))
+    with pytest.raises(ValueError, match="query_mode"):
+        carlos.warmup(db, RetrievalConfig(device="cpu"), query_mode="bogus")
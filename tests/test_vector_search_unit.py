@@ -0,0 +1,48 @@
+import importlib
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+import carlos
+from carlos.filters import col
+
+
+def test_vector_retrieval_does_not_import_torch():
+    code = (
+        "import sys, numpy as np, carlos\n"
+        "db = carlos.load_bundled_database()\n"
+        "q = db.vector_matrix().directions[0]\n"
+        "assert len(carlos.retrieve_by_vector(db, q, top_k=3)) == 3\n"
+        "assert 'torch' not in sys.modules and 'transformers' not in sys.modules, sorted(sys.modules)\n"
+    )
+    subprocess.run([sys.executable, "-c", code], check=True)
+
+
+def test_retrieve_by_vector_matches_text_retrieval(monkeypatch, random_db):
+    torch = pytest.importorskip("torch")
+    r = importlib.import_module("carlos.retrieve")
+
+    db = random_db(model_nsfw_level=lambda i: i % 3)
+    db.build_ann_index(nlist=8, persist=False)
+    q = np.random.default_rng(1).normal(size=16).astype(np.float32)
+    monkeypatch.setattr(r, "_embed_query_stub", lambda query, cfg: torch.from_numpy(q))
+
+    for kwargs in ({}, {"search": "ann", "nprobe": 2}, {"quantization": "int8", "rerank": 20}):
+        kwargs = dict(top_k=7, min_consistency=0.0, where=col("model_nsfw_level") <= 1, **kwargs)
+        want = r.retrieve(db, "x", **kwargs)
+        got = carlos.retrieve_by_vector(db, q, **kwargs)
+        assert [(x.version_id, x.rank) for x in got] == [(x.version_id, x.rank) for x in want]
+        np.testing.assert_allclose([x.score for x in got], [x.score for x in want], rtol=1e-6)
+
+
+def test_retrieve_by_vector_validates_inputs(random_db):
+    db = random_db(n=10)
+    with pytest.raises(ValueError):
+        carlos.retrieve_by_vector(db, np.ones(3), top_k=5)
+    with pytest.raises(ValueError):
+        carlos.retrieve_by_vector(db, np.ones(16), top_k=0)
+    with pytest.raises(ValueError):
+        carlos.retrieve_by_vector(db, np.ones(16), search="hnsw")
+    assert carlos.retrieve_by_vector(db, np.ones(16), max_strength=0.5) == []